@@ -5,6 +5,8 @@ Design goals:
 - Portable: rules + state live inside this repo.
 - Minimal noise: drop ack-only replies; monitoring: show only important domains, severity>=warning, and never show clears.
 - WhatsApp: if chat_title is empty, map from data/whatsapp_chats.txt (jid -> title) and cache in state.
+- Incremental: a byte cursor (data/cursors/update_chats.json) means each run only reads lines appended since the last one.
+  --jsonl may be a single file or a segments directory (see jsonl_store.py).
 
 Input JSONL format: records like those produced into /tmp/clawdbot_telegram.jsonl
 ("source" can be telegram/whatsapp; message_id may be non-numeric for WhatsApp).
@@ -15,16 +17,20 @@ from __future__ import annotations
 import argparse
 import json
 import re
-import sys
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any
 
-try:
-    import yaml  # type: ignore
-except Exception as e:
-    print(f"Missing dependency: pyyaml ({e})", file=sys.stderr)
-    raise
+from config_loader import load_yaml
+from jsonl_codec import Message, decode_message
+from jsonl_cursor import CURSOR_DIR, advance, iter_lines_from, load_cursor, resume_offset, save_cursor
+from jsonl_store import store_files
+
+CURSOR_NAME = "update_chats"
+# --profile stages. "keys" fills WhatsApp titles and compares per-chat
+# (date, message_id) keys; dates stay ISO strings, so parse_dt never runs.
+ANALYZE_STAGES = ("setup", "read", "decode", "keys", "rules", "state", "output")
+KNOWN_BOTS = {"e2tl_bot", "Business_group_mess_prod_bot", "something_bad_vc_bot"}
 
 
 @dataclass
@@ -41,11 +47,6 @@ class Rules:
     state_file: str
 
 
-def load_yaml(path: Path) -> dict[str, Any]:
-    with path.open("r", encoding="utf-8") as f:
-        return yaml.safe_load(f) or {}
-
-
 def resolve_relative(base: Path, value: str) -> Path:
     p = Path(value)
     return p if p.is_absolute() else (base / p)
@@ -110,43 +111,196 @@ def text_compact(s: str, n: int = 240) -> str:
     return s if len(s) <= n else (s[: n - 1] + "…")
 
 
-def is_monitoring_dump(text: str, rules: Rules) -> bool:
-    t = text or ""
-    for p in rules.monitoring_dump_prefixes:
-        if t.startswith(p):
-            return True
-    for sub in rules.monitoring_dump_substrings:
-        if sub in t:
-            return True
-    return False
+def _alternation(words: list[str], flags: int = 0) -> re.Pattern[str] | None:
+    """One regex that finds any of the literal `words` (None if there are none).
+
+    The words are folded into a prefix trie, so the regex engine sees one
+    branch per leading character instead of one per word. Only existence
+    matters here, so a word makes its longer extensions redundant.
+    """
+    if not words:
+        return None
+    root: dict[str, dict] = {}
+    for word in words:
+        node = root
+        for ch in word:
+            if "" in node:
+                break
+            node = node.setdefault(ch, {})
+        else:
+            node.clear()
+            node[""] = {}
+
+    def emit(node: dict[str, dict]) -> str:
+        if "" in node:
+            return ""
+        alts = [re.escape(ch) + emit(child) for ch, child in sorted(node.items())]
+        return alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+
+    return re.compile(emit(root), flags)
+
+
+def _required_literals(pattern: str, flags: int = 0) -> tuple[str, ...] | None:
+    """Casefolded strings of which every match of `pattern` contains at least one.
+
+    Used as a prefilter: `any(lit in text.casefold() ...)` is far cheaper than a
+    case-insensitive alternation and can only rule out texts the regex would not
+    match either. None when no such set can be derived (e.g. a branch that is
+    all character classes) or a literal does not fold the way `re.I` compares
+    it (see `_prefilter_safe`), in which case the regex always runs.
+    """
+    try:
+        from re import _parser as sre_parse  # Python 3.11+
+    except ImportError:  # pragma: no cover - older interpreters
+        import sre_parse  # type: ignore
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+
+    def of_seq(items) -> set[str] | None:
+        best: set[str] | None = None
+        run: list[str] = []
+
+        def offer(cands: set[str] | None) -> None:
+            nonlocal best
+            if cands and all(cands) and (best is None or min(map(len, cands)) > min(map(len, best))):
+                best = cands
+
+        for op, av in items:
+            name = str(op)
+            if name == "LITERAL":
+                run.append(chr(av))
+                continue
+            if name == "AT":
+                continue  # zero-width: the literals around it are still adjacent
+            offer({"".join(run)} if run else None)
+            run = []
+            if name == "SUBPATTERN":
+                offer(of_seq(av[-1]))
+            elif name == "BRANCH":
+                alts = [of_seq(alt) for alt in av[1]]
+                if all(alts):
+                    offer(set().union(*alts))
+            elif name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT") and av[0] >= 1:
+                offer(of_seq(av[2]))
+        offer({"".join(run)} if run else None)
+        return best
+
+    found = of_seq(parsed)
+    if not found or not all(_prefilter_safe(lit, lit.casefold()) for lit in found):
+        return None
+    return tuple(sorted({lit.casefold() for lit in found}))
+
+
+def _prefilter_safe(text: str, folded: str) -> bool:
+    """Whether `folded` (text.casefold()) compares characters the way `re.I` does.
+
+    `re.I` matches character by character on simple case folding. casefold()
+    agrees with it except where it turns one character into several ("İ" ->
+    "i̇", "ß" -> "ss") and for the dotless "ı", which `re.I` equates with "i".
+    """
+    return len(folded) == len(text) and "ı" not in folded
 
 
-def is_ack_noise(text: str, ack_res: list[re.Pattern[str]]) -> bool:
-    t = (text or "").strip()
-    return any(r.match(t) for r in ack_res)
+class _AnyMatch:
+    """Fallback for ack regexes that cannot be joined (e.g. inline global flags)."""
 
+    def __init__(self, patterns: list[re.Pattern[str]]):
+        self.patterns = patterns
 
-def is_clear(text: str, clear_re: re.Pattern[str] | None) -> bool:
-    return bool(clear_re and clear_re.search(text or ""))
+    def match(self, text: str) -> bool:
+        return any(r.match(text) for r in self.patterns)
 
 
-def is_severity(text: str, sev_re: re.Pattern[str] | None) -> bool:
-    return bool(sev_re and sev_re.search(text or ""))
+MONITORING = "monitoring"
+DISCUSSION = "discussion"
 
 
-def domain_match(text: str, kws_lower: list[str]) -> bool:
-    t = (text or "").lower()
-    return any(k in t for k in kws_lower)
+@dataclass
+class CompiledRules:
+    """All text rules compiled into one regex per rule group, built once per rules file."""
+
+    dump_prefixes: tuple[str, ...]
+    dump_re: re.Pattern[str] | None
+    ack_re: Any
+    clear_re: re.Pattern[str] | None
+    clear_literals: tuple[str, ...] | None
+    severity_re: re.Pattern[str] | None
+    severity_literals: tuple[str, ...] | None
+    domain_re: re.Pattern[str] | None
+    ignore_re: re.Pattern[str] | None
+
+    def classify(self, text: str, monitoring: bool = False) -> str | None:
+        """MONITORING or DISCUSSION for a message worth reporting, None to drop it.
+
+        `monitoring` forces the monitoring path (e.g. known bot senders). The
+        text is casefolded at most once.
+        """
+        if (self.dump_prefixes and text.startswith(self.dump_prefixes)) or (
+            self.dump_re is not None and self.dump_re.search(text)
+        ):
+            monitoring = True
+        if monitoring:
+            if not text:
+                return None
+            # All four checks must pass, so the cheap and selective ones run
+            # first; the user regexes only run once their literal prefilter hits.
+            folded = text.casefold()
+            if self.severity_re is None or not _search(self.severity_re, self.severity_literals, text, folded):
+                return None
+            if self.domain_re is None or not self.domain_re.search(folded):
+                return None
+            if self.ignore_re is not None and self.ignore_re.search(folded):
+                return None
+            if self.clear_re is not None and _search(self.clear_re, self.clear_literals, text, folded):
+                return None
+            return MONITORING
+        if text and self.ack_re is not None and self.ack_re.match(text.strip()):
+            return None
+        return DISCUSSION
+
+
+def _search(regex: re.Pattern[str], literals: tuple[str, ...] | None, text: str, folded: str) -> bool:
+    if literals is not None and _prefilter_safe(text, folded) and not any(lit in folded for lit in literals):
+        return False
+    return regex.search(text) is not None
+
+
+def compile_rules(rules: Rules) -> CompiledRules:
+    ack_re: Any = None
+    if rules.ack_noise_regexes:
+        try:
+            ack_re = re.compile("|".join(f"(?:{p})" for p in rules.ack_noise_regexes), re.I)
+        except re.error:
+            ack_re = _AnyMatch([re.compile(p, re.I) for p in rules.ack_noise_regexes])
+    clear, severity = rules.monitoring_clear_regex, rules.monitoring_severity_regex
+    return CompiledRules(
+        dump_prefixes=tuple(rules.monitoring_dump_prefixes),
+        dump_re=_alternation(rules.monitoring_dump_substrings),
+        ack_re=ack_re,
+        clear_re=re.compile(clear, re.I) if clear else None,
+        clear_literals=_required_literals(clear, re.I) if clear else None,
+        severity_re=re.compile(severity, re.I) if severity else None,
+        severity_literals=_required_literals(severity, re.I) if severity else None,
+        domain_re=_alternation([k.casefold() for k in rules.monitoring_domain_keywords]),
+        ignore_re=_alternation([s.casefold() for s in rules.monitoring_ignore_substrings]),
+    )
+
 
+def load_compiled_rules(path: Path) -> tuple[Rules, CompiledRules]:
+    """Parse and compile the rules file.
 
-def ignored_monitoring(text: str, rules: Rules) -> bool:
-    t = (text or "").lower()
-    return any(sub in t for sub in rules.monitoring_ignore_substrings)
+    The YAML parse is cached on disk by config_loader.load_yaml; compiling
+    takes a few milliseconds, once per run.
+    """
+    rules = load_rules(path)
+    return rules, compile_rules(rules)
 
 
-def key_of(msg: dict[str, Any]) -> tuple[str, str]:
+def key_of(msg: Message) -> tuple[str, str]:
     # Comparable across TG and WA; WA message_id can be hex.
-    return (msg.get("date") or "", str(msg.get("message_id") or ""))
+    return (msg.date or "", str(msg.message_id or ""))
 
 
 def main() -> int:
@@ -155,13 +309,31 @@ def main() -> int:
     ap.add_argument("--rules", default="config.update_chats_rules.yaml", help="Path to rules YAML")
     ap.add_argument("--print-empty", action="store_true", help="Print an explicit 'no new messages' line")
     ap.add_argument("--bootstrap", action="store_true", help="Mark all current messages as seen and exit")
+    ap.add_argument(
+        "--profile",
+        nargs="?",
+        const="-",
+        metavar="JSON",
+        help="Report per-stage wall/CPU time, records and bytes to stderr, or to this JSON file",
+    )
+    ap.add_argument("--cprofile", metavar="FILE", help="Dump cProfile stats of the run to FILE (python -m pstats FILE)")
     args = ap.parse_args()
+    if args.profile is None and args.cprofile is None:
+        return update_chats(args, None)
+    from stage_profile import cprofiled, profiled
+
+    return cprofiled(
+        args.cprofile,
+        lambda: profiled(args.profile, "analyze_update_chats.py", ANALYZE_STAGES, lambda profile: update_chats(args, profile)),
+    )
+
 
+def update_chats(args: argparse.Namespace, profile) -> int:
     repo = Path(__file__).resolve().parents[1]
     rules_path = Path(args.rules)
     if not rules_path.is_absolute():
         rules_path = repo / rules_path
-    rules = load_rules(rules_path)
+    rules, compiled = load_compiled_rules(rules_path)
 
     state_path = resolve_relative(repo, rules.state_file)
     wa_chats_path = resolve_relative(repo, rules.whatsapp_chats_file)
@@ -176,106 +348,127 @@ def main() -> int:
     state["wa_chat_map"].update(wa_map)
     wa_map = state["wa_chat_map"]
 
-    ack_res = [re.compile(p, re.I) for p in rules.ack_noise_regexes]
-    clear_re = re.compile(rules.monitoring_clear_regex, re.I) if rules.monitoring_clear_regex else None
-    sev_re = re.compile(rules.monitoring_severity_regex, re.I) if rules.monitoring_severity_regex else None
-    domain_kws_lower = [k.lower() for k in rules.monitoring_domain_keywords]
-
     jsonl_path = Path(args.jsonl).expanduser()
-    msgs: list[dict[str, Any]] = []
-    with jsonl_path.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                m = json.loads(line)
-            except Exception:
-                continue
-            # fill WA titles
-            if (m.get("source") or "").lower() == "whatsapp":
-                if not m.get("chat_title"):
-                    cid = str(m.get("chat_id") or "")
-                    if cid in wa_map:
-                        m["chat_title"] = wa_map[cid]
-            msgs.append(m)
-
-    # compute max key per chat for state updates
-    max_key_by_chat: dict[str, tuple[str, str]] = {}
-    for m in msgs:
-        cid = str(m.get("chat_id"))
-        k = key_of(m)
-        if cid not in max_key_by_chat or k > max_key_by_chat[cid]:
-            max_key_by_chat[cid] = k
-
-    def do_bootstrap(reason: str) -> int:
-        for cid, k in max_key_by_chat.items():
-            state["chat_last_key"][cid] = {"date": k[0], "message_id": k[1]}
-        save_state(state_path, state)
-        if args.print_empty:
-            print(f"Новых сообщений нет. ({reason})")
-        return 0
+    cursor_dir = state_path.parent / CURSOR_DIR
+    cursor = load_cursor(cursor_dir, CURSOR_NAME)
 
     # Bootstrap conditions:
     # - explicit flag
     # - first run (no state file)
     # - state exists but is empty (e.g., copied without state)
-    if args.bootstrap:
-        return do_bootstrap("инициализация состояния")
-    if not state_existed:
-        return do_bootstrap("инициализация состояния")
-    if not state.get("chat_last_key"):
-        return do_bootstrap("инициализация состояния")
+    bootstrap = args.bootstrap or not state_existed or not state.get("chat_last_key")
 
-    new_monitor: list[dict[str, Any]] = []
-    new_disc: list[dict[str, Any]] = []
+    # --jsonl may also point at a segments directory; the cursor then tracks
+    # each segment separately.
+    segmented = jsonl_path.is_dir()
+    files = [(p, p.name if segmented else None) for p in store_files(jsonl_path)]
 
     last_keys: dict[str, Any] = state["chat_last_key"]
+    seen_keys: dict[str, tuple[str, str]] = {
+        cid: (v.get("date", ""), str(v.get("message_id", ""))) for cid, v in last_keys.items()
+    }
+    max_key_by_chat: dict[str, tuple[str, str]] = {}
 
-    for m in msgs:
-        cid = str(m.get("chat_id"))
+    new_monitor: list[Message] = []
+    new_disc: list[Message] = []
+
+    consumed: dict[str | None, tuple[Path, int]] = {}
+
+    def iter_new_lines():
+        # Bootstrap scans everything; otherwise only bytes appended since the
+        # last run. chat_last_key still guards against re-reporting after a
+        # cursor reset (rotation/truncation).
+        for path, key in files:
+            start = 0 if bootstrap else resume_offset(path, cursor, key)
+            consumed[key] = (path, start)
+            for end, raw in iter_lines_from(path, start):
+                consumed[key] = (path, end)
+                yield raw
+
+    lines = iter_new_lines()
+    profiling = profile is not None
+    if profiling:
+        enter = profile.enter
+        lines = profile.iterate("read", lines, "decode", size=len)
+        decoded = classified = 0
+
+    for raw in lines:
+        line = raw.strip()
+        if not line:
+            continue
+        try:
+            m = decode_message(line)
+        except ValueError:
+            continue
+        if profiling:
+            decoded += 1
+            enter("keys")
+        # fill WA titles
+        if (m.source or "").lower() == "whatsapp":
+            if not m.chat_title:
+                cid = str(m.chat_id or "")
+                if cid in wa_map:
+                    m.chat_title = wa_map[cid]
+
+        cid = str(m.chat_id)
         k = key_of(m)
-        last = last_keys.get(cid, {"date": "", "message_id": ""})
-        lastk = (last.get("date", ""), str(last.get("message_id", "")))
-        if k <= lastk:
+        if cid not in max_key_by_chat or k > max_key_by_chat[cid]:
+            max_key_by_chat[cid] = k
+
+        if bootstrap:
+            continue
+        if k <= seen_keys.get(cid, ("", "")):
             continue
 
-        if m.get("is_service"):
+        if m.is_service:
             continue
 
-        text = m.get("text") or ""
+        text = m.text or ""
 
-        monitoring = False
-        if is_monitoring_dump(text, rules):
-            monitoring = True
         # Heuristic: treat known bots as monitoring too
-        u = (m.get("sender_username") or "")
-        if u.endswith("_bot") or u in {"e2tl_bot", "Business_group_mess_prod_bot", "something_bad_vc_bot"}:
-            monitoring = True
-
-        if monitoring:
-            if not text:
-                continue
-            if ignored_monitoring(text, rules):
-                continue
-            if is_clear(text, clear_re):
-                continue
-            if not is_severity(text, sev_re):
-                continue
-            if not domain_match(text, domain_kws_lower):
-                continue
+        u = (m.sender_username or "")
+        bot = u.endswith("_bot") or u in KNOWN_BOTS
+
+        if profiling:
+            classified += 1
+            enter("rules")
+        kind = compiled.classify(text, monitoring=bot)
+        if kind == MONITORING:
             new_monitor.append(m)
-        else:
-            if text and is_ack_noise(text, ack_res):
-                continue
-            if not text and m.get("has_media"):
+        elif kind == DISCUSSION:
+            if not text and m.has_media:
                 continue
             new_disc.append(m)
 
+    if profiling:
+        decode, keys, rules_stage = profile.stages["decode"], profile.stages["keys"], profile.stages["rules"]
+        decode.records_out = keys.records_in = decoded
+        keys.records_out = rules_stage.records_in = classified
+        rules_stage.records_out = profile.stages["output"].records_in = len(new_monitor) + len(new_disc)
+        enter("state")
+
+    def commit() -> None:
+        save_state(state_path, state)
+        c = cursor
+        for key, (path, end) in consumed.items():
+            c = advance(path, c, end, key)
+        save_cursor(cursor_dir, c)
+
+    if bootstrap:
+        for cid, k in max_key_by_chat.items():
+            last_keys[cid] = {"date": k[0], "message_id": k[1]}
+        commit()
+        if args.print_empty:
+            print("Новых сообщений нет. (инициализация состояния)")
+        return 0
+
     # update state last seen
     for cid, k in max_key_by_chat.items():
-        last_keys[cid] = {"date": k[0], "message_id": k[1]}
-    save_state(state_path, state)
+        if k > seen_keys.get(cid, ("", "")):
+            last_keys[cid] = {"date": k[0], "message_id": k[1]}
+    commit()
+    if profiling:
+        enter("output")
 
     if not new_monitor and not new_disc:
         if args.print_empty:
@@ -285,24 +478,24 @@ def main() -> int:
     # Print concise grouped output
     if new_monitor:
         print("Автомониторинг (важное):")
-        for m in sorted(new_monitor, key=lambda x: ((x.get("date") or ""), (x.get("chat_title") or ""))):
-            chat = m.get("chat_title") or "(unknown chat)"
-            dt = m.get("date") or ""
-            print(f"- {chat} ({dt}): {text_compact(m.get('text') or '')}")
+        for m in sorted(new_monitor, key=lambda x: ((x.date or ""), (x.chat_title or ""))):
+            chat = m.chat_title or "(unknown chat)"
+            dt = m.date or ""
+            print(f"- {chat} ({dt}): {text_compact(m.text or '')}")
 
     if new_disc:
         if new_monitor:
             print("")
         print("Чаты (новое):")
-        for m in sorted(new_disc, key=lambda x: ((x.get("chat_title") or ""), (x.get("date") or ""), str(x.get("message_id") or ""))):
-            chat = m.get("chat_title") or "(unknown chat)"
-            dt = m.get("date") or ""
-            if (m.get("source") or "").lower() == "whatsapp":
-                sid = str(m.get("sender_id") or "")
-                who = rules.wa_sender_map.get(sid) or (m.get("sender_username") or sid)
+        for m in sorted(new_disc, key=lambda x: ((x.chat_title or ""), (x.date or ""), str(x.message_id or ""))):
+            chat = m.chat_title or "(unknown chat)"
+            dt = m.date or ""
+            if (m.source or "").lower() == "whatsapp":
+                sid = str(m.sender_id or "")
+                who = rules.wa_sender_map.get(sid) or (m.sender_username or sid)
             else:
-                who = m.get("sender_username") or str(m.get("sender_id") or "")
-            print(f"- {chat} ({dt}) {who}: {text_compact(m.get('text') or '')}")
+                who = m.sender_username or str(m.sender_id or "")
+            print(f"- {chat} ({dt}) {who}: {text_compact(m.text or '')}")
 
     return 0
 
@@ -0,0 +1,228 @@
+"""Queue-fed writer task that group-commits records to the JSONL store.
+
+Producers `await writer.put(record)`; a single task drains the bounded queue,
+collects up to `batch_size` records or whatever arrives within `max_delay`
+seconds of the first one, and writes the batch through one long-lived store
+writer (see jsonl_store.open_writer). The write, flush and optional fsync run
+in a worker thread so a slow disk never blocks the event loop. `on_commit`,
+if given, is called on the loop with each written batch and its write time.
+`await writer.call(fn)` runs `fn(out)` in that thread once everything queued
+before it is written, for writes that need their own framing (sync batches
+through sync_journal.py) without a second writer on the same files.
+
+A batch that fails to write is retried with backoff (`retries` times). The
+retry only hands over the records not yet written, so a store writer must
+keep everything it buffered when its `flush` raises and write it on the next
+one (jsonl_store's writers and dedup.DedupWriter do; bench_telegram.py
+--fail-every checks the dedup path). If it
+still fails, the writer gives up: `error` is set, `on_error` is called, and
+from then on queued records are discarded and `put`/`call` raise, so the
+caller can stop instead of losing messages silently.
+
+fsync policies:
+- "none": flush to the OS after each batch, never fsync.
+- "batch": fsync once per batch (default).
+- "every": flush and fsync after every record.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+import time
+from typing import Callable, Optional
+
+FSYNC_POLICIES = ("none", "batch", "every")
+COMMIT_RETRIES = 5
+RETRY_DELAY = 0.5
+
+_STOP = object()
+_EMPTY = object()
+
+
+class _Call:
+    __slots__ = ("fn", "future")
+
+    def __init__(self, fn: Callable, future: asyncio.Future):
+        self.fn = fn
+        self.future = future
+
+
+class BatchWriter:
+    def __init__(
+        self,
+        open_out: Callable,
+        max_queue: int = 10000,
+        batch_size: int = 256,
+        max_delay: float = 0.05,
+        fsync: str = "batch",
+        on_commit: Optional[Callable[[list, float], None]] = None,
+        on_error: Optional[Callable[[BaseException], None]] = None,
+        retries: int = COMMIT_RETRIES,
+        retry_delay: float = RETRY_DELAY,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync!r} (expected one of {', '.join(FSYNC_POLICIES)})")
+        self._open_out = open_out
+        self._out = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.batch_size = max(1, batch_size)
+        self.max_delay = max_delay
+        self.fsync = fsync
+        self.on_commit = on_commit
+        self.on_error = on_error
+        self.retries = max(0, retries)
+        self.retry_delay = retry_delay
+        self.error: Optional[BaseException] = None
+        self._written = 0
+        self._getter: Optional[asyncio.Task] = None
+        self._task = None
+
+    def start(self) -> None:
+        self._out = self._open_out()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def _check(self) -> None:
+        if self.error is not None:
+            raise RuntimeError(f"the store writer stopped after a failed write: {self.error}") from self.error
+
+    async def put(self, record: dict) -> None:
+        self._check()
+        # Blocks only when the queue is full, which bounds memory during bursts.
+        await self._queue.put(record)
+
+    async def call(self, fn: Callable):
+        """Run `fn(out)` in the writer thread after the records queued so far; returns its result."""
+        self._check()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Call(fn, future))
+        return await future
+
+    async def drain(self) -> None:
+        """Wait until everything queued so far is on disk."""
+        await self._queue.join()
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        await asyncio.to_thread(self._out.close)
+
+    async def _get(self, timeout: Optional[float] = None):
+        """The next queued item, or _EMPTY after `timeout` seconds.
+
+        The get stays pending across a timeout and is picked up by the next
+        call; cancelling it (as `wait_for` does before Python 3.12) could
+        drop an item it had already taken off the queue.
+        """
+        if self._getter is None:
+            self._getter = asyncio.ensure_future(self._queue.get())
+        done, _ = await asyncio.wait({self._getter}, timeout=timeout)
+        if not done:
+            return _EMPTY
+        item = self._getter.result()
+        self._getter = None
+        return item
+
+    async def _collect(self, first) -> tuple[list, object]:
+        """A batch starting with `first`, and the _Call or _STOP that ended it early (or None)."""
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.batch_size:
+            item = _EMPTY
+            if self._getter is None:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+            if item is _EMPTY:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                item = await self._get(timeout)
+                if item is _EMPTY:
+                    break
+            if item is _STOP or isinstance(item, _Call):
+                return batch, item
+            batch.append(item)
+        return batch, None
+
+    def _commit(self, batch: list) -> None:
+        # A retry skips the records an earlier attempt already handed to the
+        # store writer: they are still in its buffers.
+        while self._written < len(batch):
+            self._out.write(batch[self._written])
+            self._written += 1
+            if self.fsync == "every" and self._written < len(batch):
+                self._out.flush(fsync=True)
+        self._out.flush(fsync=self.fsync != "none")
+
+    async def _write(self, batch: list) -> bool:
+        """Commit `batch`, retrying with backoff; False once the writer has given up."""
+        self._written = 0
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._commit, batch)
+            except Exception as exc:
+                if attempt == self.retries:
+                    print(f"[writer] giving up on {len(batch)} records: {exc}", file=sys.stderr)
+                    self.error = exc
+                    if self.on_error is not None:
+                        self.on_error(exc)
+                    return False
+                print(
+                    f"[writer] failed to write {len(batch)} records: {exc}; retrying in {delay:g}s",
+                    file=sys.stderr,
+                )
+                await asyncio.sleep(delay)
+                delay *= 2
+            else:
+                if self.on_commit is not None:
+                    self.on_commit(batch, time.perf_counter() - started)
+                return True
+        return False
+
+    async def _call(self, call: _Call) -> None:
+        try:
+            self._check()
+            result = await asyncio.to_thread(call.fn, self._out)
+        except Exception as exc:
+            if not call.future.done():
+                call.future.set_exception(exc)
+        else:
+            if not call.future.done():
+                call.future.set_result(result)
+        finally:
+            self._queue.task_done()
+
+    async def _run(self) -> None:
+        stop = False
+        while not stop:
+            first = await self._get()
+            if first is _STOP:
+                self._queue.task_done()
+                break
+            if isinstance(first, _Call):
+                await self._call(first)
+                continue
+            if self.error is not None:
+                # Given up: what is still queued is dropped so drain() and close() return.
+                self._queue.task_done()
+                continue
+            batch, then = await self._collect(first)
+            stop = then is _STOP
+            try:
+                await self._write(batch)
+            finally:
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self._queue.task_done()
+            if isinstance(then, _Call):
+                await self._call(then)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Micro-benchmark: per-message classification cost in analyze_update_chats.py.
+
+Compares the original rule evaluation (a loop per rule group, `text.lower()`
+per group, one `in` test per keyword) with the compiled matcher, checks that
+both make the same decision for every message, and reports the cost of
+loading and compiling the rules.
+
+    python scripts/bench_classify.py [--rules config.update_chats_rules.yaml] [--messages 50000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import re
+import time
+from pathlib import Path
+
+from analyze_update_chats import DISCUSSION, MONITORING, Rules, load_compiled_rules
+
+SAMPLES = [
+    "ок",
+    "Спасибо!",
+    "👍",
+    "Коллеги, по переводам card2card сегодня всё штатно?",
+    "Добрый день! Подскажите, когда будет выкатка нового релиза мобильного приложения",
+    "FROM: zabbix\nSUBJECT: problem\n[FIRING] payment gateway 5xx rate above threshold on ecomm node",
+    "FROM: zabbix\n[RESOLVED] payment gateway 5xx rate back to normal",
+    "SUBJECT: EM Event: CRITICAL: GoldenGate OGG replicat lag on dbk01",
+    "SUBJECT: EM Event: WARNING: tablespace usage 85% on reportdb",
+    "🟥 DOWN: Way4 processing channel #3 to Visa is not responding",
+    "Сервис восстановлен 🟩 канал Mastercard",
+    "FROM: monitoring\nWARNING: SuperApp Halyk. Чат бот latency",
+    "FROM: alerts\nFIRING traffic drop on upi channel",
+    # Case folds where str.casefold() and re.I disagree.
+    "FİRİNG visa",
+    "WARNıNG: openway straße",
+    "Нужно проверить лимиты по 3-D Secure для merchant 12345 до вечера " * 3,
+    "",
+]
+
+
+def legacy_classifier(rules: Rules):
+    """The classification as analyze_update_chats.py did it before the compiled rules."""
+    ack_res = [re.compile(p, re.I) for p in rules.ack_noise_regexes]
+    clear_re = re.compile(rules.monitoring_clear_regex, re.I) if rules.monitoring_clear_regex else None
+    sev_re = re.compile(rules.monitoring_severity_regex, re.I) if rules.monitoring_severity_regex else None
+    domain_kws_lower = [k.lower() for k in rules.monitoring_domain_keywords]
+
+    def classify(text: str, monitoring: bool) -> str | None:
+        t = text or ""
+        for p in rules.monitoring_dump_prefixes:
+            if t.startswith(p):
+                monitoring = True
+        for sub in rules.monitoring_dump_substrings:
+            if sub in t:
+                monitoring = True
+        if monitoring:
+            if not text:
+                return None
+            if any(sub in text.lower() for sub in rules.monitoring_ignore_substrings):
+                return None
+            if clear_re and clear_re.search(text):
+                return None
+            if not (sev_re and sev_re.search(text)):
+                return None
+            if not any(k in text.lower() for k in domain_kws_lower):
+                return None
+            return MONITORING
+        if text and any(r.match(text.strip()) for r in ack_res):
+            return None
+        return DISCUSSION
+
+    return classify
+
+
+def bench(fn, texts, bots) -> float:
+    start = time.perf_counter()
+    for text, bot in zip(texts, bots):
+        fn(text, bot)
+    return time.perf_counter() - start
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rules", default="config.update_chats_rules.yaml", help="Path to rules YAML")
+    ap.add_argument("--messages", type=int, default=50000, help="Messages per run")
+    ap.add_argument("--repeat", type=int, default=5, help="Runs per variant (best is reported)")
+    args = ap.parse_args()
+
+    rules_path = Path(args.rules)
+    if not rules_path.is_absolute():
+        rules_path = Path(__file__).resolve().parents[1] / rules_path
+
+    start = time.perf_counter()
+    rules, compiled = load_compiled_rules(rules_path)
+    load = time.perf_counter() - start
+
+    rng = random.Random(0)
+    texts = [rng.choice(SAMPLES) for _ in range(args.messages)]
+    bots = [rng.random() < 0.1 for _ in range(args.messages)]
+
+    legacy = legacy_classifier(rules)
+    mismatches = sum(legacy(t, b) != compiled.classify(t, b) for t, b in zip(texts, bots))
+
+    before = min(bench(legacy, texts, bots) for _ in range(args.repeat))
+    after = min(bench(compiled.classify, texts, bots) for _ in range(args.repeat))
+    n = args.messages
+    print(f"rules load and compile: {load * 1e3:.2f} ms")
+    print(f"before: {before / n * 1e6:.2f} us/message ({n / before:,.0f} msg/s)")
+    print(f"after:  {after / n * 1e6:.2f} us/message ({n / after:,.0f} msg/s)")
+    print(f"speedup: {before / after:.2f}x, mismatched decisions: {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""Benchmark: records/sec for each installed JSON backend of jsonl_codec.py.
+
+For every backend, measures encoding records to lines (`dumps_line`),
+decoding lines to dicts (`loads`) and decoding lines to `Message` records
+(`decode_message`), and checks that it writes the same bytes as the stdlib
+backend. Records come from --jsonl (first --records lines) or are synthetic.
+
+    python scripts/bench_codec.py [--jsonl data/telegram_messages.jsonl] [--records 100000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from pathlib import Path
+
+from jsonl_codec import available, get_codec
+
+WORDS = ["платёж", "card2card", "ок", "Коллеги", "релиз", "FIRING", "🟥", "Visa", "лимиты", "merchant", "latency"]
+
+
+def synthetic(n: int, first: int = 0) -> list[dict]:
+    """Records `first` .. `first + n - 1` of a fixed synthetic sequence."""
+    rng = random.Random(first)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    run_id = start.isoformat()
+    records = []
+    for i in range(first, first + n):
+        wa = rng.random() < 0.2
+        chat = rng.randrange(50)
+        records.append(
+            {
+                "source": "whatsapp" if wa else "telegram",
+                "chat_id": f"7701{chat:07d}@g.us" if wa else -1001000000000 - chat,
+                "chat_title": None if wa else f"Чат {chat}",
+                "chat_username": None if wa else f"chat_{chat}",
+                "message_id": f"3EB0{i:016X}" if wa else i + 1,
+                "date": (start + timedelta(seconds=7 * i)).isoformat(),
+                "sender_id": rng.randrange(10**9),
+                "sender_username": None if wa else f"user{rng.randrange(300)}",
+                "text": " ".join(rng.choice(WORDS) for _ in range(rng.randrange(1, 40))),
+                "is_service": False,
+                "has_media": rng.random() < 0.1,
+                "reply_to_msg_id": None,
+                "run_id": run_id,
+            }
+        )
+    return records
+
+
+def rate(fn, items, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(items) / best
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--jsonl", help="Sample records from this JSONL file instead of synthetic ones")
+    ap.add_argument("--records", type=int, default=100000, help="Records per run")
+    ap.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+    args = ap.parse_args()
+
+    reference = get_codec("json")
+    if args.jsonl:
+        with Path(args.jsonl).open("rb") as f:
+            records = [reference.loads(line) for line in islice((ln for ln in f if ln.strip()), args.records)]
+    else:
+        records = synthetic(args.records)
+    expected = [reference.dumps_line(rec) for rec in records]
+    print(f"{len(records)} records, {sum(map(len, expected)) / len(records):.0f} bytes/record")
+    print(f"{'backend':<10} {'encode/s':>12} {'loads/s':>12} {'Message/s':>12}  same bytes as json")
+
+    for name in available():
+        codec = get_codec(name)
+        lines = [codec.dumps_line(rec) for rec in records]
+        same = sum(a == b for a, b in zip(lines, expected))
+        enc = rate(codec.dumps_line, records, args.repeat)
+        dec = rate(codec.loads, lines, args.repeat)
+        msg = rate(codec.decode_message, lines, args.repeat)
+        print(f"{name:<10} {enc:>12,.0f} {dec:>12,.0f} {msg:>12,.0f}  {same}/{len(records)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
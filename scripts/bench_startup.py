@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Benchmark: cold-start import time of the CLI scripts against a budget.
+
+Imports each script in a fresh interpreter under `python -X importtime` and
+reports the module's cumulative import time (best of --repeat runs), which
+covers everything it pulls in before main() starts. With --config, the
+config is also loaded there (`config_loader.load_config`), once with its
+parse cache removed (PyYAML imported) and once with the cache in place.
+
+Exits 1 if a script is over its budget. The budgets leave headroom on a
+slow machine for the scripts cron and clawdbot start most often, and catch
+heavy imports (telethon takes hundreds of ms) creeping back to module level
+elsewhere; --budget-scale adjusts them for another machine.
+
+    python scripts/bench_startup.py [--config config.yaml] [--budget-scale 0.5]
+"""
+
+from __future__ import annotations
+
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+from config_loader import cache_path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+# Script -> import budget in ms.
+BUDGETS = {
+    "query_client": 60,
+    "query_telegram": 120,
+    "analyze_update_chats": 120,
+    "sync_telegram": 150,
+    "telegram_listen": 150,
+    "telegram_login": 150,
+    "list_telegram_chats": 150,
+    "compact_store": 150,
+    "migrate_to_segments": 150,
+}
+
+
+def import_ms(code: str, names: list[str]) -> float:
+    """Cumulative import time of the top-level modules `names` while running `code`."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=SCRIPTS_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    total = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Top-level imports are indented by exactly one space.
+        if name[1:2] != " " and name.strip() in names:
+            total += int(cumulative)
+    return total / 1000
+
+
+def best(code: str, names: list[str], repeat: int, before=None) -> float:
+    runs = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        runs.append(import_ms(code, names))
+    return min(runs)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--config", help="Also measure loading this config, with and without its parse cache")
+    ap.add_argument("--budget-scale", type=float, default=1.0, help="Multiply every budget by this factor")
+    ap.add_argument("--repeat", type=int, default=5, help="Runs per measurement (best is reported)")
+    args = ap.parse_args()
+
+    over = 0
+    print(f"{'script':<22} {'import ms':>10} {'budget':>8}")
+    for name, budget in BUDGETS.items():
+        budget *= args.budget_scale
+        try:
+            ms = best(f"import {name}", [name], args.repeat)
+        except subprocess.CalledProcessError as exc:
+            print(f"{name:<22} {'error':>10}  {exc.stderr.strip().splitlines()[-1]}")
+            over += 1
+            continue
+        ok = ms <= budget
+        over += not ok
+        print(f"{name:<22} {ms:>10.1f} {budget:>8g}  {'ok' if ok else 'OVER'}")
+
+    if args.config:
+        config = Path(args.config).expanduser().resolve()
+        code = f"from pathlib import Path; import config_loader; config_loader.load_config(Path({str(config)!r}))"
+        names = ["config_loader", "yaml"]
+
+        def drop_cache() -> None:
+            cache_path(config).unlink(missing_ok=True)
+
+        cold = best(code, names, args.repeat, before=drop_cache)
+        warm = best(code, names, args.repeat)
+        print(f"load_config: {cold:.1f} ms parsing YAML, {warm:.1f} ms from the cache (imports only)")
+
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""Benchmark: query_telegram.py and analyze_update_chats.py on synthetic stores.
+
+For each --sizes store (generate_corpus.py, written to a temporary directory
+or --workdir), runs every case --repeat times in a fresh process and
+reports the latency percentiles, throughput (store records per second at the
+median, or appended records per second for incremental analyze runs), the
+number of output lines and the peak RSS of the child process:
+
+    query chat / contains / latest / dates   query_telegram.py --chat, --contains,
+    / search                                 --chat --latest, --after/--before, --search
+    analyze bootstrap                        first run, no state (all records)
+    analyze incremental                      --increment records appended before each run
+
+The first query of each store also builds its index sidecars, which shows in
+the upper percentiles of the first case. With --compact, compact_store.py
+then archives the whole store (--retention-days 0) and the query cases run
+again as "... archived"; the run fails if any of them prints a different
+number of lines than before. analyze_update_chats.py runs with
+the repo's rules but its state, cursor and WhatsApp chat map in the work
+directory. Nothing touches the network.
+--json writes the results for comparing runs. A 10^7-record store takes
+about 4 GiB and several minutes to generate.
+
+    python scripts/bench_suite.py [--sizes 10000 100000 1000000] [--segments] [--json results.json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from config_loader import load_yaml
+from generate_corpus import Corpus, add_spec_arguments, spec_from_args, write_records
+from jsonl_cursor import CURSOR_DIR
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+QUERY = SCRIPTS_DIR / "query_telegram.py"
+ANALYZE = SCRIPTS_DIR / "analyze_update_chats.py"
+COMPACT = SCRIPTS_DIR / "compact_store.py"
+RULES = SCRIPTS_DIR.parent / "config.update_chats_rules.yaml"
+PERCENTILES = (50, 90, 99)
+# ru_maxrss is in KiB on Linux and in bytes on macOS.
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def run(cmd: list[str]) -> tuple[float, int, int]:
+    """(seconds, peak RSS bytes, stdout lines) of one run of `cmd`."""
+    start = time.perf_counter()
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err)
+        lines = 0
+        # Output is counted rather than kept: --limit 0 on a large store prints gigabytes.
+        for chunk in iter(lambda: proc.stdout.read(1 << 20), b""):
+            lines += chunk.count(b"\n")
+        proc.stdout.close()
+        # wait4 rather than wait: it reports the peak RSS of this child alone.
+        # Linux starts that from this process' peak (it survives the exec), so
+        # the corpus is streamed to disk to keep this process small.
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode != 0:
+            err.seek(0)
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=err.read().decode("utf-8", "replace"))
+    return elapsed, usage.ru_maxrss * RSS_UNIT, lines
+
+
+def percentile(samples: list[float], p: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def measure(name: str, size: int, items: int, runs: list[tuple[float, int, int]]) -> dict:
+    times = [t for t, _, _ in runs]
+    result = {
+        "case": name,
+        "records": size,
+        "items_per_s": items / percentile(times, 50),
+        "peak_rss_mib": max(rss for _, rss, _ in runs) / 2**20,
+        "lines": runs[-1][2],
+    }
+    for p in PERCENTILES:
+        result[f"p{p}_ms"] = percentile(times, p) * 1000
+    print(
+        f"{name:<24} {size:>9} "
+        + " ".join(f"{result[f'p{p}_ms']:>9.1f}" for p in PERCENTILES)
+        + f" {result['items_per_s']:>12,.0f} {result['peak_rss_mib']:>8.0f} {result['lines']:>9}"
+    )
+    return result
+
+
+def bench_size(args, size: int, workdir: Path) -> list[dict]:
+    corpus = Corpus(spec_from_args(args))
+    store = workdir / ("segments" if args.segments else "messages.jsonl")
+    started = time.perf_counter()
+    write_records(corpus, size, store, store if args.segments else None, truncate=True)
+    print(f"[bench] {size} records generated in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    config = workdir / "config.yaml"
+    config.write_text(f"{'output_segments_dir' if args.segments else 'output_jsonl'}: {json.dumps(str(store))}\n", encoding="utf-8")
+    wa_chats = workdir / "whatsapp_chats.txt"
+    wa_chats.write_text(corpus.whatsapp_chats(), encoding="utf-8")
+    state = workdir / "update_chats_state.json"
+    rules = load_yaml(RULES)
+    rules.update(state_file=str(state), whatsapp_chats_file=str(wa_chats))
+    # JSON is valid YAML, so the rules copy needs no YAML writer.
+    rules_path = workdir / "rules.yaml"
+    rules_path.write_text(json.dumps(rules, ensure_ascii=False), encoding="utf-8")
+
+    # The busiest Telegram discussion chat (--chat matches titles, not JIDs),
+    # a common Russian word and a one-day window in the middle of the corpus.
+    chat = next(c.title for c in corpus.talk_chats if c.source == "telegram")
+    middle = corpus.spec.start + (corpus.now - corpus.spec.start) / 2
+    query = [sys.executable, str(QUERY), "--config", str(config)]
+    cases = [
+        ("query chat", ["--chat", chat, "--limit", "0"]),
+        ("query contains", ["--contains", "платеж", "--limit", "0"]),
+        ("query latest", ["--chat", chat, "--latest", "--limit", "100"]),
+        ("query dates", ["--after", middle.isoformat(), "--before", (middle + timedelta(days=1)).isoformat(), "--limit", "0"]),
+        ("query search", ["--search", "платеж*", "--limit", "0"]),
+    ]
+    results = []
+    for name, extra in cases:
+        results.append(measure(name, size, size, [run(query + extra) for _ in range(args.repeat)]))
+
+    analyze = [sys.executable, str(ANALYZE), "--jsonl", str(store), "--rules", str(rules_path)]
+
+    def fresh_state() -> None:
+        state.unlink(missing_ok=True)
+        for cursor in (workdir / CURSOR_DIR).glob("*"):
+            cursor.unlink()
+
+    runs = []
+    for _ in range(args.repeat):
+        fresh_state()
+        runs.append(run(analyze))
+    results.append(measure("analyze bootstrap", size, size, runs))
+
+    runs = []
+    for _ in range(args.repeat):
+        write_records(corpus, args.increment, store, store if args.segments else None)
+        runs.append(run(analyze))
+    results.append(measure("analyze incremental", size, args.increment, runs))
+
+    if args.compact:
+        expected = {name: run(query + extra)[2] for name, extra in cases}
+        results.append(measure("compact", size, size, [run([sys.executable, str(COMPACT), "--config", str(config), "--retention-days", "0"])]))
+        for name, extra in cases:
+            result = measure(f"{name} archived", size, size, [run(query + extra) for _ in range(args.repeat)])
+            if result["lines"] != expected[name]:
+                print(f"[bench] {name}: {result['lines']} lines from the archives, {expected[name]} before compaction", file=sys.stderr)
+                result["mismatch"] = True
+            results.append(result)
+    return results
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="Store sizes in records")
+    ap.add_argument("--repeat", type=int, default=5, help="Runs per case (percentiles are over these)")
+    ap.add_argument("--increment", type=int, default=1000, help="Records appended before each incremental analyze run")
+    ap.add_argument("--segments", action="store_true", help="Use a segments directory instead of a single JSONL file")
+    ap.add_argument("--compact", action="store_true", help="Archive the store afterwards and check the queries again")
+    ap.add_argument("--workdir", help="Write stores here instead of a temporary directory (overwritten)")
+    ap.add_argument("--json", help="Also write the results to this JSON file")
+    add_spec_arguments(ap)
+    args = ap.parse_args()
+
+    print(
+        f"{'case':<24} {'records':>9} "
+        + " ".join(f"{f'p{p} ms':>9}" for p in PERCENTILES)
+        + f" {'items/s':>12} {'RSS MiB':>8} {'lines':>9}"
+    )
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            workdir = Path(args.workdir or tmp).expanduser() / str(size)
+            workdir.mkdir(parents=True, exist_ok=True)
+            results.extend(bench_size(args, size, workdir))
+
+    if args.json:
+        payload = {"layout": "segments" if args.segments else "jsonl", "cpus": os.cpu_count(), "results": results}
+        Path(args.json).write_text(json.dumps(payload, indent=2), encoding="utf-8")
+    return 1 if any(r.get("mismatch") for r in results) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
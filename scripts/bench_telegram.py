@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""Benchmark: sync_telegram.py and telegram_listen.py against fake_telethon.py.
+
+Runs each script's real main() in this process with the fake Telethon layer
+installed, so it needs neither Telethon nor a network:
+
+- sync backfill: --records messages over --chats chats, from an empty store;
+- sync incremental: --increment new messages, with the state from the backfill;
+- listener: --live messages arriving as NewMessage events at --live-rate per
+  second in bursts of --burst, until all are on disk. With --drop-every, the
+  connection is lost after every --drop-every messages and the next
+  --drop-messages are sent while the listener is away, for it to catch up.
+
+Every request takes --latency seconds and every --flood-every-th one fails
+with a FloodWait of --flood-seconds. With --fail-every, every Nth key-table
+reconcile of the listener's dedup writer fails with "database is locked", so
+batches are retried; the listener must still write each message exactly once. Messages are synthetic Telegram records
+(generate_corpus.py) or, with --jsonl, the Telegram records of a store in
+file order, split into the three phases in turn. Sync
+reports wall time, messages/s and requests; the listener reports messages/s
+and the latency from dispatch to the flushed write (p50/p90/p99/max).
+
+    python scripts/bench_telegram.py [--records 100000] [--latency 0.05] [--live 20000 --live-rate 2000 --burst 50]
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from itertools import islice
+from pathlib import Path
+
+import fake_telethon
+from bench_suite import percentile
+from generate_corpus import Corpus, add_spec_arguments, spec_from_args
+from jsonl_codec import loads
+from jsonl_store import store_files
+
+
+def fail_every(writer, n: int, failures: list):
+    """Make every `n`th reconcile of `writer`'s key set fail like a locked database."""
+    keys = writer.keys
+    reconcile = keys.reconcile
+    calls = 0
+
+    def flaky(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        if calls % n == 0:
+            failures.append(calls)
+            raise sqlite3.OperationalError("database is locked")
+        return reconcile(*args, **kwargs)
+
+    keys.reconcile = flaky
+    return writer
+
+
+class TimedWriter:
+    """Store writer wrapper noting when each record's flush returned."""
+
+    def __init__(self, inner, flushed: dict):
+        self._inner = inner
+        self._flushed = flushed
+        self._pending: list = []
+
+    def write(self, record: dict) -> None:
+        self._inner.write(record)
+        self._pending.append((record["chat_id"], record["message_id"]))
+
+    def flush(self, fsync: bool = False) -> None:
+        self._inner.flush(fsync=fsync)
+        now = time.perf_counter()
+        for key in self._pending:
+            self._flushed[key] = now
+        self._pending.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self._inner.close()
+
+
+def telegram_records(args):
+    """Endless (or, with --jsonl, the store's) Telegram records in arrival order."""
+    if args.jsonl:
+        for path in store_files(Path(args.jsonl).expanduser()):
+            with path.open("rb") as f:
+                for line in f:
+                    if line.strip():
+                        rec = loads(line)
+                        if rec.get("source", "telegram") == "telegram":
+                            yield rec
+        return
+    spec = spec_from_args(args)
+    spec.whatsapp = 0.0
+    corpus = Corpus(spec)
+    while True:
+        yield from corpus.take(100000)
+
+
+def count_lines(path: Path) -> int:
+    with path.open("rb") as f:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b""))
+
+
+def run_main(module, argv: list[str]) -> int:
+    saved = sys.argv
+    sys.argv = [module.__file__, *argv]
+    try:
+        # Per-chat and per-message progress lines are not part of the measurement.
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            return module.main()
+    finally:
+        sys.argv = saved
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--records", type=int, default=100000, help="Messages in the backfilled histories")
+    ap.add_argument("--increment", type=int, default=2000, help="Messages fetched by the incremental sync")
+    ap.add_argument("--live", type=int, default=20000, help="Messages replayed to the listener")
+    ap.add_argument("--jsonl", help="Replay the Telegram records of this store instead of synthetic ones")
+    ap.add_argument("--latency", type=float, default=0.05, help="Seconds per request (default %(default)s)")
+    ap.add_argument("--flood-every", type=int, default=0, help="Every Nth request fails with FloodWait (0: never)")
+    ap.add_argument("--flood-seconds", type=int, default=1, help="FloodWait seconds (sync sleeps one more)")
+    ap.add_argument("--live-rate", type=float, default=0.0, help="Listener messages per second (0: as fast as handled)")
+    ap.add_argument("--burst", type=int, default=50, help="Listener messages delivered together")
+    ap.add_argument("--drop-every", type=int, default=0, help="Lose the listener's connection every N messages (0: never)")
+    ap.add_argument("--drop-messages", type=int, default=100, help="Messages sent while the listener is disconnected")
+    ap.add_argument("--concurrency", type=int, help="sync --concurrency")
+    ap.add_argument("--fsync", default="batch", help="listener_fsync policy (default %(default)s)")
+    ap.add_argument("--fail-every", type=int, default=0, help="Every Nth listener dedup reconcile fails (0: never)")
+    add_spec_arguments(ap)
+    args = ap.parse_args()
+
+    import sync_telegram
+    import telegram_listen
+
+    flushed: dict = {}
+    live = 0
+    server = fake_telethon.FakeServer(
+        latency=args.latency,
+        flood_every=args.flood_every,
+        flood_seconds=args.flood_seconds,
+        rate=args.live_rate,
+        burst=args.burst,
+        stop_when_done=True,
+        drop_every=args.drop_every,
+        drop_messages=args.drop_messages,
+        # Caught-up messages are written after the last live one is handled.
+        stop_when=lambda: len(flushed) >= live,
+    )
+    if args.drop_every:
+        os.environ.setdefault("LISTENER_RETRY_SECONDS", "0")
+    fake_telethon.install(server)
+    stream = telegram_records(args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = Path(tmp) / "messages.jsonl"
+        config = Path(tmp) / "config.yaml"
+
+        def write_config() -> None:
+            cfg = {
+                "api_id": 1,
+                "api_hash": "offline",
+                "phone": "+10000000000",
+                "chats": server.peer_ids(),
+                "output_jsonl": str(store),
+                "state_file": str(Path(tmp) / "state.json"),
+                "listener_fsync": args.fsync,
+            }
+            # JSON is valid YAML.
+            config.write_text(json.dumps(cfg), encoding="utf-8")
+
+        sync_args = ["--config", str(config)]
+        if args.concurrency:
+            sync_args += ["--concurrency", str(args.concurrency)]
+
+        print(f"{'phase':<18} {'messages':>9} {'seconds':>9} {'msgs/s':>10} {'requests':>9} {'floods':>7}")
+        for phase, n in (("sync backfill", args.records), ("sync incremental", args.increment)):
+            added = server.add_history(islice(stream, n))
+            write_config()
+            requests, floods = server.requests, server.floods
+            before = count_lines(store) if store.exists() else 0
+            start = time.perf_counter()
+            run_main(sync_telegram, sync_args)
+            elapsed = time.perf_counter() - start
+            written = count_lines(store) - before
+            note = "" if written == added else f"  (wrote {written} of {added})"
+            print(
+                f"{phase:<18} {added:>9} {elapsed:>9.2f} {added / elapsed:>10,.0f} "
+                f"{server.requests - requests:>9} {server.floods - floods:>7}{note}"
+            )
+
+        live = server.add_live(islice(stream, args.live))
+        write_config()
+        open_dedup_writer = telegram_listen.open_dedup_writer
+        failures: list = []
+
+        def open_writer(*a, **kw):
+            writer = open_dedup_writer(*a, **kw)
+            if args.fail_every:
+                writer = fail_every(writer, args.fail_every, failures)
+            return TimedWriter(writer, flushed)
+
+        telegram_listen.open_dedup_writer = open_writer
+        before = count_lines(store)
+        try:
+            run_main(telegram_listen, ["--config", str(config), "--quiet"])
+        finally:
+            telegram_listen.open_dedup_writer = open_dedup_writer
+        written = count_lines(store) - before
+
+    latencies = [flushed[key] - at for key, at in server.delivered.items() if key in flushed]
+    if not latencies:
+        print("listener: no messages written", file=sys.stderr)
+        return 1
+    span = max(flushed.values()) - min(server.delivered.values())
+    ms = " ".join(f"p{p} {percentile(latencies, p) * 1000:.1f}" for p in (50, 90, 99))
+    print(
+        f"listener: {len(latencies)}/{live} messages, {len(latencies) / span:,.0f} msgs/s, "
+        f"dispatch->flushed ms {ms} max {max(latencies) * 1000:.1f}"
+    )
+    if server.drops:
+        print(f"listener: {server.drops} dropped connections, {len(flushed) - len(latencies)}/{server.missed} missed messages caught up")
+    if failures:
+        print(f"listener: {len(failures)} failed dedup reconciles retried")
+    if written != len(flushed):
+        print(f"listener: wrote {written} records for {len(flushed)} messages", file=sys.stderr)
+    return 0 if written == len(flushed) == live else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
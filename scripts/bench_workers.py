@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Benchmark: query_telegram.py --workers 1/2/4/8 on a synthetic store.
+
+Writes --records synthetic records (bench_codec.synthetic) to a temporary
+JSONL store, then times a few queries at each worker count and checks that
+every worker count prints exactly what --workers 1 prints. Speedups depend
+on the cores available (os.cpu_count() is shown).
+
+    python scripts/bench_workers.py [--records 1000000] [--workers 1 2 4 8]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench_codec import synthetic
+from jsonl_codec import dumps_line
+
+QUERY = Path(__file__).resolve().parent / "query_telegram.py"
+
+QUERIES = [
+    ("chat", ["--chat", "Чат 7", "--limit", "0"]),
+    ("contains", ["--contains", "latency", "--limit", "0"]),
+    ("all", ["--limit", "0"]),
+    ("latest", ["--chat", "Чат 7", "--latest", "--limit", "100"]),
+]
+
+
+def run(config: Path, args: list[str], workers: int) -> tuple[float, bytes]:
+    cmd = [sys.executable, str(QUERY), "--config", str(config), "--workers", str(workers), *args]
+    start = time.perf_counter()
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+    return time.perf_counter() - start, out
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--records", type=int, default=1000000, help="Synthetic records in the store")
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Worker counts to compare")
+    ap.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = Path(tmp) / "messages.jsonl"
+        with store.open("wb") as f:
+            # Build and write in chunks to keep memory flat for large stores.
+            for start in range(0, args.records, 100000):
+                f.writelines(dumps_line(rec) for rec in synthetic(min(100000, args.records - start), start))
+        config = Path(tmp) / "config.yaml"
+        config.write_text(f"output_jsonl: {store}\n", encoding="utf-8")
+        print(f"{args.records} records, {store.stat().st_size / 2**20:.0f} MiB, {os.cpu_count()} CPUs")
+        print(f"{'query':<10} {'workers':>7} {'seconds':>9} {'speedup':>8}  same output")
+
+        for name, query in QUERIES:
+            base = None
+            expected = None
+            for workers in args.workers:
+                best = None
+                for _ in range(args.repeat):
+                    elapsed, out = run(config, query, workers)
+                    best = elapsed if best is None else min(best, elapsed)
+                if expected is None:
+                    base, expected = best, out
+                same = "yes" if out == expected else "NO"
+                print(f"{name:<10} {workers:>7} {best:>9.2f} {base / best:>7.2f}x  {same}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -12,6 +12,12 @@ fi
 # Threshold for "stale" output (seconds)
 STALE_SECS="${STALE_SECS:-900}"   # 15 minutes
 
+# Metrics files the listeners rewrite every listener_metrics_interval seconds
+# (see scripts/listener_metrics.py); older than this means the listener is stuck.
+TG_METRICS="${TG_METRICS:-$ROOT/data/telegram_listener.prom}"
+WA_METRICS="${WA_METRICS:-$ROOT/data/whatsapp_listener.prom}"
+METRICS_STALE_SECS="${METRICS_STALE_SECS:-120}"
+
 RESTART=0
 QUIET=0
 STRICT_STALE=0
@@ -35,6 +41,49 @@ say() {
   fi
 }
 
+# metric FILE NAME: sum of NAME's samples in FILE (over all labels), or empty.
+metric() {
+  awk -v n="$2" '$1 == n || index($1, n "{") == 1 { s += $NF; found = 1 } END { if (found) printf "%.3f\n", s }' "$1"
+}
+
+# check_metrics LABEL FILE: report a listener's metrics; unhealthy if its
+# metrics are stale, or (with --strict-stale) if it has not written for STALE_SECS.
+check_metrics() {
+  local label="$1" file="$2" now updated age connected streak reconnects queue rate last idle
+  now=$(date +%s)
+  updated=$(metric "$file" listener_metrics_updated_timestamp_seconds)
+  updated=${updated:-0}
+  age=$(( now - ${updated%.*} ))
+  if [ "$age" -gt "$METRICS_STALE_SECS" ]; then
+    say "[FAIL] $label metrics not updated for ${age}s (> ${METRICS_STALE_SECS}s): $file"
+    healthy=0
+    return
+  fi
+  connected=$(metric "$file" listener_connected)
+  streak=$(metric "$file" listener_fail_streak)
+  reconnects=$(metric "$file" listener_reconnects_total)
+  queue=$(metric "$file" listener_queue_depth)
+  rate=$(metric "$file" listener_messages_per_second)
+  last=$(metric "$file" listener_last_persist_timestamp_seconds)
+  last=${last:-0}
+  if [ "${connected%.*}" != "1" ]; then
+    say "[WARN] $label listener not connected (fail streak ${streak%.*})"
+  fi
+  if [ "${last%.*}" -eq 0 ]; then
+    say "[OK] $label: nothing written since start (reconnects ${reconnects%.*}, queue ${queue%.*})"
+    return
+  fi
+  idle=$(( now - ${last%.*} ))
+  if [ "$idle" -gt "$STALE_SECS" ]; then
+    say "[WARN] $label: last write ${idle}s ago (> ${STALE_SECS}s)"
+    if [ "$STRICT_STALE" -eq 1 ]; then
+      healthy=0
+    fi
+  else
+    say "[OK] $label: ${rate:-0} msg/s, queue ${queue%.*}, reconnects ${reconnects%.*}, last write ${idle}s ago"
+  fi
+}
+
 # Prefer pyenv python if available
 if [ -d "$HOME/.pyenv/shims" ]; then
   export PATH="$HOME/.pyenv/shims:$PATH"
@@ -82,9 +131,21 @@ else
   fi
 fi
 
-# Staleness check: output JSONL updated recently?
-# NOTE: If no one writes new messages, JSONL won't change. So by default this is only a warning.
-if [ -f "$OUT_JSONL" ]; then
+# Staleness check: from the listeners' metrics when they write them, else the
+# output JSONL's mtime.
+# NOTE: If no one writes new messages, nothing changes. So by default this is only a warning.
+used_metrics=0
+if [ "$DISABLE_TELEGRAM" -eq 0 ] && [ -n "$TG_PID" ] && [ -f "$TG_METRICS" ]; then
+  check_metrics Telegram "$TG_METRICS"
+  used_metrics=1
+fi
+if [ -n "$WA_PID" ] && [ -f "$WA_METRICS" ]; then
+  check_metrics WhatsApp "$WA_METRICS"
+  used_metrics=1
+fi
+if [ "$used_metrics" -eq 1 ]; then
+  :
+elif [ -f "$OUT_JSONL" ]; then
   now=$(date +%s)
   mtime=$(stat -f %m "$OUT_JSONL")
   age=$(( now - mtime ))
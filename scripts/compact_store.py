@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+import argparse
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from config_loader import load_config, store_location
+from dedup import record_key
+from jsonl_archive import CODECS, archive_name, check_codec, frames_path, read_lines, record_order, write_archive
+from jsonl_codec import loads
+from jsonl_index import NO_DATE, date_us, index_dir, to_us
+from jsonl_store import (
+    SEGMENT_SUFFIX,
+    UNDATED_SEGMENT,
+    archive_dir,
+    list_segments,
+    refresh_manifest,
+    segment_name,
+)
+
+COMPACT_LOCK = "compact.lock"
+DEFAULT_GRACE = 5.0
+TAIL_POLL = 0.1
+# Lines buffered in memory before they are appended to the per-day spill files.
+SPILL_BYTES = 64 * 1024 * 1024
+DAY_US = 86_400_000_000
+
+
+def parse_lines(lines):
+    """Split raw lines into (record, raw) pairs and lines that are not records."""
+    items, bad = [], []
+    for raw in lines:
+        if not raw.strip():
+            continue
+        try:
+            rec = loads(raw)
+        except ValueError:
+            bad.append(raw)
+            continue
+        if isinstance(rec, dict):
+            items.append((rec, raw))
+        else:
+            bad.append(raw)
+    return items, bad
+
+
+def drop_duplicates(items):
+    """Keep the first record per (source, chat_id, message_id); records without an id are kept."""
+    seen = set()
+    kept = []
+    for rec, raw in items:
+        key = record_key(rec)
+        if key is not None:
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append((rec, raw))
+    return kept
+
+
+def hot_order(item) -> tuple:
+    # Hot files stay in date order so --latest and the index zone maps keep working.
+    chat_id, date, message_id = record_order(item[0])
+    return date, chat_id, message_id
+
+
+def read_complete(f, pos: int) -> tuple[bytes, int]:
+    """Complete lines after `pos` and the offset just past them."""
+    f.seek(pos)
+    data = f.read()
+    cut = data.rfind(b"\n") + 1
+    return data[:cut], pos + cut
+
+
+def archive_day(adir: Path, day: str, items, codec: str) -> int:
+    """Merge records into the day's archive; returns how many records it now holds."""
+    adir.mkdir(parents=True, exist_ok=True)
+    existing = []
+    old_paths = [adir / archive_name(day, c) for c in CODECS]
+    for path in old_paths:
+        if path.exists():
+            existing.extend(parse_lines(read_lines(path))[0])
+    merged = drop_duplicates(existing + list(items))
+    merged.sort(key=lambda item: record_order(item[0]))
+    target = adir / archive_name(day, codec)
+    write_archive(target, merged, codec)
+    for path in old_paths:
+        if path != target and path.exists():
+            frames_path(path).unlink(missing_ok=True)
+            path.unlink()
+    return len(merged)
+
+
+class _Spill:
+    """Raw lines bucketed on disk, so that only one bucket is in memory at a time."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._names: dict = {}
+        self._buffers: dict = {}
+        self._buffered = 0
+
+    def add(self, bucket, raw: bytes) -> None:
+        self._buffers.setdefault(bucket, []).append(raw if raw.endswith(b"\n") else raw + b"\n")
+        self._buffered += len(raw)
+        if self._buffered >= SPILL_BYTES:
+            self.flush()
+
+    def flush(self) -> None:
+        for bucket, lines in self._buffers.items():
+            name = self._names.setdefault(bucket, str(len(self._names)))
+            with (self.directory / name).open("ab") as f:
+                f.writelines(lines)
+        self._buffers.clear()
+        self._buffered = 0
+
+    def buckets(self) -> list:
+        return sorted(set(self._names) | set(self._buffers))
+
+    def lines(self, bucket) -> list[bytes]:
+        lines = []
+        name = self._names.get(bucket)
+        if name is not None:
+            with (self.directory / name).open("rb") as f:
+                lines = f.readlines()
+        return lines + self._buffers.get(bucket, [])
+
+
+def compact_file(path: Path, cutoff_us, adir: Path, codec: str, keep: bool):
+    """Rewrite `path` sorted and deduplicated, archiving records dated before `cutoff_us`.
+
+    The file is read once and its lines spilled into per-day files next to
+    it, then sorted and deduplicated one day at a time (a record and its
+    duplicates share a date). Lines appended while this runs are copied into
+    the new file before it replaces `path`. Returns (stats, tail): `tail` is
+    the old file, still open, and the offset copied up to, for
+    `follow_tails`; None if `path` was already compact and left alone.
+    """
+    stats = {"lines": 0, "hot": 0, "archived": 0, "duplicates": 0, "tail": 0}
+    src = path.open("rb")
+    try:
+        with tempfile.TemporaryDirectory(prefix=path.name + ".compact.", dir=path.parent) as tmpdir:
+            spill = _Spill(Path(tmpdir))
+            # Whether the file is already compact is decided on the way: hot
+            # records in order, and no duplicates within a day (which are
+            # then all in the current one).
+            compact = True
+            last, last_day, day_keys = None, None, set()
+            end = 0
+            for raw in src:
+                if not raw.endswith(b"\n"):
+                    break
+                end += len(raw)
+                if not raw.strip():
+                    continue
+                stats["lines"] += 1
+                try:
+                    rec = loads(raw)
+                except ValueError:
+                    rec = None
+                if not isinstance(rec, dict):
+                    spill.add(("bad",), raw)
+                    continue
+                d = date_us(rec.get("date"))
+                if cutoff_us is not None and d != NO_DATE and d < cutoff_us:
+                    spill.add(("cold", segment_name(rec)[: -len(SEGMENT_SUFFIX)]), raw)
+                    compact = False
+                    continue
+                day = d // DAY_US
+                spill.add(("hot", day), raw)
+                if compact:
+                    order = hot_order((rec, raw))
+                    if last is not None and order < last:
+                        compact = False
+                    last = order
+                    if day != last_day:
+                        last_day, day_keys = day, set()
+                    key = record_key(rec)
+                    if key is not None:
+                        if key in day_keys:
+                            compact = False
+                        day_keys.add(key)
+            if compact:
+                src.close()
+                return stats, None
+
+            # Archives are written first: a crash before the swap below leaves
+            # the records in both places, and the next run drops the extra copies.
+            hot_days = []
+            for bucket in spill.buckets():
+                if bucket[0] == "cold":
+                    items, _ = parse_lines(spill.lines(bucket))
+                    kept = drop_duplicates(items)
+                    stats["duplicates"] += len(items) - len(kept)
+                    archive_day(adir, bucket[1], kept, codec)
+                    stats["archived"] += len(kept)
+                elif bucket[0] == "hot":
+                    hot_days.append(bucket)
+
+            tmp = path.with_name(path.name + ".compact.tmp")
+            with tmp.open("wb") as out:
+                for bucket in hot_days:
+                    items, _ = parse_lines(spill.lines(bucket))
+                    kept = drop_duplicates(items)
+                    stats["duplicates"] += len(items) - len(kept)
+                    stats["hot"] += len(kept)
+                    kept.sort(key=hot_order)
+                    out.writelines(raw for _, raw in kept)
+                out.writelines(spill.lines(("bad",)))
+                while True:
+                    chunk, end = read_complete(src, end)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    stats["tail"] += chunk.count(b"\n")
+                out.flush()
+                os.fsync(out.fileno())
+        if keep or tmp.stat().st_size:
+            tmp.replace(path)
+        else:
+            tmp.unlink()
+            path.unlink()
+            shutil.rmtree(index_dir(path), ignore_errors=True)
+    except BaseException:
+        src.close()
+        raise
+    return stats, (path, src, end)
+
+
+def follow_tails(tails, grace: float) -> int:
+    """Copy lines still written to replaced files until none arrive for `grace` seconds.
+
+    Writers reopen the path at their next flush (see jsonl_store._AppendFile);
+    until then they may append to the old inode. Returns the lines copied.
+    """
+    copied = 0
+    deadline = time.monotonic() + grace
+    try:
+        while time.monotonic() < deadline:
+            for i, (path, src, end) in enumerate(tails):
+                chunk, end = read_complete(src, end)
+                if chunk:
+                    with path.open("ab") as out:
+                        out.write(chunk)
+                    copied += chunk.count(b"\n")
+                    tails[i] = (path, src, end)
+                    deadline = time.monotonic() + grace
+            time.sleep(TAIL_POLL)
+    finally:
+        for _, src, _ in tails:
+            src.close()
+    return copied
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Sort and deduplicate the JSONL store and archive old days into compressed frames."
+    )
+    parser.add_argument("--config", required=True, help="Path to YAML config file")
+    parser.add_argument(
+        "--retention-days",
+        type=int,
+        help="Archive days older than N days (overrides archive_after_days; omit both to only compact)",
+    )
+    parser.add_argument("--codec", choices=sorted(CODECS), help="Archive compression (overrides archive_codec)")
+    parser.add_argument(
+        "--grace",
+        type=float,
+        default=DEFAULT_GRACE,
+        help=f"Seconds to keep copying lines written to replaced files (default {DEFAULT_GRACE:g})",
+    )
+    args = parser.parse_args()
+
+    config_path = Path(args.config).expanduser().resolve()
+    cfg = load_config(config_path)
+
+    output_path, segments_dir = store_location(config_path, cfg)
+    store_path = segments_dir or output_path
+    if not store_path.exists():
+        print(f"JSONL not found: {store_path}", file=sys.stderr)
+        return 1
+
+    retention = args.retention_days
+    if retention is None and cfg.get("archive_after_days") is not None:
+        retention = int(cfg["archive_after_days"])
+    codec = args.codec or str(cfg.get("archive_codec") or "gzip")
+    try:
+        check_codec(codec)
+    except RuntimeError as exc:
+        print(str(exc), file=sys.stderr)
+        return 2
+    cutoff_us = None
+    if retention is not None:
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        cutoff_us = to_us(today - timedelta(days=max(0, retention)))
+
+    adir = archive_dir(store_path)
+    lock_path = store_path / COMPACT_LOCK if segments_dir else store_path.with_name(store_path.name + ".compact.lock")
+    with lock_path.open("a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(f"Another compaction is running on {store_path}", file=sys.stderr)
+            return 1
+
+        if segments_dir is not None:
+            targets = [(p, cutoff_us if p.name != UNDATED_SEGMENT else None, False) for p in list_segments(segments_dir)]
+        else:
+            targets = [(output_path, cutoff_us, True)]
+        tails = []
+        try:
+            for path, cutoff, keep in targets:
+                stats, tail = compact_file(path, cutoff, adir, codec, keep)
+                if tail is None:
+                    continue
+                tails.append(tail)
+                print(
+                    f"[compact] {path.name}: {stats['lines']} lines -> {stats['hot']} kept, "
+                    f"{stats['archived']} archived, {stats['duplicates']} duplicates dropped, "
+                    f"{stats['tail']} appended during compaction"
+                )
+        except RuntimeError as exc:
+            print(str(exc), file=sys.stderr)
+            return 2
+        finally:
+            late = follow_tails(tails, args.grace)
+        if late:
+            print(f"[compact] copied {late} lines written to replaced files")
+        if segments_dir is not None:
+            refresh_manifest(segments_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
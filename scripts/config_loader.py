@@ -0,0 +1,142 @@
+"""Config loading shared by the scripts.
+
+`load_config` returns the YAML config with `${VAR}` / `$VAR` values of the
+Telegram credentials resolved from the environment (falling back to
+TG_API_ID, TG_API_HASH and TG_PHONE), and `resolve_path` turns relative
+paths into paths next to the config file.
+
+Parsed YAML files are cached in the process and on disk, in
+`.<name>.cache.json` beside the file (mode 0600, as it holds the same
+values), keyed on the file's mtime, size and inode. A run whose config has
+not changed reads that JSON instead of importing PyYAML and parsing. Configs
+JSON cannot represent exactly (dates, non-string keys) are parsed every
+time. Environment values are resolved on every call and never cached.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Iterable, Optional
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".cache.json"
+ENV_FALLBACKS = {"api_id": "TG_API_ID", "api_hash": "TG_API_HASH", "phone": "TG_PHONE"}
+
+# path -> (stamp, cache file contents); callers get a fresh json.loads of it.
+_parsed: dict[Path, tuple[list[int], str]] = {}
+
+
+def resolve_env_value(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        key = None
+        if value.startswith("${") and value.endswith("}"):
+            key = value[2:-1]
+        elif value.startswith("$"):
+            key = value[1:]
+        if key:
+            return os.environ.get(key)
+    return value
+
+
+def resolve_path(config_path: Path, value: str, default_relative: str) -> Path:
+    if value:
+        p = Path(value)
+    else:
+        p = Path(default_relative)
+    if not p.is_absolute():
+        p = config_path.parent / p
+    return p
+
+
+def store_location(config_path: Path, cfg: dict) -> tuple[Path, Optional[Path]]:
+    """(output_jsonl, output_segments_dir or None) of a config."""
+    output_path = resolve_path(config_path, cfg.get("output_jsonl", ""), "data/telegram_messages.jsonl")
+    segments_value = cfg.get("output_segments_dir") or ""
+    segments_dir = resolve_path(config_path, segments_value, segments_value) if segments_value else None
+    return output_path, segments_dir
+
+
+def cache_path(path: Path) -> Path:
+    return path.with_name("." + path.name + CACHE_SUFFIX)
+
+
+def _stamp(path: Path) -> list[int]:
+    st = path.stat()
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+def _read_cache(path: Path, stamp: list[int]) -> Optional[str]:
+    try:
+        with cache_path(path).open("r", encoding="utf-8") as f:
+            encoded = f.read()
+        cached = json.loads(encoded)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("version") != CACHE_VERSION or cached.get("stamp") != stamp:
+        return None
+    return encoded
+
+
+def _encode(stamp: list[int], data) -> Optional[str]:
+    """The cache file contents for `data`, or None if JSON would not give it back unchanged."""
+    try:
+        encoded = json.dumps({"version": CACHE_VERSION, "stamp": stamp, "data": data}, ensure_ascii=False)
+        if json.loads(encoded)["data"] != data:
+            return None
+    except (TypeError, ValueError):
+        return None
+    return encoded
+
+
+def _write_cache(path: Path, encoded: str) -> None:
+    target = cache_path(path)
+    tmp = target.with_name(target.name + ".tmp")
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(encoded)
+        os.replace(tmp, target)
+    except OSError:
+        # A read-only config directory only costs the YAML parse next time.
+        tmp.unlink(missing_ok=True)
+
+
+def load_yaml(path: Path) -> dict:
+    """The parsed YAML mapping in `path` (empty file: {}); the caller owns the result."""
+    # The stamp is taken before reading, so a write racing the parse changes it.
+    stamp = _stamp(path)
+    hit = _parsed.get(path)
+    encoded = hit[1] if hit is not None and hit[0] == stamp else _read_cache(path, stamp)
+    if encoded is None:
+        import yaml
+
+        with path.open("r", encoding="utf-8") as f:
+            data = yaml.safe_load(f) or {}
+        encoded = _encode(stamp, data)
+        if encoded is None:
+            return data
+        _write_cache(path, encoded)
+    _parsed[path] = (stamp, encoded)
+    return json.loads(encoded)["data"]
+
+
+def load_config(config_path: Path, required: Iterable[str] = (), nonempty: Iterable[str] = ()) -> dict:
+    """The config with credentials resolved.
+
+    Raises ValueError for `required` keys that are absent and `nonempty` keys
+    without a value.
+    """
+    cfg = load_yaml(config_path)
+
+    for key, env in ENV_FALLBACKS.items():
+        cfg[key] = resolve_env_value(cfg.get(key)) or os.environ.get(env)
+
+    missing = [k for k in required if k not in cfg] + [k for k in nonempty if not cfg.get(k)]
+    if missing:
+        raise ValueError(f"Missing config keys: {', '.join(missing)}")
+
+    return cfg
@@ -0,0 +1,366 @@
+"""Persistent set of stored message keys, used to skip duplicate writes.
+
+The sync and the live listener both append to the same store, so without a
+check every message the listener captured is written again by the next sync.
+`DedupWriter` wraps a store writer (see jsonl_store.open_writer) and drops
+records whose (source, chat_id, message_id) is already stored.
+
+Keys live next to the store (`<output_jsonl>.dedup.sqlite`, or
+`dedup.sqlite` inside a segments directory) in two forms:
+
+- an exact SQLite table of keys, tagged with the file that holds the record,
+  plus the identity and size of every store file covered;
+- a Bloom filter (`.dedup.bloom` / `dedup.bloom`) memory-mapped by every
+  writer, so new messages (the common case) are accepted without a lookup.
+  A positive answer is confirmed against the table.
+
+Each flush runs in one `BEGIN IMMEDIATE` transaction, which also serializes
+concurrent writers across processes. Records are flushed to the store before
+their keys commit, so a crash can at worst let a duplicate through, never
+lose a message; a flush that raises keeps its records for the next one. Store files that were replaced, truncated or rewritten (e.g.
+`sync_telegram.py --rebuild`) have their keys dropped and are rescanned.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import mmap
+import sqlite3
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from jsonl_codec import loads
+from jsonl_store import open_writer, segment_path, store_files
+
+DEDUP_DB = "dedup.sqlite"
+DEDUP_BLOOM = "dedup.bloom"
+BLOOM_CAPACITY = 1 << 20
+BLOOM_ERROR_RATE = 0.01
+SCAN_BATCH = 5000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    source TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    file TEXT NOT NULL,
+    PRIMARY KEY (source, chat_id, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS keys_file ON keys(file);
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+_INSERT = "INSERT OR IGNORE INTO keys(source, chat_id, message_id, file) VALUES (?, ?, ?, ?)"
+
+
+def dedup_path(store_path: Path) -> Path:
+    if store_path.is_dir():
+        return store_path / DEDUP_DB
+    return store_path.with_name(store_path.name + ".dedup.sqlite")
+
+
+def bloom_path(store_path: Path) -> Path:
+    if store_path.is_dir():
+        return store_path / DEDUP_BLOOM
+    return store_path.with_name(store_path.name + ".dedup.bloom")
+
+
+def record_key(rec: dict) -> Optional[tuple[str, str, str]]:
+    """(source, chat_id, message_id) as strings, or None when the record has no id."""
+    message_id = rec.get("message_id")
+    if message_id is None or message_id == "":
+        return None
+    return str(rec.get("source") or "telegram"), str(rec.get("chat_id", "")), str(message_id)
+
+
+class BloomFilter:
+    """Bit array over a shared memory-mapped file; sized by (capacity, error rate)."""
+
+    def __init__(self, path: Path, bits: int, hashes: int):
+        self.path = path
+        self.bits = bits
+        self.hashes = hashes
+        size = (bits + 7) // 8
+        with path.open("a+b") as f:
+            if f.seek(0, 2) < size:
+                f.truncate(size)
+            self._mm = mmap.mmap(f.fileno(), size)
+
+    @staticmethod
+    def params(capacity: int, error_rate: float = BLOOM_ERROR_RATE) -> tuple[int, int]:
+        bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        return bits, max(1, round(bits / capacity * math.log(2)))
+
+    def _positions(self, key: tuple) -> Iterable[int]:
+        digest = hashlib.blake2b("\x1f".join(key).encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, key: tuple) -> None:
+        mm = self._mm
+        for pos in self._positions(key):
+            mm[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: tuple) -> bool:
+        mm = self._mm
+        return all(mm[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def close(self) -> None:
+        self._mm.close()
+
+
+class KeySet:
+    """Exact key table plus Bloom filter for one store (a JSONL file or a segments directory)."""
+
+    def __init__(self, store_path: Path, capacity: int = BLOOM_CAPACITY):
+        self.store_path = store_path
+        self._min_capacity = capacity
+        self.conn = sqlite3.connect(
+            str(dedup_path(store_path)), timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self.conn.executescript(_SCHEMA)
+        self.bloom: Optional[BloomFilter] = None
+        self._bloom_generation = 0
+        with self.transaction():
+            self.reconcile(store_files(store_path))
+
+    def transaction(self):
+        return _Transaction(self.conn)
+
+    def _meta(self, name: str, default: int = 0) -> int:
+        row = self.conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return int(row[0]) if row else default
+
+    def _set_meta(self, name: str, value: int) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO meta(name, value) VALUES (?, ?)", (name, value))
+
+    def _sync_bloom(self) -> None:
+        # Another writer may have rebuilt or resized the filter since we mapped it.
+        generation = self._meta("bloom_generation")
+        if self.bloom is not None and generation == self._bloom_generation:
+            return
+        if self.bloom is not None:
+            self.bloom.close()
+            self.bloom = None
+        if not generation:
+            self._rebuild_bloom()
+            return
+        self.bloom = BloomFilter(bloom_path(self.store_path), self._meta("bloom_bits"), self._meta("bloom_hashes"))
+        self._bloom_generation = generation
+
+    def _rebuild_bloom(self) -> None:
+        count = self.conn.execute("SELECT COUNT(*) FROM keys").fetchone()[0]
+        capacity = max(self._min_capacity, 2 * count)
+        bits, hashes = BloomFilter.params(capacity)
+        if self.bloom is not None:
+            self.bloom.close()
+        path = bloom_path(self.store_path)
+        path.unlink(missing_ok=True)
+        self.bloom = BloomFilter(path, bits, hashes)
+        for key in self.conn.execute("SELECT source, chat_id, message_id FROM keys"):
+            self.bloom.add(key)
+        self._set_meta("bloom_bits", bits)
+        self._set_meta("bloom_hashes", hashes)
+        self._set_meta("bloom_capacity", capacity)
+        self._set_meta("key_count", count)
+        self._bloom_generation = self._meta("bloom_generation") + 1
+        self._set_meta("bloom_generation", self._bloom_generation)
+
+    def _stale(self, path: Path, row) -> bool:
+        if row is None:
+            return True
+        dev, ino, size = row
+        st = path.stat()
+        if (dev, ino) != (st.st_dev, st.st_ino) or size > st.st_size:
+            return True
+        if size > 0:
+            with path.open("rb") as f:
+                f.seek(size - 1)
+                return f.read(1) != b"\n"
+        return False
+
+    def _scan(self, path: Path, start: int = 0) -> int:
+        """Add the keys of the complete lines of `path` after `start`; returns where they end."""
+        batch = []
+        end = start
+        before = self.conn.total_changes
+        with path.open("rb") as f:
+            f.seek(start)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                end += len(raw)
+                try:
+                    rec = loads(raw)
+                except ValueError:
+                    continue
+                if not isinstance(rec, dict):
+                    continue
+                key = record_key(rec)
+                if key is not None:
+                    batch.append((*key, path.name))
+                    self.bloom.add(key)
+                if len(batch) >= SCAN_BATCH:
+                    self.conn.executemany(_INSERT, batch)
+                    batch.clear()
+        if batch:
+            self.conn.executemany(_INSERT, batch)
+        self._set_meta("key_count", self._meta("key_count") + self.conn.total_changes - before)
+        return end
+
+    def mark(self, path: Path, size: int) -> None:
+        st = path.stat()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files(name, dev, ino, size) VALUES (?, ?, ?, ?)",
+            (path.name, st.st_dev, st.st_ino, size),
+        )
+
+    def reconcile(self, files: list[Path], forget_missing: bool = True) -> None:
+        """Bring the key table in line with `files` (call inside a transaction).
+
+        Lines appended since a file was last covered are scanned, whoever
+        wrote them: the WhatsApp listener and writers with `dedup: false`
+        do not record keys themselves.
+        """
+        # Map the filter other writers may have rebuilt before adding to it.
+        self._sync_bloom()
+        changed = False
+        if forget_missing:
+            names = {p.name for p in files}
+            for (name,) in self.conn.execute("SELECT name FROM files").fetchall():
+                if name not in names:
+                    self.conn.execute("DELETE FROM keys WHERE file = ?", (name,))
+                    self.conn.execute("DELETE FROM files WHERE name = ?", (name,))
+                    changed = True
+        for path in files:
+            if not path.exists():
+                continue
+            row = self.conn.execute("SELECT dev, ino, size FROM files WHERE name = ?", (path.name,)).fetchone()
+            if self._stale(path, row):
+                if row is not None:
+                    self.conn.execute("DELETE FROM keys WHERE file = ?", (path.name,))
+                self.mark(path, self._scan(path))
+                changed = True
+            elif row[2] < path.stat().st_size:
+                self.mark(path, self._scan(path, row[2]))
+        if changed or self._meta("key_count") > self._meta("bloom_capacity"):
+            self._rebuild_bloom()
+
+    def seen(self, key: tuple) -> bool:
+        if key not in self.bloom:
+            return False
+        row = self.conn.execute(
+            "SELECT 1 FROM keys WHERE source = ? AND chat_id = ? AND message_id = ?", key
+        ).fetchone()
+        return row is not None
+
+    def close(self) -> None:
+        if self.bloom is not None:
+            self.bloom.close()
+        self.conn.close()
+
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, *exc):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class DedupWriter:
+    """Store writer that skips records whose key is already in the store.
+
+    Records are held until `flush`, which checks them, writes the new ones
+    through the wrapped writer and records their keys in one transaction.
+    """
+
+    def __init__(self, inner, store_path: Path, file_of: Callable[[dict], Path]):
+        self._inner = inner
+        self._file_of = file_of
+        self._pending: list[dict] = []
+        # (key, file) of records handed to the wrapped writer whose flush has
+        # not succeeded yet; it keeps them buffered for the next flush.
+        self._held: list[tuple[Optional[tuple], Path]] = []
+        self.keys = KeySet(store_path)
+        self.written = 0
+        self.skipped = 0
+
+    def write(self, record: dict) -> None:
+        self._pending.append(record)
+
+    def flush(self, fsync: bool = False) -> None:
+        """Write the new pending records; if this raises, nothing buffered is lost and `flush` can be retried."""
+        if not self._pending and not self._held:
+            self._inner.flush(fsync=fsync)
+            return
+        pending = self._pending
+        targets = [(rec, self._file_of(rec)) for rec in pending]
+        touched = sorted({path for _, path in targets} | {path for _, path in self._held})
+        with self.keys.transaction():
+            self.keys.reconcile(touched, forget_missing=False)
+            new = []
+            batch_keys = {key for key, _ in self._held if key is not None}
+            for rec, path in targets:
+                key = record_key(rec)
+                if key is not None:
+                    if key in batch_keys or self.keys.seen(key):
+                        self.skipped += 1
+                        continue
+                    batch_keys.add(key)
+                new.append((rec, key, path))
+            # Until here a failure leaves the records in _pending; each one
+            # handed to the wrapped writer stays buffered there instead, even
+            # if a flush (its own or this one) fails.
+            self._pending = []
+            for i, (rec, key, path) in enumerate(new):
+                self._held.append((key, path))
+                try:
+                    self._inner.write(rec)
+                except BaseException:
+                    self._pending = [later for later, _, _ in new[i + 1 :]] + self._pending
+                    raise
+            # Records reach the store before their keys commit: a crash in
+            # between can only let a duplicate through later. Their keys are
+            # read back with whatever other writers appended meanwhile.
+            self._inner.flush(fsync=fsync)
+            self.keys.reconcile(touched, forget_missing=False)
+        self.written += len(self._held)
+        self._held = []
+
+    def close(self) -> None:
+        try:
+            if self._pending or self._held:
+                self.flush()
+            self._inner.close()
+        finally:
+            self.keys.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_dedup_writer(output_path: Path, segments_dir: Optional[Path], truncate: bool = False) -> DedupWriter:
+    inner = open_writer(output_path, segments_dir, truncate=truncate)
+    if segments_dir is not None:
+        return DedupWriter(inner, segments_dir, lambda rec: segment_path(segments_dir, rec))
+    return DedupWriter(inner, output_path, lambda rec: output_path)
@@ -0,0 +1,95 @@
+"""In-process LRU/TTL cache of chat and sender metadata for the live listener.
+
+Resolving a chat (`event.get_chat()`) can cost a network round-trip per
+message. The listener keeps what it needs for a record (chat id, title,
+username and sender usernames) here instead: entries are pre-warmed from the
+configured chats at startup, refreshed after `ttl` seconds, evicted least
+recently used beyond `max_size`, and dropped when a service message changes
+the chat title.
+"""
+
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Hashable, NamedTuple, Optional
+
+_MISSING = object()
+
+
+class ChatInfo(NamedTuple):
+    id: Optional[int]
+    title: Optional[str]
+    username: Optional[str]
+
+
+def chat_info(entity) -> ChatInfo:
+    return ChatInfo(
+        getattr(entity, "id", None),
+        getattr(entity, "title", None),
+        getattr(entity, "username", None),
+    )
+
+
+class LruTtlCache:
+    def __init__(self, max_size: int = 2048, ttl: float = 3600.0):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._items: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable, default=None):
+        item = self._items.get(key, _MISSING)
+        if item is _MISSING:
+            return default
+        expires, value = item
+        if expires is not None and expires < time.monotonic():
+            del self._items[key]
+            return default
+        self._items.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl and self.ttl > 0 else None
+        self._items[key] = (expires, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._items.pop(key, None)
+
+
+class EntityCache:
+    """Chat metadata keyed by the event's (marked) chat id, sender usernames by sender id."""
+
+    def __init__(self, max_size: int = 2048, ttl: float = 3600.0):
+        self.chats = LruTtlCache(max_size, ttl)
+        self.senders = LruTtlCache(max_size, ttl)
+
+    def chat(self, chat_id) -> Optional[ChatInfo]:
+        if chat_id is None:
+            return None
+        return self.chats.get(chat_id)
+
+    def put_chat(self, chat_id, entity) -> ChatInfo:
+        info = entity if isinstance(entity, ChatInfo) else chat_info(entity)
+        if chat_id is not None:
+            self.chats.put(chat_id, info)
+        return info
+
+    def invalidate_chat(self, chat_id) -> None:
+        self.chats.pop(chat_id)
+
+    def sender_username(self, sender_id, sender=None) -> Optional[str]:
+        """Username of `sender` when the update carried it, else the cached one."""
+        if sender is not None:
+            username = getattr(sender, "username", None)
+            if sender_id is not None:
+                self.senders.put(sender_id, username)
+            return username
+        if sender_id is None:
+            return None
+        return self.senders.get(sender_id)
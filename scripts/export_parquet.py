@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+import argparse
+import sys
+from pathlib import Path
+
+from config_loader import load_config, store_location
+from parquet_store import export, parquet_path
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Export the JSONL store to Parquet, partitioned by source and day.")
+    parser.add_argument("--config", required=True, help="Path to YAML config file")
+    parser.add_argument("--rebuild", action="store_true", help="Convert the whole store again instead of new lines only")
+    args = parser.parse_args()
+
+    config_path = Path(args.config).expanduser().resolve()
+    cfg = load_config(config_path)
+
+    output_path, segments_dir = store_location(config_path, cfg)
+    store_path = segments_dir or output_path
+    if not store_path.exists():
+        print(f"JSONL not found: {store_path}", file=sys.stderr)
+        return 1
+
+    try:
+        manifest = export(store_path, args.rebuild)
+    except RuntimeError as exc:
+        print(str(exc), file=sys.stderr)
+        return 2
+    rows = sum(part["rows"] for part in manifest["parts"].values())
+    print(
+        f"[parquet] {rows} records from {len(manifest['files'])} files"
+        f" in {len(manifest['parts'])} parts under {parquet_path(store_path)}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,419 @@
+"""Offline stand-in for the parts of Telethon that sync_telegram.py and telegram_listen.py use.
+
+`install(server)` registers `telethon`, `telethon.errors`, `telethon.events`,
+`telethon.utils`, `telethon.sessions` and `telethon.tl.types` modules backed
+by a `FakeServer`, so
+the scripts' own `from telethon import ...` (done inside main) picks them up
+and the scripts run unchanged, without Telethon or a network:
+
+- TelegramClient: start, get_entity (entity id, -100 peer id or username),
+  iter_messages with limit/min_id/offset_date/add_offset/reverse (pages of
+  PAGE_SIZE messages, one request each), on + events.NewMessage(chats=...),
+  run_until_disconnected and disconnect.
+- SQLiteSession and StringSession carry a fixed offline auth key, so every
+  session_mode of telegram_listen.py starts.
+- Every request takes `latency` seconds, and every `flood_every`-th request
+  fails with FloodWaitError(`flood_seconds`) (a retry is a new request).
+- run_until_disconnected replays the server's live messages as NewMessage
+  events, `burst` at a time at `rate` messages per second (0: as fast as the
+  loop takes them), and adds each to its chat's history as it is sent. With
+  `drop_every`, the connection is lost after every `drop_every` messages
+  dispatched: the next `drop_messages` are sent while the client is away
+  (history only, no events) and run_until_disconnected raises
+  ConnectionError. With `stop_when_done`, SIGTERM is raised once they are
+  all handled and `stop_when()` (if set) is true, so the listener shuts down
+  through its own signal handler.
+
+Histories and live messages are Telegram records in the store schema:
+recorded ones read back from a JSONL store, or synthetic ones from
+generate_corpus.py. `delivered` maps (chat id, message id) to the
+time.perf_counter() at which each live message was dispatched.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import signal
+import sys
+import time
+import types
+from typing import Callable, Iterable, Optional
+
+from jsonl_store import parse_dt
+
+PAGE_SIZE = 100  # messages per history request, as Telethon fetches them
+
+_server: Optional["FakeServer"] = None
+
+
+class FloodWaitError(Exception):
+    def __init__(self, seconds: int):
+        super().__init__(f"A wait of {seconds} seconds is required")
+        self.seconds = seconds
+
+
+class MessageActionChatEditTitle:
+    def __init__(self, title: str = ""):
+        self.title = title
+
+
+class MessageActionChatAddUser:
+    def __init__(self, users: Optional[list] = None):
+        self.users = users or []
+
+
+class Entity:
+    __slots__ = ("id", "title", "username")
+
+    def __init__(self, id: int, title: Optional[str], username: Optional[str]):
+        self.id = id
+        self.title = title
+        self.username = username
+
+
+class User:
+    __slots__ = ("id", "username")
+
+    def __init__(self, id: int, username: Optional[str]):
+        self.id = id
+        self.username = username
+
+
+class Message:
+    __slots__ = ("id", "date", "message", "sender_id", "sender", "action", "media", "reply_to_msg_id")
+
+    def __init__(self, rec: dict):
+        sender_id = rec.get("sender_id")
+        self.id = int(rec["message_id"])
+        self.date = parse_dt(rec["date"])
+        self.message = rec.get("text") or ""
+        self.sender_id = sender_id
+        self.sender = User(sender_id, rec.get("sender_username")) if sender_id is not None else None
+        self.action = MessageActionChatAddUser() if rec.get("is_service") else None
+        self.media = object() if rec.get("has_media") else None
+        self.reply_to_msg_id = rec.get("reply_to_msg_id")
+
+
+def _telegram(rec: dict) -> bool:
+    """Whether `rec` is a Telegram message the fake can serve (numeric ids, a date)."""
+    if rec.get("source", "telegram") != "telegram" or not rec.get("date"):
+        return False
+    try:
+        int(rec["chat_id"]), int(rec["message_id"]), parse_dt(rec["date"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return True
+
+
+class SQLiteSession:
+    def __init__(self, session_id: str):
+        self.auth_key = b"offline"
+
+    def close(self) -> None:
+        pass
+
+
+class StringSession:
+    def __init__(self, string: Optional[str] = None):
+        self.auth_key = b"offline" if string else None
+
+    def save(self) -> str:
+        return "1" + self.auth_key.hex() if self.auth_key else ""
+
+
+def get_peer_id(entity) -> int:
+    """The marked (-100...) id Telethon uses for a supergroup or channel."""
+    return entity.id if entity.id < 0 else -(10**12 + entity.id)
+
+
+class FakeServer:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        flood_every: int = 0,
+        flood_seconds: int = 0,
+        rate: float = 0.0,
+        burst: int = 1,
+        stop_when_done: bool = False,
+        drop_every: int = 0,
+        drop_messages: int = 0,
+        stop_when: Optional[Callable[[], bool]] = None,
+    ):
+        self.latency = latency
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.stop_when_done = stop_when_done
+        self.drop_every = drop_every
+        self.drop_messages = drop_messages
+        self.stop_when = stop_when
+        self.entities: dict[int, Entity] = {}
+        self.history: dict[int, list[Message]] = {}
+        self.live: list[tuple[Entity, Message]] = []
+        self.requests = 0
+        self.floods = 0
+        self.delivered: dict[tuple[int, int], float] = {}
+        self.drops = 0
+        self.missed = 0
+        self._replayed = 0
+
+    def _entity(self, rec: dict) -> Entity:
+        chat_id = int(rec["chat_id"])
+        entity = self.entities.get(chat_id)
+        if entity is None:
+            entity = self.entities[chat_id] = Entity(chat_id, rec.get("chat_title"), rec.get("chat_username"))
+            self.history[chat_id] = []
+        return entity
+
+    def add_history(self, records: Iterable[dict]) -> int:
+        """Add Telegram records to the chat histories; returns how many were added.
+
+        Records without numeric chat and message ids or a date are skipped.
+        """
+        added = 0
+        touched = set()
+        for rec in records:
+            if not _telegram(rec):
+                continue
+            entity = self._entity(rec)
+            self.history[entity.id].append(Message(rec))
+            touched.add(entity.id)
+            added += 1
+        for chat_id in touched:
+            self.history[chat_id].sort(key=lambda m: m.id)
+        return added
+
+    def add_live(self, records: Iterable[dict]) -> int:
+        """Queue Telegram records to arrive as NewMessage events, in order."""
+        before = len(self.live)
+        for rec in records:
+            if _telegram(rec):
+                self.live.append((self._entity(rec), Message(rec)))
+        return len(self.live) - before
+
+    def peer_ids(self) -> list[int]:
+        return [get_peer_id(e) for e in self.entities.values()]
+
+    def resolve(self, chat) -> Entity:
+        if isinstance(chat, int) or (isinstance(chat, str) and chat.lstrip("-").isdigit()):
+            n = int(chat)
+            for entity in self.entities.values():
+                if n in (entity.id, get_peer_id(entity)):
+                    return entity
+        elif isinstance(chat, str):
+            name = chat.lstrip("@").lower()
+            for entity in self.entities.values():
+                if entity.username and entity.username.lower() == name:
+                    return entity
+        raise ValueError(f'Cannot find any entity corresponding to "{chat}"')
+
+    async def request(self) -> None:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_every and self.requests % self.flood_every == 0:
+            self.floods += 1
+            raise FloodWaitError(self.flood_seconds)
+
+    def _send(self, entity: Entity, msg: Message) -> None:
+        bisect.insort(self.history[entity.id], msg, key=lambda m: m.id)
+
+    async def replay(self, client: "TelegramClient") -> None:
+        loop = asyncio.get_running_loop()
+        interval = self.burst / self.rate if self.rate > 0 else 0.0
+        due = loop.time()
+        dispatched = 0
+        # Continues where the previous connection stopped.
+        while self._replayed < len(self.live):
+            if self.drop_every and dispatched >= self.drop_every:
+                away = self.live[self._replayed : self._replayed + self.drop_messages]
+                self._replayed += len(away)
+                for entity, msg in away:
+                    self._send(entity, msg)
+                self.drops += 1
+                self.missed += len(away)
+                await client._settle()
+                client._drop()
+                return
+            batch = self.live[self._replayed : self._replayed + self.burst]
+            self._replayed += len(batch)
+            dispatched += len(batch)
+            for entity, msg in batch:
+                self._send(entity, msg)
+                self.delivered[(entity.id, msg.id)] = time.perf_counter()
+                client._dispatch(entity, msg)
+            if interval:
+                due += interval
+                await asyncio.sleep(max(0.0, due - loop.time()))
+            else:
+                await asyncio.sleep(0)
+        await client._settle()
+        if self.stop_when_done:
+            while self.stop_when is not None and not self.stop_when():
+                await asyncio.sleep(0.01)
+            signal.raise_signal(signal.SIGTERM)
+
+
+class NewMessageEvent:
+    def __init__(self, server: FakeServer, entity: Entity, message: Message):
+        self._server = server
+        self._entity = entity
+        self.message = message
+        self.chat_id = get_peer_id(entity)
+
+    async def get_chat(self) -> Entity:
+        await self._server.request()
+        return self._entity
+
+
+class NewMessage:
+    def __init__(self, chats=None, **kwargs):
+        self.chats = chats
+        self._ids: Optional[set[int]] = None
+
+    def matches(self, server: FakeServer, entity: Entity) -> bool:
+        if self.chats is None:
+            return True
+        if self._ids is None:
+            ids = set()
+            chats = self.chats if isinstance(self.chats, (list, tuple, set)) else [self.chats]
+            for chat in chats:
+                try:
+                    ids.add(server.resolve(chat).id)
+                except ValueError:
+                    pass
+            self._ids = ids
+        return entity.id in self._ids
+
+
+class TelegramClient:
+    def __init__(self, session, api_id=None, api_hash=None, **kwargs):
+        if _server is None:
+            raise RuntimeError("fake_telethon.install() has not been called")
+        self._server = _server
+        self._handlers: list = []
+        self._tasks: set = set()
+        self._disconnected: Optional[asyncio.Event] = None
+        self._lost = False
+
+    async def start(self, phone=None, **kwargs) -> "TelegramClient":
+        if self._server.latency:
+            await asyncio.sleep(self._server.latency)
+        self._disconnected = asyncio.Event()
+        return self
+
+    async def get_entity(self, chat) -> Entity:
+        await self._server.request()
+        return self._server.resolve(chat)
+
+    async def iter_messages(
+        self,
+        entity,
+        limit: Optional[int] = None,
+        min_id: int = 0,
+        offset_date=None,
+        add_offset: int = 0,
+        reverse: bool = False,
+    ):
+        history = self._server.history.get(entity.id, [])
+        ids = [m.id for m in history]
+        selected = history[bisect.bisect_right(ids, min_id) :]
+        if offset_date is not None:
+            # Older than offset_date, or with reverse, from offset_date on.
+            if reverse:
+                selected = [m for m in selected if m.date >= offset_date]
+            else:
+                selected = [m for m in selected if m.date < offset_date]
+        if not reverse:
+            selected = selected[::-1]
+        selected = selected[add_offset:]
+        if limit is not None:
+            selected = selected[:limit]
+        for start in range(0, max(1, len(selected)), PAGE_SIZE):
+            await self._server.request()
+            for msg in selected[start : start + PAGE_SIZE]:
+                yield msg
+
+    def on(self, event):
+        def register(fn):
+            self._handlers.append((event, fn))
+            return fn
+
+        return register
+
+    def _dispatch(self, entity: Entity, msg: Message) -> None:
+        for event, fn in self._handlers:
+            if event.matches(self._server, entity):
+                task = asyncio.get_running_loop().create_task(self._handle(fn, NewMessageEvent(self._server, entity, msg)))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, fn, event: NewMessageEvent) -> None:
+        try:
+            await fn(event)
+        except Exception as exc:
+            # Telethon logs handler errors and keeps going.
+            print(f"[fake-telethon] handler failed: {exc!r}", file=sys.stderr)
+
+    async def _settle(self) -> None:
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+    def _drop(self) -> None:
+        self._lost = True
+        self._disconnected.set()
+
+    async def run_until_disconnected(self) -> None:
+        feed = asyncio.get_running_loop().create_task(self._server.replay(self))
+        try:
+            await self._disconnected.wait()
+        finally:
+            feed.cancel()
+        if self._lost:
+            raise ConnectionError("Connection to Telegram lost")
+
+    def disconnect(self):
+        """Disconnect once the result is awaited, as older Telethon versions do inside a running loop."""
+        return self._disconnect()
+
+    async def _disconnect(self) -> None:
+        if self._disconnected is not None:
+            self._disconnected.set()
+
+
+def install(server: FakeServer) -> None:
+    """Serve `import telethon` (and the submodules the scripts use) from `server`."""
+    global _server
+    _server = server
+
+    def module(name: str, **attrs) -> types.ModuleType:
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        return mod
+
+    errors = module("telethon.errors", FloodWaitError=FloodWaitError)
+    events = module("telethon.events", NewMessage=NewMessage)
+    utils = module("telethon.utils", get_peer_id=get_peer_id)
+    sessions = module("telethon.sessions", SQLiteSession=SQLiteSession, StringSession=StringSession)
+    tl_types = module(
+        "telethon.tl.types",
+        MessageActionChatEditTitle=MessageActionChatEditTitle,
+        MessageActionChatAddUser=MessageActionChatAddUser,
+    )
+    tl = module("telethon.tl", types=tl_types)
+    telethon = module(
+        "telethon", TelegramClient=TelegramClient, errors=errors, events=events, utils=utils, sessions=sessions, tl=tl
+    )
+    sys.modules.update(
+        {
+            "telethon": telethon,
+            "telethon.errors": errors,
+            "telethon.events": events,
+            "telethon.utils": utils,
+            "telethon.sessions": sessions,
+            "telethon.tl": tl,
+            "telethon.tl.types": tl_types,
+        }
+    )
@@ -0,0 +1,216 @@
+"""Optional SQLite FTS5 full-text index over the JSONL store.
+
+The database sits next to the store (`<output_jsonl>.fts.sqlite`, or
+`fts.sqlite` inside a segments directory) and only keeps what is needed to
+find records again: the tokenized text plus file name, byte offset, date and
+chat id. Every search first indexes the lines appended since the last one;
+files that were replaced or truncated are reindexed from scratch. Compressed
+day archives (compact_store.py) are indexed whole, by line position instead
+of byte offset, and read back through their frame tables.
+
+Tokenization is SQLite's unicode61 (Unicode case folding, diacritics
+removed) with "ё" folded to "е", so Cyrillic matches regardless of case.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional
+
+from jsonl_archive import ArchiveLines, read_lines
+from jsonl_codec import loads
+from jsonl_index import NO_DATE, date_us, to_us
+from jsonl_store import ARCHIVE_SUFFIXES
+
+FTS_DB = "fts.sqlite"
+BATCH_SIZE = 5000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+    text,
+    file UNINDEXED,
+    offset UNINDEXED,
+    date_us UNINDEXED,
+    chat_id UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+"""
+
+
+_INSERT = "INSERT INTO messages(text, file, offset, date_us, chat_id) VALUES (?, ?, ?, ?, ?)"
+
+
+class FtsUnavailable(RuntimeError):
+    pass
+
+
+def fts_path(store_path: Path) -> Path:
+    if store_path.is_dir():
+        return store_path / FTS_DB
+    return store_path.with_name(store_path.name + ".fts.sqlite")
+
+
+def fold(text: str) -> str:
+    return text.replace("ё", "е").replace("Ё", "Е")
+
+
+def connect(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(db_path))
+    try:
+        conn.executescript(_SCHEMA)
+    except sqlite3.OperationalError as exc:
+        conn.close()
+        raise FtsUnavailable(f"SQLite FTS5 is not available: {exc}") from exc
+    return conn
+
+
+def is_archive(path: Path) -> bool:
+    return path.name.endswith(ARCHIVE_SUFFIXES)
+
+
+def _indexed_from(conn: sqlite3.Connection, path: Path) -> int:
+    row = conn.execute("SELECT dev, ino, size FROM files WHERE name = ?", (path.name,)).fetchone()
+    if row is None:
+        return 0
+    dev, ino, size = row
+    st = path.stat()
+    stale = (dev, ino) != (st.st_dev, st.st_ino) or size > st.st_size
+    if is_archive(path):
+        # Archives are written once; a different size means a new archive.
+        stale = stale or size != st.st_size
+    elif not stale and size > 0:
+        with path.open("rb") as f:
+            f.seek(size - 1)
+            stale = f.read(1) != b"\n"
+    if stale:
+        conn.execute("DELETE FROM messages WHERE file = ?", (path.name,))
+        return 0
+    return size
+
+
+def _lines_from(path: Path, start: int) -> Iterator[tuple[int, int, bytes]]:
+    """(position, end, raw) of the complete lines of a hot file after byte `start`."""
+    pos = start
+    with path.open("rb") as f:
+        f.seek(start)
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break
+            yield pos, pos + len(raw), raw
+            pos += len(raw)
+
+
+def _archive_lines(path: Path, size: int) -> Iterator[tuple[int, int, bytes]]:
+    """(line number, archive size, raw) of every line of an archive."""
+    for i, raw in enumerate(read_lines(path)):
+        yield i, size, raw
+
+
+def sync(conn: sqlite3.Connection, files: list[Path]) -> None:
+    """Index new lines of `files` and forget files that no longer exist.
+
+    `files` may include archives; their records are keyed by line number.
+    """
+    names = {p.name for p in files}
+    with conn:
+        for (name,) in conn.execute("SELECT name FROM files").fetchall():
+            if name not in names:
+                conn.execute("DELETE FROM messages WHERE file = ?", (name,))
+                conn.execute("DELETE FROM files WHERE name = ?", (name,))
+    for path in files:
+        with conn:
+            start = end = _indexed_from(conn, path)
+            if is_archive(path):
+                if start:
+                    continue
+                end = path.stat().st_size
+                lines = _archive_lines(path, end)
+            else:
+                lines = _lines_from(path, start)
+            batch = []
+            for off, end, raw in lines:
+                try:
+                    rec = loads(raw)
+                except ValueError:
+                    continue
+                if not isinstance(rec, dict) or not rec.get("text"):
+                    continue
+                date = date_us(rec.get("date"))
+                if date == NO_DATE:
+                    date = None
+                batch.append((fold(rec["text"]), path.name, off, date, str(rec.get("chat_id", ""))))
+                if len(batch) >= BATCH_SIZE:
+                    conn.executemany(_INSERT, batch)
+                    batch.clear()
+            if batch:
+                conn.executemany(_INSERT, batch)
+            st = path.stat()
+            conn.execute(
+                "INSERT OR REPLACE INTO files(name, dev, ino, size) VALUES (?, ?, ?, ?)",
+                (path.name, st.st_dev, st.st_ino, end),
+            )
+
+
+def build_match(query: str) -> str:
+    """Turn user input into an FTS5 query: all words required, `word*` is a prefix."""
+    terms = []
+    for word in fold(query).split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def search(
+    conn: sqlite3.Connection,
+    files: list[Path],
+    query: str,
+    after_dt: Optional[datetime] = None,
+    before_dt: Optional[datetime] = None,
+) -> Iterator[bytes]:
+    """Yield raw JSONL lines matching `query`, newest first."""
+    match = build_match(query)
+    if not match:
+        return
+    sql = "SELECT file, offset FROM messages WHERE messages MATCH ?"
+    params: list = [match]
+    if after_dt is not None:
+        sql += " AND (date_us IS NULL OR date_us >= ?)"
+        params.append(to_us(after_dt))
+    if before_dt is not None:
+        sql += " AND (date_us IS NULL OR date_us <= ?)"
+        params.append(to_us(before_dt))
+    sql += " ORDER BY date_us DESC, file DESC, offset DESC"
+
+    by_name = {p.name: p for p in files}
+    handles: dict = {}
+    try:
+        for name, offset in conn.execute(sql, params):
+            path = by_name.get(name)
+            if path is None:
+                continue
+            f = handles.get(name)
+            if is_archive(path):
+                if f is None:
+                    f = handles[name] = ArchiveLines(path)
+                raw = f.line(offset)
+                if raw is not None:
+                    yield raw
+                continue
+            if f is None:
+                f = handles[name] = path.open("rb")
+            f.seek(offset)
+            yield f.readline()
+    finally:
+        for f in handles.values():
+            f.close()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+"""Generate a synthetic Telegram + WhatsApp message store for benchmarks.
+
+Records follow references/schema.md and the shapes the writers produce:
+Telegram records carry numeric ids, titles and `+00:00` dates; WhatsApp
+records (whatsapp_listen.js) carry JIDs, `...Z` dates and no titles, which
+analyze_update_chats.py maps through `whatsapp_chats.txt` (written with
+--whatsapp-chats). Messages arrive at --rate per hour as a Poisson process
+across --chats chats with skewed activity. A --monitoring share are alert
+dumps posted by bots into a few alert chats, in the formats the update_chats
+rules look for; the rest are discussion (--cyrillic of it in Russian, some of
+it one-word acks), with --media and --service shares of media and service
+messages. The same arguments and --seed always give the same corpus, and a
+Corpus keeps producing later messages after its first batch.
+
+    python scripts/generate_corpus.py --output /tmp/corpus.jsonl [--records 1000000]
+    python scripts/generate_corpus.py --segments /tmp/corpus --records 100000 --whatsapp-chats /tmp/whatsapp_chats.txt
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, Optional
+
+from jsonl_store import open_writer
+
+RUN_INTERVAL = 900  # seconds between the sync runs that stamp Telegram run_id
+
+RU_WORDS = (
+    "коллеги подскажите пожалуйста сегодня вечером релиз перевод платеж лимиты карта клиент "
+    "проверить выкатка приложение обновление ошибка статус заявка договор счет банк отчет "
+    "согласовать встреча завтра утром срочно посмотрите вопрос ответ тест прод стенд"
+).split()
+EN_WORDS = (
+    "release deploy rollback merchant limits card transfer latency timeout review ticket "
+    "please check today tomorrow status report incident fix build pipeline staging prod"
+).split()
+ACKS = ["ок", "Ок.", "спасибо", "Спасибо!", "принято", "понял", "да", "+", "👍", "👌", "хорошо!", "ok", "thanks"]
+ALERT_SOURCES = ["zabbix", "grafana", "alertmanager", "oem"]
+ALERT_SUBJECTS = [
+    "payment gateway 5xx rate above threshold on ecomm node",
+    "Way4 processing channel to Visa is not responding",
+    "GoldenGate OGG replicat lag on dbk01",
+    "card2card transfer success rate dropped",
+    "3-D Secure ACS timeout for merchant",
+    "traffic drop on upi channel",
+    "Mastercard MPS channel 502 errors",
+    "tablespace usage 85% on reportdb",
+    "disk usage high on backup host",
+    "certificate expires in 14 days on intranet portal",
+]
+SEVERITIES = ["FIRING", "CRITICAL", "WARNING", "DOWN", "🟥", "‼️"]
+CLEARS = ["RESOLVED", "Clear", "🟩"]
+
+
+@dataclass
+class CorpusSpec:
+    chats: int = 40
+    whatsapp: float = 0.25
+    rate: float = 2000.0
+    monitoring: float = 0.2
+    cyrillic: float = 0.7
+    media: float = 0.08
+    service: float = 0.02
+    seed: int = 1
+    start: datetime = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass
+class Chat:
+    source: str
+    chat_id: object
+    title: Optional[str]
+    username: Optional[str]
+    members: list
+    alerts: bool
+    last_id: int = 0
+
+
+class Corpus:
+    """An endless, reproducible message stream; `take(n)` yields the next n records."""
+
+    def __init__(self, spec: CorpusSpec):
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+        self.now = spec.start
+        self.count = 0
+        self.chats = [self._chat(i) for i in range(max(2, spec.chats))]
+        self.alert_chats = [c for c in self.chats if c.alerts]
+        # Zipf-like activity: a few chats carry most of the discussion, the first one most.
+        self.talk_chats = [c for c in self.chats if not c.alerts]
+        self._talk_weights = [1 / (i + 1) for i in range(len(self.talk_chats))]
+        self._stream = self._generate()
+
+    def _chat(self, i: int) -> Chat:
+        rng = self.rng
+        alerts = i < max(1, self.spec.chats // 8)
+        whatsapp = not alerts and rng.random() < self.spec.whatsapp
+        size = rng.randrange(3, 60)
+        if whatsapp:
+            members = [(f"7701{rng.randrange(10**7):07d}@s.whatsapp.net", None) for _ in range(size)]
+            return Chat("whatsapp", f"1203630{rng.randrange(10**11):011d}@g.us", None, None, members, False)
+        if alerts:
+            members = [(5000000000 + j, f"{src}_alerts_bot") for j, src in enumerate(ALERT_SOURCES)]
+            title = f"Мониторинг {i}"
+        else:
+            members = [(rng.randrange(10**8, 10**10), f"user{rng.randrange(10**5)}" if rng.random() < 0.8 else None) for _ in range(size)]
+            title = f"Чат {i}" if rng.random() < 0.7 else f"Team {i}"
+        # Supergroup ids as the writers store them (entity.id, not the -100 peer id).
+        return Chat("telegram", 1000000000 + i, title, f"chat_{i}" if rng.random() < 0.5 else None, members, alerts)
+
+    def whatsapp_chats(self) -> str:
+        """`whatsapp_chats.txt` for the corpus (jid, type and title per line)."""
+        return "".join(f"{c.chat_id}\tgroup\tWA группа {n}\n" for n, c in enumerate(self.chats) if c.source == "whatsapp")
+
+    def take(self, n: int) -> Iterator[dict]:
+        return islice(self._stream, n)
+
+    def _text(self, alerts: bool) -> str:
+        rng = self.rng
+        if alerts:
+            source = rng.choice(ALERT_SOURCES)
+            state = rng.choice(CLEARS) if rng.random() < 0.4 else rng.choice(SEVERITIES)
+            subject = rng.choice(ALERT_SUBJECTS)
+            if source == "oem":
+                return f"SUBJECT: EM Event: {state}: {subject}"
+            return f"FROM: {source}\nSUBJECT: [{state}] {subject}\nhost: node{rng.randrange(40):02d} value={rng.random() * 100:.1f}"
+        roll = rng.random()
+        if roll < 0.15:
+            return rng.choice(ACKS)
+        words = RU_WORDS if rng.random() < self.spec.cyrillic else EN_WORDS
+        # Mostly short messages with a long tail.
+        length = min(200, int(rng.lognormvariate(2.0, 0.9)) + 1)
+        text = " ".join(rng.choice(words) for _ in range(length))
+        return text[0].upper() + text[1:]
+
+    def _generate(self) -> Iterator[dict]:
+        spec = self.spec
+        rng = self.rng
+        mean_gap = 3600.0 / spec.rate
+        while True:
+            self.now += timedelta(seconds=rng.expovariate(1.0 / mean_gap))
+            alerts = rng.random() < spec.monitoring
+            if alerts:
+                chat = rng.choice(self.alert_chats)
+            else:
+                chat = rng.choices(self.talk_chats, self._talk_weights)[0]
+            chat.last_id += 1
+            sender_id, sender_username = rng.choice(chat.members)
+            is_service = not alerts and rng.random() < spec.service
+            has_media = not alerts and not is_service and rng.random() < spec.media
+            if is_service:
+                text = ""
+            elif has_media and rng.random() < 0.6:
+                text = ""
+            else:
+                text = self._text(alerts)
+            reply = chat.last_id > 1 and not is_service and rng.random() < 0.15
+            ts = self.now.replace(microsecond=0)
+            if chat.source == "whatsapp":
+                message_id = f"3EB0{rng.getrandbits(64):016X}"
+                record = {
+                    "source": "whatsapp",
+                    "chat_id": chat.chat_id,
+                    "chat_title": None,
+                    "chat_username": None,
+                    "message_id": message_id,
+                    "date": ts.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                    "sender_id": sender_id,
+                    "sender_username": None,
+                    "text": text,
+                    "is_service": is_service,
+                    "has_media": has_media,
+                    "reply_to_msg_id": f"3EB0{rng.getrandbits(64):016X}" if reply else None,
+                    # The listener stamps the time it started; one start per day.
+                    "run_id": ts.replace(hour=0, minute=0, second=0).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                }
+            else:
+                run = datetime.fromtimestamp((ts.timestamp() // RUN_INTERVAL + 1) * RUN_INTERVAL, timezone.utc)
+                record = {
+                    "source": "telegram",
+                    "chat_id": chat.chat_id,
+                    "chat_title": chat.title,
+                    "chat_username": chat.username,
+                    "message_id": chat.last_id,
+                    "date": ts.isoformat(),
+                    "sender_id": None if is_service else sender_id,
+                    "sender_username": None if is_service else sender_username,
+                    "text": text,
+                    "is_service": is_service,
+                    "has_media": has_media,
+                    "reply_to_msg_id": rng.randrange(max(1, chat.last_id - 50), chat.last_id) if reply else None,
+                    "run_id": run.replace(microsecond=rng.randrange(10**6)).isoformat(),
+                }
+            self.count += 1
+            yield record
+
+
+def write_records(corpus: Corpus, n: int, output: Path, segments: Optional[Path], truncate: bool = False) -> None:
+    """Append the corpus' next `n` records to a store (a JSONL file or a segments directory)."""
+    with open_writer(output, segments, truncate=truncate) as writer:
+        for rec in corpus.take(n):
+            writer.write(rec)
+
+
+def add_spec_arguments(ap: argparse.ArgumentParser) -> None:
+    d = CorpusSpec()
+    ap.add_argument("--chats", type=int, default=d.chats, help=f"Chats in the corpus (default {d.chats})")
+    ap.add_argument("--whatsapp", type=float, default=d.whatsapp, help=f"Share of discussion chats on WhatsApp (default {d.whatsapp})")
+    ap.add_argument("--rate", type=float, default=d.rate, help=f"Messages per hour across all chats (default {d.rate:g})")
+    ap.add_argument("--monitoring", type=float, default=d.monitoring, help=f"Share of messages that are monitoring dumps (default {d.monitoring})")
+    ap.add_argument("--cyrillic", type=float, default=d.cyrillic, help=f"Share of discussion text in Russian (default {d.cyrillic})")
+    ap.add_argument("--media", type=float, default=d.media, help=f"Share of discussion messages with media (default {d.media})")
+    ap.add_argument("--service", type=float, default=d.service, help=f"Share of discussion messages that are service messages (default {d.service})")
+    ap.add_argument("--seed", type=int, default=d.seed, help=f"Random seed (default {d.seed})")
+    ap.add_argument("--start", default=d.start.date().isoformat(), help="UTC date of the first message (default %(default)s)")
+
+
+def spec_from_args(args: argparse.Namespace) -> CorpusSpec:
+    return CorpusSpec(
+        chats=args.chats,
+        whatsapp=args.whatsapp,
+        rate=args.rate,
+        monitoring=args.monitoring,
+        cyrillic=args.cyrillic,
+        media=args.media,
+        service=args.service,
+        seed=args.seed,
+        start=datetime.fromisoformat(args.start).replace(tzinfo=timezone.utc),
+    )
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = ap.add_mutually_exclusive_group(required=True)
+    target.add_argument("--output", help="Write a single JSONL file")
+    target.add_argument("--segments", help="Write a segments directory (one JSONL per day plus manifest.json)")
+    ap.add_argument("--records", type=int, default=100000, help="Records to write (default %(default)s)")
+    ap.add_argument("--whatsapp-chats", help="Also write the WhatsApp jid/title map analyze_update_chats.py reads")
+    add_spec_arguments(ap)
+    args = ap.parse_args()
+
+    corpus = Corpus(spec_from_args(args))
+    segments = Path(args.segments).expanduser() if args.segments else None
+    output = Path(args.output).expanduser() if args.output else segments
+    started = time.perf_counter()
+    write_records(corpus, args.records, output, segments, truncate=True)
+    if args.whatsapp_chats:
+        Path(args.whatsapp_chats).expanduser().write_text(corpus.whatsapp_chats(), encoding="utf-8")
+    elapsed = time.perf_counter() - started
+    print(f"[corpus] {args.records} records up to {corpus.now:%Y-%m-%d %H:%M} UTC in {elapsed:.1f}s -> {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,284 @@
+"""Seekable compressed day archives for cold history.
+
+compact_store.py moves days older than the retention window into archives
+named like segments (`YYYY-MM-DD.jsonl.gz`, or `.jsonl.zst` with the optional
+zstandard package). Records are sorted by (chat_id, date, message_id) and
+compressed as a run of independent frames (gzip members / zstd frames) of
+about FRAME_BYTES of JSONL each, so the archive is still an ordinary stream
+for zcat/zstdcat. The sidecar `<archive>.frames.json` is the offset table:
+
+    {"version": 1, "codec": "gzip", "size": ..., "count": ...,
+     "min_date": "...", "max_date": "...",
+     "chats": {"-100123": {"titles": [...], "usernames": [...]}},
+     "frames": [[offset, length, lines, min_date_us, max_date_us, ["-100123"]], ...]}
+
+Readers only decompress the frames overlapping the date bounds and holding a
+matching chat, and return lines in date order like the hot files. Without a
+valid table (missing, or written for another archive size) the whole archive
+is decompressed instead.
+"""
+
+from __future__ import annotations
+
+import gzip
+import io
+import json
+from bisect import bisect_right
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from jsonl_codec import loads
+from jsonl_index import NO_DATE, date_us, to_us
+from jsonl_store import FRAMES_SUFFIX, SEGMENT_SUFFIX, archive_dir, chat_probes, list_archives
+
+ARCHIVE_VERSION = 1
+CODECS = {"gzip": ".gz", "zstd": ".zst"}
+FRAME_BYTES = 256 * 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as exc:
+        raise RuntimeError("zstd archives need the zstandard package (pip install zstandard)") from exc
+    return zstandard
+
+
+def check_codec(codec: str) -> None:
+    """Raise RuntimeError early if `codec` cannot be used here."""
+    if codec not in CODECS:
+        raise RuntimeError(f"Unknown archive codec: {codec!r} (expected one of {', '.join(sorted(CODECS))})")
+    if codec == "zstd":
+        _zstd()
+
+
+def codec_of(path: Path) -> str:
+    return "zstd" if path.name.endswith(CODECS["zstd"]) else "gzip"
+
+
+def archive_name(day: str, codec: str) -> str:
+    return day + SEGMENT_SUFFIX + CODECS[codec]
+
+
+def frames_path(path: Path) -> Path:
+    return path.with_name(path.name + FRAMES_SUFFIX)
+
+
+def _compress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        return _zstd().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        reader = _zstd().ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True)
+        return reader.read()
+    return gzip.decompress(data)
+
+
+def record_order(rec: dict) -> tuple:
+    """Archive sort key: (chat_id, date, message_id), tolerant of mixed id types."""
+    message_id = rec.get("message_id")
+    if isinstance(message_id, int):
+        mid = (0, message_id, "")
+    else:
+        mid = (1, 0, str(message_id or ""))
+    return str(rec.get("chat_id", "")), date_us(rec.get("date")), mid
+
+
+def write_archive(path: Path, records: list[tuple[dict, bytes]], codec: str) -> dict:
+    """Write (record, raw line) pairs, already in archive order, and their frame table."""
+    chats: dict[str, dict[str, list]] = {}
+    frames = []
+    min_date = max_date = None
+    min_us, max_us = None, None
+    tmp = path.with_name(path.name + ".tmp")
+    offset = 0
+    with tmp.open("wb") as f:
+        i = 0
+        while i < len(records):
+            chunk = []
+            size = 0
+            lo, hi = None, None
+            frame_chats: list[str] = []
+            while i < len(records) and (not chunk or size < FRAME_BYTES):
+                rec, raw = records[i]
+                i += 1
+                chunk.append(raw if raw.endswith(b"\n") else raw + b"\n")
+                size += len(chunk[-1])
+                cid = str(rec.get("chat_id", ""))
+                if not frame_chats or frame_chats[-1] != cid:
+                    frame_chats.append(cid)
+                chat = chats.setdefault(cid, {"titles": [], "usernames": []})
+                title = rec.get("chat_title")
+                if title and title not in chat["titles"]:
+                    chat["titles"].append(title)
+                username = rec.get("chat_username")
+                if username and username not in chat["usernames"]:
+                    chat["usernames"].append(username)
+                d = date_us(rec.get("date"))
+                lo = d if lo is None else min(lo, d)
+                hi = d if hi is None else max(hi, d)
+                if d != NO_DATE:
+                    if min_us is None or d < min_us:
+                        min_us, min_date = d, rec["date"]
+                    if max_us is None or d > max_us:
+                        max_us, max_date = d, rec["date"]
+            data = _compress(codec, b"".join(chunk))
+            f.write(data)
+            frames.append([offset, len(data), len(chunk), lo, hi, sorted(set(frame_chats))])
+            offset += len(data)
+    table = {
+        "version": ARCHIVE_VERSION,
+        "codec": codec,
+        "size": offset,
+        "count": len(records),
+        "min_date": min_date,
+        "max_date": max_date,
+        "chats": chats,
+        "frames": frames,
+    }
+    ftmp = frames_path(tmp)
+    with ftmp.open("w", encoding="utf-8") as f:
+        json.dump(table, f, ensure_ascii=False)
+    tmp.replace(path)
+    ftmp.replace(frames_path(path))
+    return table
+
+
+def load_frames(path: Path) -> Optional[dict]:
+    try:
+        with frames_path(path).open("r", encoding="utf-8") as f:
+            table = json.load(f) or {}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if table.get("version") != ARCHIVE_VERSION or table.get("size") != path.stat().st_size:
+        return None
+    return table
+
+
+def read_lines(path: Path) -> list[bytes]:
+    """Every line of an archive, in archive order."""
+    with path.open("rb") as f:
+        data = _decompress(codec_of(path), f.read())
+    return data.splitlines(keepends=True)
+
+
+class ArchiveLines:
+    """Lines of an archive by position in archive order, decompressing only the frames they are in."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        table = load_frames(path)
+        self._codec = (table or {}).get("codec") or codec_of(path)
+        # (first position, offset, length) per frame; one pseudo-frame for
+        # the whole file without a valid table.
+        self._frames = []
+        first = 0
+        for offset, length, count, *_ in (table or {}).get("frames") or []:
+            self._frames.append((first, offset, length))
+            first += count
+        self._starts = [fr[0] for fr in self._frames]
+        self._lines: dict[int, list[bytes]] = {}
+        self._f = path.open("rb")
+
+    def line(self, pos: int) -> Optional[bytes]:
+        if self._frames:
+            i = bisect_right(self._starts, pos) - 1
+            first, offset, length = self._frames[max(i, 0)]
+        else:
+            i, first, offset, length = 0, 0, 0, -1
+        lines = self._lines.get(i)
+        if lines is None:
+            self._f.seek(offset)
+            lines = self._lines[i] = _decompress(self._codec, self._f.read(length)).splitlines(keepends=True)
+        pos -= first
+        return lines[pos] if 0 <= pos < len(lines) else None
+
+    def close(self) -> None:
+        self._f.close()
+
+
+def _chat_ok(chat_match, chats: dict, cids) -> bool:
+    return any(chat_match(rec) for rec in chat_probes({cid: chats.get(cid) or {} for cid in cids}))
+
+
+def archive_matches(
+    table: dict,
+    after_dt: Optional[datetime] = None,
+    before_dt: Optional[datetime] = None,
+    chat_match: Optional[Callable[[dict], bool]] = None,
+) -> bool:
+    if not table.get("count"):
+        return False
+    undated = any(fr[3] == NO_DATE for fr in table["frames"])
+    if not undated:
+        if after_dt and table.get("max_date") and date_us(table["max_date"]) < to_us(after_dt):
+            return False
+        if before_dt and table.get("min_date") and date_us(table["min_date"]) > to_us(before_dt):
+            return False
+    if chat_match is not None and not _chat_ok(chat_match, table.get("chats") or {}, table.get("chats") or {}):
+        return False
+    return True
+
+
+def select_archives(
+    store_path: Path,
+    after_dt: Optional[datetime] = None,
+    before_dt: Optional[datetime] = None,
+    chat_match: Optional[Callable[[dict], bool]] = None,
+) -> list[Path]:
+    """Archives of a store that may hold records within the date bounds and chat filter."""
+    selected = []
+    for path in list_archives(archive_dir(store_path)):
+        table = load_frames(path)
+        if table is None or archive_matches(table, after_dt, before_dt, chat_match):
+            selected.append(path)
+    return selected
+
+
+def iter_archive(
+    path: Path,
+    chat_match: Optional[Callable[[dict], bool]] = None,
+    after_dt: Optional[datetime] = None,
+    before_dt: Optional[datetime] = None,
+    reverse: bool = False,
+) -> Iterator[bytes]:
+    """Raw lines that may match the filters, in date order (newest first if `reverse`).
+
+    Like jsonl_index.candidate_lines this only narrows the candidates; callers
+    still apply the exact filters.
+    """
+    table = load_frames(path)
+    if table is None:
+        lines = read_lines(path)
+    else:
+        after_us = to_us(after_dt) if after_dt else None
+        before_us = to_us(before_dt) if before_dt else None
+        chats = table.get("chats") or {}
+        codec = table.get("codec") or codec_of(path)
+        lines = []
+        with path.open("rb") as f:
+            for offset, length, _, lo, hi, cids in table["frames"]:
+                if lo != NO_DATE:
+                    if after_us is not None and hi < after_us:
+                        continue
+                    if before_us is not None and lo > before_us:
+                        continue
+                if chat_match is not None and not _chat_ok(chat_match, chats, cids):
+                    continue
+                f.seek(offset)
+                lines.extend(_decompress(codec, f.read(length)).splitlines(keepends=True))
+
+    def by_date(raw: bytes) -> int:
+        try:
+            return date_us(loads(raw).get("date"))
+        except (ValueError, AttributeError):
+            return NO_DATE
+
+    lines.sort(key=by_date, reverse=reverse)
+    yield from lines
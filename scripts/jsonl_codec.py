@@ -0,0 +1,155 @@
+"""JSON encoding and decoding of store records.
+
+Every script reads and writes message records through this module so that
+the JSON backend is chosen in one place: orjson if installed, then msgspec,
+then the stdlib `json` module. `TG_JSON_CODEC=json|orjson|msgspec` forces a
+backend (bench_codec.py compares them).
+
+All backends write the same compact form (`{"a":1,"b":"x"}`, non-ASCII kept
+as UTF-8, one record per line), and all raise ValueError on malformed input.
+
+`decode_message` returns a `Message` with the fields of references/schema.md
+instead of a dict. With msgspec installed it is a `msgspec.Struct` decoded
+and type-checked straight from the line; otherwise a dataclass filled from
+the decoded dict. Unknown fields are ignored either way.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import field, make_dataclass
+from typing import Any, Callable, NamedTuple, Optional, Union
+
+CODEC_ENV = "TG_JSON_CODEC"
+BACKENDS = ("orjson", "msgspec", "json")
+
+Id = Union[int, str, None]
+
+# (name, type, default) in schema.md order; WhatsApp ids are strings.
+MESSAGE_FIELDS = [
+    ("source", Optional[str], None),
+    ("chat_id", Id, None),
+    ("chat_title", Optional[str], None),
+    ("chat_username", Optional[str], None),
+    ("message_id", Id, None),
+    ("date", Optional[str], None),
+    ("sender_id", Id, None),
+    ("sender_username", Optional[str], None),
+    ("text", Optional[str], None),
+    ("is_service", Optional[bool], False),
+    ("has_media", Optional[bool], False),
+    ("reply_to_msg_id", Id, None),
+    ("run_id", Optional[str], None),
+]
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if msgspec is not None:
+    Message = msgspec.defstruct("Message", MESSAGE_FIELDS, gc=False)
+else:
+    Message = make_dataclass(
+        "Message", [(name, typ, field(default=default)) for name, typ, default in MESSAGE_FIELDS]
+    )
+_MESSAGE_FIELD_NAMES = frozenset(name for name, _, _ in MESSAGE_FIELDS)
+
+
+class Codec(NamedTuple):
+    name: str
+    loads: Callable[[Union[bytes, str]], Any]
+    dumps: Callable[[Any], bytes]
+    dumps_line: Callable[[Any], bytes]
+    decode_message: Callable[[Union[bytes, str]], Any]
+
+
+def _message_from_loads(loads):
+    def decode_message(data):
+        rec = loads(data)
+        if not isinstance(rec, dict):
+            raise ValueError("record is not a JSON object")
+        return Message(**{k: v for k, v in rec.items() if k in _MESSAGE_FIELD_NAMES})
+
+    return decode_message
+
+
+def _msgspec_message():
+    decoder = msgspec.json.Decoder(Message)
+
+    def decode_message(data):
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError as exc:
+            raise ValueError(str(exc)) from exc
+
+    return decode_message
+
+
+def _stdlib_codec() -> Codec:
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(obj):
+        return encoder.encode(obj).encode("utf-8")
+
+    def dumps_line(obj):
+        return (encoder.encode(obj) + "\n").encode("utf-8")
+
+    decode_message = _msgspec_message() if msgspec is not None else _message_from_loads(json.loads)
+    return Codec("json", json.loads, dumps, dumps_line, decode_message)
+
+
+def _orjson_codec() -> Codec:
+    def dumps_line(obj):
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+
+    decode_message = _msgspec_message() if msgspec is not None else _message_from_loads(orjson.loads)
+    return Codec("orjson", orjson.loads, orjson.dumps, dumps_line, decode_message)
+
+
+def _msgspec_codec() -> Codec:
+    decoder = msgspec.json.Decoder()
+    encoder = msgspec.json.Encoder()
+
+    def loads(data):
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError as exc:
+            raise ValueError(str(exc)) from exc
+
+    def dumps_line(obj):
+        return encoder.encode(obj) + b"\n"
+
+    return Codec("msgspec", loads, encoder.encode, dumps_line, _msgspec_message())
+
+
+def available() -> list[str]:
+    """Installed backends, fastest first."""
+    return [
+        name for name in BACKENDS if name == "json" or (orjson if name == "orjson" else msgspec) is not None
+    ]
+
+
+def get_codec(name: Optional[str] = None) -> Codec:
+    """The named backend, or the fastest installed one (honouring TG_JSON_CODEC)."""
+    name = name or os.environ.get(CODEC_ENV) or available()[0]
+    if name not in BACKENDS:
+        raise RuntimeError(f"Unknown JSON codec: {name!r} (expected one of {', '.join(BACKENDS)})")
+    if name not in available():
+        raise RuntimeError(f"JSON codec {name!r} is not installed (pip install {name})")
+    return {"json": _stdlib_codec, "orjson": _orjson_codec, "msgspec": _msgspec_codec}[name]()
+
+
+_codec = get_codec()
+BACKEND = _codec.name
+loads = _codec.loads
+dumps = _codec.dumps
+dumps_line = _codec.dumps_line
+decode_message = _codec.decode_message
@@ -0,0 +1,113 @@
+"""Durable per-consumer read cursors over an append-only JSONL file.
+
+A cursor remembers how far a consumer has read (byte offset of the next
+unread line) together with the identity of the file it was reading
+(st_dev/st_ino). When the file is replaced, truncated or rotated the cursor
+no longer matches and the consumer starts again from the beginning.
+
+For a segmented store the cursor keeps one such position per segment file,
+keyed by segment name.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Iterator, Optional
+
+CURSOR_DIR = "cursors"
+
+_NAME_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+@dataclass
+class Cursor:
+    name: str
+    dev: int = 0
+    ino: int = 0
+    offset: int = 0
+    segments: dict[str, list[int]] = field(default_factory=dict)
+
+    def position(self, key: Optional[str] = None) -> tuple[int, int, int]:
+        if key is None:
+            return self.dev, self.ino, self.offset
+        dev, ino, offset = self.segments.get(key) or (0, 0, 0)
+        return dev, ino, offset
+
+
+def cursor_path(cursor_dir: Path, name: str) -> Path:
+    if not _NAME_RE.match(name):
+        raise ValueError(f"Invalid cursor name: {name!r}")
+    return cursor_dir / f"{name}.json"
+
+
+def load_cursor(cursor_dir: Path, name: str) -> Cursor:
+    path = cursor_path(cursor_dir, name)
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            d = json.load(f) or {}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return Cursor(name=name)
+    return Cursor(
+        name=name,
+        dev=int(d.get("dev", 0)),
+        ino=int(d.get("ino", 0)),
+        offset=int(d.get("offset", 0)),
+        segments={str(k): [int(x) for x in v] for k, v in (d.get("segments") or {}).items()},
+    )
+
+
+def save_cursor(cursor_dir: Path, cursor: Cursor) -> None:
+    path = cursor_path(cursor_dir, cursor.name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(asdict(cursor), f, indent=2)
+    tmp.replace(path)
+
+
+def resume_offset(path: Path, cursor: Cursor, key: Optional[str] = None) -> int:
+    """Return the offset to resume reading from, or 0 if the cursor is stale.
+
+    `key` selects a segment position instead of the single-file one.
+    """
+    dev, ino, offset = cursor.position(key)
+    st = path.stat()
+    if (dev, ino) != (st.st_dev, st.st_ino):
+        return 0
+    if offset <= 0 or offset > st.st_size:
+        return 0
+    # Cursors always stop right after a newline; anything else means the file
+    # was truncated and rewritten in place.
+    with path.open("rb") as f:
+        f.seek(offset - 1)
+        if f.read(1) != b"\n":
+            return 0
+    return offset
+
+
+def advance(path: Path, cursor: Cursor, offset: int, key: Optional[str] = None) -> Cursor:
+    st = path.stat()
+    if key is None:
+        return Cursor(name=cursor.name, dev=st.st_dev, ino=st.st_ino, offset=offset, segments=cursor.segments)
+    segments = dict(cursor.segments)
+    segments[key] = [st.st_dev, st.st_ino, offset]
+    return Cursor(name=cursor.name, dev=cursor.dev, ino=cursor.ino, offset=cursor.offset, segments=segments)
+
+
+def iter_lines_from(path: Path, offset: int = 0) -> Iterator[tuple[int, bytes]]:
+    """Yield (end_offset, raw_line) for every complete line after `offset`.
+
+    A trailing line without a newline is still being written by a listener and
+    is left for the next run.
+    """
+    with path.open("rb") as f:
+        f.seek(offset)
+        pos = offset
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break
+            pos += len(raw)
+            yield pos, raw
@@ -0,0 +1,288 @@
+"""Sidecar offset index for a JSONL data file.
+
+For `data/telegram_messages.jsonl` the index lives in
+`data/telegram_messages.jsonl.idx/` (one per segment in a segmented store):
+
+- `meta.json`: file identity, how many bytes are indexed, and per chat its
+  slot number, entry count and the titles/usernames seen (to resolve --chat).
+- `chats/chat_<slot>.off` and `.dt`: int64 arrays of byte offsets and
+  message dates (epoch microseconds) in file order.
+- `blocks.bin`: int64 triples (start offset, min date, max date) for every
+  BLOCK_LINES lines, used to skip whole ranges on date-only queries. A block
+  holding an undated record spans [NO_DATE, MAX_DATE] and is never skipped.
+
+The index is extended with the lines appended since the last run and rebuilt
+from scratch when the data file was replaced, truncated or rewritten.
+Lookups only narrow the candidates; callers still apply the exact filters.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import mmap
+import shutil
+from array import array
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from jsonl_codec import loads
+from jsonl_store import iter_lines_reverse
+
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+BLOCK_LINES = 1024
+NO_DATE = -(2**63)
+MAX_DATE = 2**63 - 1
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_US = timedelta(microseconds=1)
+
+
+def index_dir(data_path: Path) -> Path:
+    return data_path.with_name(data_path.name + INDEX_SUFFIX)
+
+
+def to_us(dt: datetime) -> int:
+    return (dt - _EPOCH) // _US
+
+
+def date_us(value) -> int:
+    if not value or not isinstance(value, str):
+        return NO_DATE
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return NO_DATE
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return to_us(dt)
+
+
+def _read_array(path: Path, count: int) -> array:
+    a = array("q")
+    if count <= 0:
+        return a
+    with path.open("rb") as f:
+        a.fromfile(f, count)
+    return a
+
+
+def _load_meta(idx: Path) -> dict:
+    try:
+        with (idx / "meta.json").open("r", encoding="utf-8") as f:
+            return json.load(f) or {}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_meta(idx: Path, meta: dict) -> None:
+    path = idx / "meta.json"
+    tmp = path.with_suffix(".json.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    tmp.replace(path)
+
+
+def _is_current(data_path: Path, meta: dict) -> bool:
+    if meta.get("version") != INDEX_VERSION:
+        return False
+    st = data_path.stat()
+    if (meta.get("dev"), meta.get("ino")) != (st.st_dev, st.st_ino):
+        return False
+    size = int(meta.get("size", 0))
+    if size > st.st_size:
+        return False
+    if size > 0:
+        with data_path.open("rb") as f:
+            f.seek(size - 1)
+            if f.read(1) != b"\n":
+                return False
+    return True
+
+
+def _trim(path: Path, count: int) -> None:
+    # Drop entries written after the last committed meta.json (crash mid-update).
+    size = count * 8
+    if path.exists() and path.stat().st_size > size:
+        with path.open("r+b") as f:
+            f.truncate(size)
+
+
+def update_index(data_path: Path) -> dict:
+    """Index the lines appended since the last update and return the meta."""
+    idx = index_dir(data_path)
+    idx.mkdir(parents=True, exist_ok=True)
+    with (idx / "lock").open("a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        meta = _load_meta(idx)
+        if not _is_current(data_path, meta):
+            shutil.rmtree(idx / "chats", ignore_errors=True)
+            (idx / "blocks.bin").unlink(missing_ok=True)
+            st = data_path.stat()
+            meta = {
+                "version": INDEX_VERSION,
+                "dev": st.st_dev,
+                "ino": st.st_ino,
+                "size": 0,
+                "lines": 0,
+                "chats": {},
+            }
+        chats_dir = idx / "chats"
+        chats_dir.mkdir(exist_ok=True)
+        chats: dict[str, dict] = meta["chats"]
+        for chat in chats.values():
+            _trim(chats_dir / f"chat_{chat['slot']}.off", chat["count"])
+            _trim(chats_dir / f"chat_{chat['slot']}.dt", chat["count"])
+
+        blocks = _read_array(idx / "blocks.bin", 3 * ((meta["lines"] + BLOCK_LINES - 1) // BLOCK_LINES))
+        new_off: dict[str, array] = {}
+        new_dt: dict[str, array] = {}
+        pos = start = int(meta["size"])
+        lines = int(meta["lines"])
+        with data_path.open("rb") as f:
+            f.seek(start)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                off = pos
+                pos += len(raw)
+                try:
+                    rec = loads(raw)
+                except ValueError:
+                    continue
+                if not isinstance(rec, dict):
+                    continue
+                date = date_us(rec.get("date"))
+                if lines % BLOCK_LINES == 0:
+                    blocks.extend((off, MAX_DATE, NO_DATE))
+                if date == NO_DATE:
+                    blocks[-2], blocks[-1] = NO_DATE, MAX_DATE
+                else:
+                    blocks[-2] = min(blocks[-2], date)
+                    blocks[-1] = max(blocks[-1], date)
+                lines += 1
+
+                cid = str(rec.get("chat_id", ""))
+                chat = chats.get(cid)
+                if chat is None:
+                    chat = chats[cid] = {"slot": len(chats), "count": 0, "titles": [], "usernames": []}
+                    _trim(chats_dir / f"chat_{chat['slot']}.off", 0)
+                    _trim(chats_dir / f"chat_{chat['slot']}.dt", 0)
+                title = rec.get("chat_title")
+                if title and title not in chat["titles"]:
+                    chat["titles"].append(title)
+                username = rec.get("chat_username")
+                if username and username not in chat["usernames"]:
+                    chat["usernames"].append(username)
+                new_off.setdefault(cid, array("q")).append(off)
+                new_dt.setdefault(cid, array("q")).append(date)
+
+        if pos == start:
+            return meta
+        for cid, offs in new_off.items():
+            chat = chats[cid]
+            with (chats_dir / f"chat_{chat['slot']}.off").open("ab") as f:
+                offs.tofile(f)
+            with (chats_dir / f"chat_{chat['slot']}.dt").open("ab") as f:
+                new_dt[cid].tofile(f)
+            chat["count"] += len(offs)
+        tmp = idx / "blocks.bin.tmp"
+        with tmp.open("wb") as f:
+            blocks.tofile(f)
+        tmp.replace(idx / "blocks.bin")
+        meta["size"] = pos
+        meta["lines"] = lines
+        _save_meta(idx, meta)
+        return meta
+
+
+def _date_ok(date: int, after_us: Optional[int], before_us: Optional[int]) -> bool:
+    if date == NO_DATE:
+        return True
+    if after_us is not None and date < after_us:
+        return False
+    if before_us is not None and date > before_us:
+        return False
+    return True
+
+
+def _chat_offsets(idx: Path, meta: dict, chat_match, after_us, before_us) -> list[int]:
+    offsets: list[int] = []
+    for cid, chat in meta["chats"].items():
+        probes = [{"chat_id": cid}]
+        probes += [{"chat_id": cid, "chat_title": t} for t in chat["titles"]]
+        probes += [{"chat_id": cid, "chat_username": u} for u in chat["usernames"]]
+        if not any(chat_match(p) for p in probes):
+            continue
+        offs = _read_array(idx / "chats" / f"chat_{chat['slot']}.off", chat["count"])
+        if after_us is None and before_us is None:
+            offsets.extend(offs)
+            continue
+        dts = _read_array(idx / "chats" / f"chat_{chat['slot']}.dt", chat["count"])
+        offsets.extend(o for o, d in zip(offs, dts) if _date_ok(d, after_us, before_us))
+    offsets.sort()
+    return offsets
+
+
+def _block_ranges(idx: Path, meta: dict, after_us, before_us) -> list[tuple[int, int]]:
+    n = (meta["lines"] + BLOCK_LINES - 1) // BLOCK_LINES
+    blocks = _read_array(idx / "blocks.bin", 3 * n)
+    ranges: list[tuple[int, int]] = []
+    for i in range(n):
+        start, lo, hi = blocks[3 * i], blocks[3 * i + 1], blocks[3 * i + 2]
+        end = blocks[3 * i + 3] if i + 1 < n else meta["size"]
+        if after_us is not None and hi < after_us:
+            continue
+        if before_us is not None and lo > before_us:
+            continue
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def candidate_lines(
+    data_path: Path,
+    chat_match: Optional[Callable[[dict], bool]] = None,
+    after_dt: Optional[datetime] = None,
+    before_dt: Optional[datetime] = None,
+    reverse: bool = False,
+) -> Iterator[bytes]:
+    """Raw lines (in file order, or last to first) that may match the chat and date filters.
+
+    The index is brought up to date before returning, so OSError from a
+    read-only data directory surfaces here rather than mid-iteration.
+    """
+    meta = update_index(data_path)
+    return _iter_candidates(data_path, meta, chat_match, after_dt, before_dt, reverse)
+
+
+def _iter_candidates(data_path: Path, meta: dict, chat_match, after_dt, before_dt, reverse) -> Iterator[bytes]:
+    size = int(meta["size"])
+    if size == 0:
+        return
+    idx = index_dir(data_path)
+    after_us = to_us(after_dt) if after_dt else None
+    before_us = to_us(before_dt) if before_dt else None
+    if chat_match is None and reverse:
+        for start, end in reversed(_block_ranges(idx, meta, after_us, before_us)):
+            yield from iter_lines_reverse(data_path, start, end)
+        return
+    with data_path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if chat_match is not None:
+            offsets = _chat_offsets(idx, meta, chat_match, after_us, before_us)
+            for off in reversed(offsets) if reverse else offsets:
+                end = mm.find(b"\n", off, size)
+                yield mm[off : end + 1]
+            return
+        for start, end in _block_ranges(idx, meta, after_us, before_us):
+            pos = start
+            while pos < end:
+                nl = mm.find(b"\n", pos, end)
+                yield mm[pos : nl + 1]
+                pos = nl + 1
@@ -0,0 +1,173 @@
+"""Raw-line prefilter for --chat/--contains scans.
+
+Decoding JSON is most of the cost of a scan, yet a selective query rejects
+almost every line. A line can only match if its raw bytes contain the text
+searched for, so `LinePrefilter` looks for the needles in whole blocks of
+the file (mmap + find) and hands only the lines they occur in to the JSON
+decoder. Callers still apply the exact filters to the decoded records; the
+prefilter only has to never drop a line that could match.
+
+Needles are matched in their JSON-escaped form (`"` as `\\"`, newline as
+`\\n`, ...), which is how every writer of the store escapes them, and
+case-insensitively like `str.lower()`: ASCII needles with `find` on the
+ASCII-lowered block, others with a bytes regex listing the UTF-8 spellings
+of each character's upper and lower case. Text may also be written as
+`\\uXXXX` (or `\\/` for `/`) by other JSON encoders; lines containing such
+escapes cannot be judged from their bytes and are always passed on.
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import re
+from pathlib import Path
+from typing import Iterator, Optional
+
+BLOCK_BYTES = 4 << 20
+
+# Characters whose lower case does not map back to them with upper(): U+0130
+# lowers to two characters, KELVIN SIGN to "k", titlecase digraphs, ... Taken
+# from the Unicode database; besides a character itself and its upper/title
+# case, these are the only characters that lower() turns into it.
+_IRREGULAR_UPPER = (
+    "İǅǈǋǲϴẞᾈᾉᾊᾋᾌᾍ"
+    "ᾎᾏᾘᾙᾚᾛᾜᾝᾞᾟᾨᾩᾪ"
+    "ᾫᾬᾭᾮᾯᾼῌῼΩKÅ"
+)
+
+
+def chat_needles(filters: list[str]) -> Optional[list[str]]:
+    """What a line matching any of record_filter.match_chat's filters must contain.
+
+    None if some filter matches every record (an empty title substring).
+    """
+    needles = []
+    for f in filters:
+        # An @username filter also matches titles containing "@name"; both contain "name".
+        needle = f[1:] if f.startswith("@") else f
+        if not needle:
+            return None
+        needles.append(needle)
+    return needles
+
+
+def _escape(text: str) -> str:
+    return json.dumps(text, ensure_ascii=False)[1:-1]
+
+
+def _spellings(ch: str) -> list[bytes]:
+    """UTF-8 spellings, as they look after bytes.lower(), of text whose lower() is `ch`."""
+    if ch.isascii():
+        return [_escape(ch).encode("utf-8")]
+    chars = {ch} | {c for c in (ch.upper(), ch.title()) if len(c) == 1 and c.lower() == ch}
+    chars |= {c for c in _IRREGULAR_UPPER if c.lower() == ch}
+    return sorted(c.encode("utf-8") for c in chars)
+
+
+def _markers(needle: str) -> list[bytes]:
+    """Bytes whose presence means a line may match `needle` without containing a spelling of it."""
+    markers = [b"\\u"]
+    if "/" in needle:
+        markers.append(b"\\/")
+    for c in _IRREGULAR_UPPER:
+        low = c.lower()
+        # Multi-character lower cases, and ASCII ones bytes.lower() does not produce.
+        if (len(low) > 1 or low.isascii()) and any(x in needle for x in low):
+            markers.append(c.encode("utf-8"))
+    return markers
+
+
+class _Needle:
+    """One case-insensitive needle, searched for in ASCII-lowered bytes."""
+
+    def __init__(self, text: str):
+        text = text.lower()
+        self.markers = _markers(text)
+        self._literal: Optional[bytes] = None
+        self._regex = None
+        if text.isascii():
+            self._literal = _escape(text).encode("utf-8")
+            return
+        parts = []
+        for ch in text:
+            spellings = [re.escape(s) for s in _spellings(ch)]
+            parts.append(spellings[0] if len(spellings) == 1 else b"(?:" + b"|".join(spellings) + b")")
+        self._regex = re.compile(b"".join(parts))
+
+    def find(self, hay: bytes, pos: int = 0) -> int:
+        if self._literal is not None:
+            return hay.find(self._literal, pos)
+        m = self._regex.search(hay, pos)
+        return m.start() if m else -1
+
+
+class LinePrefilter:
+    """Lines that contain, for every group, at least one of the group's needles."""
+
+    def __init__(self, groups: list[list[str]]):
+        self._groups = []
+        for group in groups:
+            needles = [_Needle(n) for n in group]
+            markers = sorted({m for n in needles for m in n.markers})
+            self._groups.append((needles, markers))
+
+    def line_ok(self, raw: bytes) -> bool:
+        low = raw.lower()
+        return all(
+            any(n.find(low) >= 0 for n in needles) or any(m in raw for m in markers)
+            for needles, markers in self._groups
+        )
+
+    def _block_candidates(self, block: bytes) -> Iterator[tuple[int, bytes]]:
+        """(end offset, line) for the candidate lines of a block of complete lines."""
+        low = block.lower()
+
+        def collect(find, hay: bytes, spans: dict[int, int]) -> None:
+            pos = find(hay, 0)
+            while pos >= 0:
+                start = hay.rfind(b"\n", 0, pos) + 1
+                end = hay.find(b"\n", pos) + 1
+                spans[start] = end
+                pos = find(hay, end)
+
+        keep: Optional[dict[int, int]] = None
+        for needles, markers in self._groups:
+            spans: dict[int, int] = {}
+            for n in needles:
+                collect(n.find, low, spans)
+            for m in markers:
+                collect(lambda hay, pos, m=m: hay.find(m, pos), block, spans)
+            keep = spans if keep is None else {k: v for k, v in keep.items() if k in spans}
+            if not keep:
+                return
+        for start in sorted(keep):
+            yield keep[start], block[start : keep[start]]
+
+    def scan(self, path: Path, offset: int = 0, end: Optional[int] = None) -> Iterator[tuple[int, Optional[bytes]]]:
+        """Like jsonl_cursor.iter_lines_from, but only for lines that may match.
+
+        After each block it also yields (end offset, None), so a cursor reader
+        can record how far the file was read past the last candidate. `end`,
+        if given, must be a line boundary; the scan stops there.
+        """
+        with path.open("rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if end is not None:
+                size = min(size, end)
+            if size <= offset:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pos = offset
+                while pos < size:
+                    nl = mm.rfind(b"\n", pos, min(pos + BLOCK_BYTES, size))
+                    if nl < 0:
+                        # A line longer than a block, or the unfinished last line.
+                        nl = mm.find(b"\n", pos + BLOCK_BYTES, size)
+                        if nl < 0:
+                            return
+                    for end, line in self._block_candidates(mm[pos : nl + 1]):
+                        yield pos + end, line
+                    pos = nl + 1
+                    yield pos, None
@@ -0,0 +1,407 @@
+"""Writers and segment layout for the JSONL message store.
+
+The store is either a single append-only JSONL file (`output_jsonl`) or, when
+`output_segments_dir` is configured, a directory with one segment per UTC day
+of the message date (`YYYY-MM-DD.jsonl`, plus `undated.jsonl` for records
+without a usable date) and a `manifest.json` describing each segment:
+
+    {"version": 1, "segments": {"2026-02-04.jsonl": {
+        "dev": ..., "ino": ..., "size": ..., "count": ...,
+        "min_date": "...", "max_date": "...",
+        "chats": {"-100123": {"titles": [...], "usernames": [...]}}}}}
+
+Writers only append to segments. The manifest is brought up to date lazily by
+`refresh_manifest`, which rescans just the bytes appended since the recorded
+size, so any writer (including the Node WhatsApp listener) can roll segments
+without coordinating on the manifest.
+
+Days older than the retention window can be moved by compact_store.py into
+compressed archives (`YYYY-MM-DD.jsonl.gz` or `.jsonl.zst`, see
+jsonl_archive.py), kept in the segments directory or in `<output_jsonl>.archive/`.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from jsonl_codec import dumps_line, loads
+
+MANIFEST = "manifest.json"
+MANIFEST_LOCK = "manifest.lock"
+SEGMENT_SUFFIX = ".jsonl"
+UNDATED_SEGMENT = "undated" + SEGMENT_SUFFIX
+MAX_OPEN_SEGMENTS = 16
+REVERSE_CHUNK = 1 << 20
+FLUSH_LINES = 1024
+ARCHIVE_DIR_SUFFIX = ".archive"
+ARCHIVE_SUFFIXES = (SEGMENT_SUFFIX + ".gz", SEGMENT_SUFFIX + ".zst")
+FRAMES_SUFFIX = ".frames.json"
+
+
+def parse_dt(value: str) -> datetime:
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def _record_dt(rec: dict) -> Optional[datetime]:
+    value = rec.get("date")
+    if not value:
+        return None
+    try:
+        return parse_dt(value).astimezone(timezone.utc)
+    except Exception:
+        return None
+
+
+def segment_name(rec: dict) -> str:
+    dt = _record_dt(rec)
+    if dt is None:
+        return UNDATED_SEGMENT
+    return dt.strftime("%Y-%m-%d") + SEGMENT_SUFFIX
+
+
+def segment_path(segments_dir: Path, rec: dict) -> Path:
+    return segments_dir / segment_name(rec)
+
+
+def list_segments(segments_dir: Path) -> list[Path]:
+    if not segments_dir.is_dir():
+        return []
+    return sorted(p for p in segments_dir.iterdir() if p.is_file() and p.suffix == SEGMENT_SUFFIX)
+
+
+def archive_dir(store_path: Path) -> Path:
+    """Where compact_store.py puts compressed day archives for a store."""
+    if store_path.is_dir():
+        return store_path
+    return store_path.with_name(store_path.name + ARCHIVE_DIR_SUFFIX)
+
+
+def list_archives(directory: Path) -> list[Path]:
+    if not directory.is_dir():
+        return []
+    return sorted(
+        p for p in directory.iterdir() if p.is_file() and p.name.endswith(ARCHIVE_SUFFIXES)
+    )
+
+
+def remove_archives(store_path: Path) -> None:
+    for p in list_archives(archive_dir(store_path)):
+        p.with_name(p.name + FRAMES_SUFFIX).unlink(missing_ok=True)
+        p.unlink()
+
+
+def store_files(path: Path) -> list[Path]:
+    """Files backing a store path: the segments of a directory, or the file itself."""
+    if path.is_dir():
+        return list_segments(path)
+    return [path]
+
+
+def iter_lines_reverse(
+    path: Path, start: int = 0, end: Optional[int] = None, chunk_size: int = REVERSE_CHUNK
+) -> Iterator[bytes]:
+    """Yield complete lines of path[start:end] from last to first, without newlines.
+
+    Reads backwards in `chunk_size` blocks, so taking the last few lines of a
+    large file costs roughly the size of those lines. A trailing line without
+    a newline is still being written and is skipped, as in forward reads.
+    """
+    with path.open("rb") as f:
+        if end is None:
+            end = f.seek(0, 2)
+        pos = end
+        tail = b""
+        dropping = True
+        while pos > start:
+            size = min(chunk_size, pos - start)
+            pos -= size
+            f.seek(pos)
+            buf = f.read(size) + tail
+            if dropping:
+                cut = buf.rfind(b"\n")
+                if cut < 0:
+                    tail = b""
+                    continue
+                buf = buf[:cut]
+                dropping = False
+            lines = buf.split(b"\n")
+            tail = lines[0]
+            for line in reversed(lines[1:]):
+                yield line
+        if not dropping:
+            yield tail
+
+
+class _AppendFile:
+    """Buffered appender that follows the path if the file is replaced.
+
+    compact_store.py swaps rewritten files in under the same name (or removes
+    an archived segment); lines are buffered until `flush`, which first checks
+    that the open handle is still the file at `path` and reopens it if not, so
+    nothing is appended to an unlinked inode for longer than a flush.
+    """
+
+    def __init__(self, path: Path, truncate: bool = False):
+        self.path = path
+        self._pending: list[bytes] = []
+        self._f = path.open("wb" if truncate else "ab")
+
+    def write(self, line: bytes) -> None:
+        self._pending.append(line)
+        if len(self._pending) >= FLUSH_LINES:
+            self.flush()
+
+    def _follow(self) -> None:
+        fst = os.fstat(self._f.fileno())
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        if st is None or (st.st_dev, st.st_ino) != (fst.st_dev, fst.st_ino):
+            self._f.close()
+            self._f = self.path.open("ab")
+
+    def flush(self, fsync: bool = False) -> None:
+        if self._pending:
+            self._follow()
+            self._f.write(b"".join(self._pending))
+            self._pending.clear()
+        self._f.flush()
+        if fsync:
+            os.fsync(self._f.fileno())
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._f.close()
+
+
+class JsonlWriter:
+    """Append records to a single JSONL file."""
+
+    def __init__(self, path: Path, truncate: bool = False):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        if truncate:
+            remove_archives(path)
+        self._f = _AppendFile(path, truncate=truncate)
+
+    def write(self, record: dict) -> None:
+        self._f.write(dumps_line(record))
+
+    def flush(self, fsync: bool = False) -> None:
+        self._f.flush(fsync=fsync)
+
+    def close(self) -> None:
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SegmentWriter:
+    """Append records to per-day segments, keeping a few segment handles open."""
+
+    def __init__(self, segments_dir: Path, truncate: bool = False):
+        segments_dir.mkdir(parents=True, exist_ok=True)
+        if truncate:
+            for p in list_segments(segments_dir):
+                p.unlink()
+            (segments_dir / MANIFEST).unlink(missing_ok=True)
+            remove_archives(segments_dir)
+        self.segments_dir = segments_dir
+        self._open: "OrderedDict[str, _AppendFile]" = OrderedDict()
+
+    def _handle(self, name: str) -> _AppendFile:
+        f = self._open.get(name)
+        if f is not None:
+            self._open.move_to_end(name)
+            return f
+        if len(self._open) >= MAX_OPEN_SEGMENTS:
+            _, oldest = self._open.popitem(last=False)
+            oldest.close()
+        f = _AppendFile(self.segments_dir / name)
+        self._open[name] = f
+        return f
+
+    def write(self, record: dict) -> None:
+        self._handle(segment_name(record)).write(dumps_line(record))
+
+    def flush(self, fsync: bool = False) -> None:
+        for f in self._open.values():
+            f.flush(fsync=fsync)
+
+    def close(self) -> None:
+        while self._open:
+            _, f = self._open.popitem(last=False)
+            f.close()
+        refresh_manifest(self.segments_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_writer(output_path: Path, segments_dir: Optional[Path], truncate: bool = False):
+    if segments_dir is not None:
+        return SegmentWriter(segments_dir, truncate=truncate)
+    return JsonlWriter(output_path, truncate=truncate)
+
+
+def _load_manifest(segments_dir: Path) -> dict:
+    try:
+        with (segments_dir / MANIFEST).open("r", encoding="utf-8") as f:
+            manifest = json.load(f) or {}
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+    manifest.setdefault("version", 1)
+    manifest.setdefault("segments", {})
+    return manifest
+
+
+def _save_manifest(segments_dir: Path, manifest: dict) -> None:
+    path = segments_dir / MANIFEST
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    tmp.replace(path)
+
+
+def _scan_segment(path: Path, entry: dict, start: int) -> dict:
+    """Fold the complete lines of `path` after `start` into a manifest entry."""
+    chats: dict[str, dict[str, list]] = entry.setdefault("chats", {})
+    count = int(entry.get("count", 0))
+    min_date = entry.get("min_date")
+    max_date = entry.get("max_date")
+    undated = int(entry.get("undated", 0))
+    pos = start
+    with path.open("rb") as f:
+        f.seek(start)
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break
+            pos += len(raw)
+            try:
+                rec = loads(raw)
+            except ValueError:
+                continue
+            if not isinstance(rec, dict):
+                continue
+            count += 1
+            chat = chats.setdefault(str(rec.get("chat_id", "")), {"titles": [], "usernames": []})
+            title = rec.get("chat_title")
+            if title and title not in chat["titles"]:
+                chat["titles"].append(title)
+            username = rec.get("chat_username")
+            if username and username not in chat["usernames"]:
+                chat["usernames"].append(username)
+            dt = _record_dt(rec)
+            if dt is None:
+                undated += 1
+                continue
+            iso = dt.isoformat()
+            if min_date is None or iso < min_date:
+                min_date = iso
+            if max_date is None or iso > max_date:
+                max_date = iso
+    st = path.stat()
+    entry.update(
+        {
+            "dev": st.st_dev,
+            "ino": st.st_ino,
+            "size": pos,
+            "count": count,
+            "min_date": min_date,
+            "max_date": max_date,
+            "undated": undated,
+        }
+    )
+    return entry
+
+
+def refresh_manifest(segments_dir: Path) -> dict:
+    """Bring the manifest in line with the segments on disk and return it."""
+    segments_dir.mkdir(parents=True, exist_ok=True)
+    with (segments_dir / MANIFEST_LOCK).open("a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = _load_manifest(segments_dir)
+        entries: dict[str, dict] = manifest["segments"]
+        on_disk = {p.name: p for p in list_segments(segments_dir)}
+        changed = False
+        for name in list(entries):
+            if name not in on_disk:
+                del entries[name]
+                changed = True
+        for name, path in on_disk.items():
+            st = path.stat()
+            entry = entries.get(name)
+            if entry and (entry.get("dev"), entry.get("ino")) == (st.st_dev, st.st_ino):
+                if st.st_size == entry.get("size"):
+                    continue
+                if st.st_size > entry.get("size", 0):
+                    _scan_segment(path, entry, int(entry.get("size", 0)))
+                    changed = True
+                    continue
+            # New, replaced or truncated segment: rescan from scratch.
+            entries[name] = _scan_segment(path, {}, 0)
+            changed = True
+        if changed:
+            _save_manifest(segments_dir, manifest)
+        return manifest
+
+
+def select_segments(
+    segments_dir: Path,
+    after_dt: Optional[datetime] = None,
+    before_dt: Optional[datetime] = None,
+    chat_match: Optional[Callable[[dict], bool]] = None,
+) -> list[Path]:
+    """Segments that may hold records within the date bounds and chat filter.
+
+    `chat_match` is called with stand-in records carrying chat_id plus one known
+    title or username, so it should be the same predicate applied per record.
+    """
+    manifest = refresh_manifest(segments_dir)
+    selected = []
+    for name in sorted(manifest["segments"]):
+        entry = manifest["segments"][name]
+        if not entry.get("count"):
+            continue
+        if not entry.get("undated"):
+            if after_dt and entry.get("max_date") and parse_dt(entry["max_date"]) < after_dt:
+                continue
+            if before_dt and entry.get("min_date") and parse_dt(entry["min_date"]) > before_dt:
+                continue
+        if chat_match is not None and not any(
+            chat_match(rec) for rec in chat_probes(entry.get("chats") or {})
+        ):
+            continue
+        selected.append(segments_dir / name)
+    return selected
+
+
+def chat_probes(chats: dict):
+    for chat_id, meta in chats.items():
+        yield {"chat_id": chat_id}
+        for title in meta.get("titles") or []:
+            yield {"chat_id": chat_id, "chat_title": title}
+        for username in meta.get("usernames") or []:
+            yield {"chat_id": chat_id, "chat_username": username}
+
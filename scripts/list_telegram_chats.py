@@ -1,25 +1,9 @@
 #!/usr/bin/env python
 import argparse
-import json
 from pathlib import Path
 
-import yaml
-from telethon.sync import TelegramClient
-
-
-def load_config(config_path: Path) -> dict:
-    with config_path.open("r", encoding="utf-8") as f:
-        return yaml.safe_load(f) or {}
-
-
-def resolve_path(config_path: Path, value: str, default_relative: str) -> Path:
-    if value:
-        p = Path(value)
-    else:
-        p = Path(default_relative)
-    if not p.is_absolute():
-        p = config_path.parent / p
-    return p
+from config_loader import load_config, resolve_path
+from jsonl_codec import dumps
 
 
 def main() -> int:
@@ -38,6 +22,8 @@ def main() -> int:
     api_hash = cfg["api_hash"]
     phone = cfg.get("phone")
 
+    from telethon.sync import TelegramClient
+
     with TelegramClient(str(session_path), api_id, api_hash) as client:
         client.start(phone=phone)
 
@@ -54,7 +40,7 @@ def main() -> int:
             }
 
             if args.json:
-                print(json.dumps(record, ensure_ascii=False))
+                print(dumps(record).decode("utf-8"))
             else:
                 title = record["title"] or record["username"] or "(no title)"
                 kind = "channel" if record["is_channel"] else "group" if record["is_group"] else "user" if record["is_user"] else "chat"
@@ -0,0 +1,62 @@
+"""Per-chat progress of telegram_listen.py, for catching up after a reconnect.
+
+Telegram does not replay the NewMessage updates a client missed while it
+was disconnected. The listener therefore remembers, per configured chat, the
+newest message id known to be on disk: the chat's newest message when the
+listener started, then each id the writer commits. After a reconnect it
+fetches every chat's messages after that id (`iter_messages(min_id=...)`)
+while live events are already flowing again.
+
+Both paths `claim` a message before queueing it, so one that arrives live
+and is also in the fetched range is written once: while a chat is being
+caught up, ids are claimed first come first served, and afterwards a live
+event for a message at or below the newest one fetched is a late duplicate.
+Commits during a catch-up do not move the chat's id: live messages newer
+than the gap could otherwise hide the rest of it from the next catch-up if
+the connection drops again. The claimed ids are kept until a catch-up
+finishes, so a retry after another drop skips what was already queued.
+"""
+
+from __future__ import annotations
+
+
+class GapTracker:
+    def __init__(self):
+        self.last_ids: dict[int, int] = {}
+        self._claimed: dict[int, set[int]] = {}
+        self._fetched_to: dict[int, int] = {}
+
+    def seen(self, chat_id: int, message_id: int) -> None:
+        """Track `chat_id`, noting `message_id` as on disk or older than the listener's start."""
+        self.last_ids[chat_id] = max(self.last_ids.get(chat_id, 0), message_id)
+
+    def committed(self, batch: list, seconds: float = 0.0) -> None:
+        """BatchWriter on_commit hook: advance the tracked chats not being caught up."""
+        for record in batch:
+            chat_id = record.get("chat_id")
+            if chat_id in self.last_ids and chat_id not in self._claimed:
+                self.seen(chat_id, record["message_id"])
+
+    def begin(self, chat_id: int) -> int:
+        """Start (or resume) catching up `chat_id`; returns the id to fetch after."""
+        self._claimed.setdefault(chat_id, set())
+        return self.last_ids[chat_id]
+
+    def claim(self, chat_id: int, message_id: int) -> bool:
+        """False if `message_id` is already queued or on disk by way of a catch-up."""
+        claimed = self._claimed.get(chat_id)
+        if claimed is None:
+            return message_id > self._fetched_to.get(chat_id, 0)
+        if message_id in claimed:
+            return False
+        claimed.add(message_id)
+        return True
+
+    def finish(self, chat_id: int, fetched_to: int) -> None:
+        """End the catch-up of `chat_id` once everything it claimed is on disk.
+
+        `fetched_to` is the newest message id the catch-up fetched.
+        """
+        claimed = self._claimed.pop(chat_id, None)
+        self._fetched_to[chat_id] = fetched_to
+        self.seen(chat_id, max(claimed or (), default=fetched_to))
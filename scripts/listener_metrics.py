@@ -0,0 +1,165 @@
+"""Runtime metrics of the live listeners, written as a Prometheus text file.
+
+telegram_listen.py keeps a ListenerMetrics and rewrites `listener_metrics_file`
+(default `data/telegram_listener.prom` next to the config; `false` turns it
+off) every `listener_metrics_interval` seconds and on exit. whatsapp_listen.js
+writes the same metric names to `whatsapp_metrics_file` (default
+`data/whatsapp_listener.prom`). The files can be scraped by node_exporter's
+textfile collector or read directly, as check_listeners.sh does. Metrics (all labelled with `source`):
+
+    listener_messages_total{chat}                counter   records persisted
+    listener_messages_per_second{chat}           gauge     over the last interval
+    listener_handler_seconds                     histogram event handler, update to queued
+    listener_write_seconds                       histogram one batch: write, flush, fsync
+    listener_lag_seconds                         histogram persist time minus message date
+    listener_queue_depth                         gauge     records waiting for the writer
+    listener_reconnects_total                    counter   connections after the first
+    listener_fail_streak                         gauge     failed connects in a row
+    listener_connected                           gauge     1 while connected
+    listener_last_persist_timestamp_seconds      gauge     unix time of the last write
+    listener_metrics_updated_timestamp_seconds   gauge     unix time this file was written
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+from typing import Callable
+
+from jsonl_store import parse_dt
+
+DEFAULT_INTERVAL = 10.0
+HANDLER_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+WRITE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+LAG_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 86400.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name: str, source: str) -> list[str]:
+        out = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            out.append(f"{name}_bucket{_labels(source=source, le=_number(bound))} {cumulative}")
+        out.append(f'{name}_bucket{_labels(source=source, le="+Inf")} {self.count}')
+        out.append(f"{name}_sum{_labels(source=source)} {_number(self.sum)}")
+        out.append(f"{name}_count{_labels(source=source)} {self.count}")
+        return out
+
+
+class ListenerMetrics:
+    def __init__(self, source: str):
+        self.source = source
+        self.messages: dict[str, int] = {}
+        self.handler = Histogram(HANDLER_BUCKETS)
+        self.write = Histogram(WRITE_BUCKETS)
+        self.lag = Histogram(LAG_BUCKETS)
+        self.reconnects = 0
+        self.fail_streak = 0
+        self.connected = False
+        self.last_persist = 0.0
+        # Called at render time, e.g. BatchWriter.qsize.
+        self.queue_depth: Callable[[], int] = lambda: 0
+        self._rates: dict[str, float] = {}
+        self._previous: tuple[float, dict[str, int]] = (time.monotonic(), {})
+
+    def committed(self, batch: list, seconds: float) -> None:
+        """Account for a batch of records that has just been written."""
+        now = time.time()
+        self.write.observe(seconds)
+        self.last_persist = now
+        for record in batch:
+            chat = str(record.get("chat_id"))
+            self.messages[chat] = self.messages.get(chat, 0) + 1
+            date = record.get("date")
+            if date:
+                try:
+                    self.lag.observe(max(0.0, now - parse_dt(date).timestamp()))
+                except ValueError:
+                    pass
+
+    def _update_rates(self) -> None:
+        now = time.monotonic()
+        then, counts = self._previous
+        elapsed = now - then
+        if elapsed > 0:
+            self._rates = {chat: (n - counts.get(chat, 0)) / elapsed for chat, n in self.messages.items()}
+        self._previous = (now, dict(self.messages))
+
+    def render(self) -> str:
+        self._update_rates()
+        src = self.source
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: list[str]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+
+        metric(
+            "listener_messages_total",
+            "counter",
+            "Records persisted, per chat.",
+            [f"listener_messages_total{_labels(source=src, chat=c)} {n}" for c, n in sorted(self.messages.items())],
+        )
+        metric(
+            "listener_messages_per_second",
+            "gauge",
+            "Records persisted per second over the last metrics interval, per chat.",
+            [f"listener_messages_per_second{_labels(source=src, chat=c)} {r:.3f}" for c, r in sorted(self._rates.items())],
+        )
+        metric("listener_handler_seconds", "histogram", "Time from update to record queued.", self.handler.lines("listener_handler_seconds", src))
+        metric("listener_write_seconds", "histogram", "Time to write, flush and fsync one batch.", self.write.lines("listener_write_seconds", src))
+        metric("listener_lag_seconds", "histogram", "Persist time minus message date.", self.lag.lines("listener_lag_seconds", src))
+        metric("listener_queue_depth", "gauge", "Records waiting for the writer.", [f"listener_queue_depth{_labels(source=src)} {self.queue_depth()}"])
+        metric("listener_reconnects_total", "counter", "Connections after the first one.", [f"listener_reconnects_total{_labels(source=src)} {self.reconnects}"])
+        metric("listener_fail_streak", "gauge", "Failed connection attempts in a row.", [f"listener_fail_streak{_labels(source=src)} {self.fail_streak}"])
+        metric("listener_connected", "gauge", "1 while connected.", [f"listener_connected{_labels(source=src)} {int(self.connected)}"])
+        metric(
+            "listener_last_persist_timestamp_seconds",
+            "gauge",
+            "Unix time of the last write.",
+            [f"listener_last_persist_timestamp_seconds{_labels(source=src)} {self.last_persist:.3f}"],
+        )
+        metric(
+            "listener_metrics_updated_timestamp_seconds",
+            "gauge",
+            "Unix time these metrics were written.",
+            [f"listener_metrics_updated_timestamp_seconds{_labels(source=src)} {time.time():.3f}"],
+        )
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path: Path) -> None:
+        """Replace `path` atomically, so readers never see a partial file."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
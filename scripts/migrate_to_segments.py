@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from config_loader import load_config, resolve_path
+from jsonl_store import SegmentWriter, list_segments
+
+
+_decoder = json.JSONDecoder()
+
+
+def parse_many(line: str):
+    # Older WhatsApp listener builds wrote a literal "\n" instead of a newline,
+    # so one physical line may hold several records.
+    s = line.replace("\\n", "\n") if "}\\n{" in line else line
+    i, n = 0, len(s)
+    while i < n:
+        while i < n and s[i].isspace():
+            i += 1
+        if i >= n:
+            break
+        try:
+            obj, i = _decoder.raw_decode(s, i)
+        except ValueError:
+            return
+        if isinstance(obj, dict):
+            yield obj
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Split a monolithic JSONL store into per-day segments.")
+    parser.add_argument("--config", required=True, help="Path to YAML config file")
+    parser.add_argument("--segments-dir", help="Target directory (defaults to output_segments_dir from config)")
+    parser.add_argument("--force", action="store_true", help="Append into a segments directory that is not empty")
+    args = parser.parse_args()
+
+    config_path = Path(args.config).expanduser().resolve()
+    cfg = load_config(config_path)
+
+    source = resolve_path(config_path, cfg.get("output_jsonl", ""), "data/telegram_messages.jsonl")
+    if not source.exists():
+        print(f"JSONL not found: {source}", file=sys.stderr)
+        return 1
+
+    segments_value = args.segments_dir or cfg.get("output_segments_dir") or ""
+    if not segments_value:
+        print("No target: pass --segments-dir or set output_segments_dir in config", file=sys.stderr)
+        return 2
+    segments_dir = resolve_path(config_path, segments_value, segments_value)
+    if list_segments(segments_dir) and not args.force:
+        print(f"Segments directory is not empty: {segments_dir} (use --force to append)", file=sys.stderr)
+        return 2
+
+    count = 0
+    skipped = 0
+    with source.open("r", encoding="utf-8", errors="replace") as f, SegmentWriter(segments_dir) as out:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            found = False
+            for rec in parse_many(line):
+                out.write(rec)
+                count += 1
+                found = True
+            if not found:
+                skipped += 1
+
+    segments = list_segments(segments_dir)
+    print(f"[migrate] wrote {count} records into {len(segments)} segments under {segments_dir}")
+    if skipped:
+        print(f"[migrate] skipped {skipped} unparsable lines", file=sys.stderr)
+    print(f"[migrate] source left in place: {source}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
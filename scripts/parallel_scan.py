@@ -0,0 +1,133 @@
+"""Multi-process scans for query_telegram.py --workers.
+
+The files to scan are cut into newline-aligned byte ranges (a compressed
+archive is one task), and each task is filtered by a ProcessPoolExecutor
+worker: decode, apply the RecordFilter, and send back the matching records
+already encoded for output. The parent takes the results task by task in
+file order (last task first for --latest), with only a few tasks per worker
+in flight, so it can stop and cancel the queued ones once --limit is
+reached.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from dedup import record_key
+from jsonl_archive import iter_archive
+from jsonl_codec import dumps_line, loads
+from record_filter import RecordFilter
+
+RANGE_BYTES = 16 << 20
+TASKS_PER_WORKER = 2
+
+
+class ScanTask(NamedTuple):
+    path: str
+    start: int = 0
+    end: int = 0
+    archive: bool = False
+
+
+def split_ranges(path: Path, range_bytes: int = RANGE_BYTES) -> list[tuple[int, int]]:
+    """Newline-aligned [start, end) ranges covering the complete lines of `path`."""
+    with path.open("rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            last = mm.rfind(b"\n") + 1
+            ranges = []
+            start = 0
+            while start < last:
+                end = mm.find(b"\n", min(start + range_bytes, last) - 1, last) + 1
+                ranges.append((start, end))
+                start = end
+    return ranges
+
+
+def _read_range(path: Path, start: int, end: int) -> list[bytes]:
+    with path.open("rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return data.split(b"\n")[:-1]
+
+
+def run_task(
+    task: ScanTask, record_filter: RecordFilter, prefilter: bool, reverse: bool, keys: bool, cap: int
+) -> list[tuple[Optional[tuple], bytes]]:
+    """(dedup key, output line) for the matching records of one task, in scan order.
+
+    With `cap`, only the first `cap` matches are kept (the newest if `reverse`).
+    """
+    path = Path(task.path)
+    line_filter = record_filter.prefilter() if prefilter else None
+    if task.archive:
+        lines: Iterable[bytes] = iter_archive(
+            path, record_filter.chat_match(), record_filter.after, record_filter.before, reverse=reverse
+        )
+        if line_filter is not None:
+            lines = filter(line_filter.line_ok, lines)
+    else:
+        if line_filter is not None:
+            lines = [raw for _, raw in line_filter.scan(path, task.start, task.end) if raw is not None]
+        else:
+            lines = _read_range(path, task.start, task.end)
+        if reverse:
+            lines.reverse()
+
+    matches = []
+    for raw in lines:
+        line = raw.strip()
+        if not line:
+            continue
+        try:
+            rec = loads(line)
+        except ValueError:
+            continue
+        if not record_filter.matches(rec):
+            continue
+        matches.append((record_key(rec) if keys else None, dumps_line(rec)))
+        if cap and len(matches) >= cap:
+            break
+    return matches
+
+
+def iter_parallel(
+    tasks: list[ScanTask],
+    workers: int,
+    record_filter: RecordFilter,
+    prefilter: bool = True,
+    reverse: bool = False,
+    keys: bool = False,
+    cap: int = 0,
+) -> Iterator[tuple[Optional[tuple], bytes]]:
+    """Yield what `run_task` returns for each task, in the order of `tasks`.
+
+    Closing the iterator cancels the tasks not started yet and waits for the
+    running ones, so the workers are gone before the caller moves on; a pool
+    left to the interpreter's exit hooks can print tracebacks at exit.
+    """
+    pool = ProcessPoolExecutor(max_workers=workers)
+    queue = iter(tasks)
+    pending = deque()
+
+    def submit(n: int) -> None:
+        for task in islice(queue, n):
+            pending.append(pool.submit(run_task, task, record_filter, prefilter, reverse, keys, cap))
+
+    try:
+        submit(workers * TASKS_PER_WORKER)
+        while pending:
+            matches = pending.popleft().result()
+            submit(1)
+            yield from matches
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True, cancel_futures=True)
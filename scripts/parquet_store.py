@@ -0,0 +1,441 @@
+"""Optional Parquet copy of the JSONL store, for `query_telegram.py --engine arrow`.
+
+The copy sits next to the store (`<output_jsonl>.parquet/`, or `parquet/`
+inside a segments directory), partitioned by record source and UTC day:
+`source=telegram/day=2026-03-01/<file>.<offset>.parquet`, with `day=undated`
+for records without a date. Like fts_index, every export only converts the
+lines appended since the last one; files that were replaced or truncated are
+exported again, and the parts of files that no longer exist (segments moved
+into archives by compact_store.py) are dropped. Archives are exported whole.
+
+chat_id, chat_title, chat_username, sender_id and sender_username are
+dictionary-encoded, so analytics can group and filter on them cheaply. Each
+row also keeps the record as query_telegram.py writes it (`line`), the file
+it came from and its position in the forward and `--latest` scans of that
+file, so the arrow engine outputs exactly what the default scan would.
+
+`manifest.json` lists the exported files and, per part, its date range and
+chats, so queries skip parts that cannot match before reading them.
+"""
+
+from __future__ import annotations
+
+import bisect
+import fcntl
+import functools
+import json
+import operator
+import unicodedata
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+from dedup import record_key
+from jsonl_archive import iter_archive
+from jsonl_codec import dumps, dumps_line, loads
+from jsonl_cursor import iter_lines_from
+from jsonl_index import NO_DATE, date_us, to_us
+from jsonl_store import archive_dir, chat_probes, list_archives, store_files
+from record_filter import RecordFilter
+
+PARQUET_DIR = "parquet"
+MANIFEST = "manifest.json"
+EXPORT_LOCK = "export.lock"
+EXPORT_VERSION = 1
+CHUNK_ROWS = 100_000
+ROW_GROUP_ROWS = 10_000
+READ_BATCH = 10_000
+UNDATED_DAY = "undated"
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as exc:
+        raise RuntimeError("Parquet export needs the pyarrow package (pip install pyarrow)") from exc
+    return pyarrow
+
+
+def parquet_path(store_path: Path) -> Path:
+    if store_path.is_dir():
+        return store_path / PARQUET_DIR
+    return store_path.with_name(store_path.name + ".parquet")
+
+
+def _build() -> str:
+    # --contains lower-cases text with pyarrow where it agrees with Python's
+    # str.lower(); the exceptions stored at export depend on both versions.
+    pa = _pyarrow()
+    return f"pyarrow {pa.__version__}, unicode {unicodedata.unidata_version}"
+
+
+def _schema():
+    pa = _pyarrow()
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema(
+        [
+            ("source", dictionary),
+            ("chat_id", dictionary),
+            ("chat_title", dictionary),
+            ("chat_username", dictionary),
+            ("sender_id", dictionary),
+            ("sender_username", dictionary),
+            ("message_id", pa.string()),
+            ("date", pa.timestamp("us", tz="UTC")),
+            ("text", pa.string()),
+            # Python's lower() of `text` where pyarrow's utf8_lower differs (e.g. "İ", final "Σ").
+            ("text_lower", pa.string()),
+            ("file", dictionary),
+            ("offset", pa.int64()),
+            ("rev", pa.int64()),
+            ("key", pa.binary()),
+            ("line", pa.binary()),
+        ]
+    )
+
+
+def _text(value) -> Optional[str]:
+    """A str value arrow can store: lone surrogates (valid JSON escapes) are replaced."""
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        value = str(value)
+    try:
+        value.encode("utf-8")
+    except UnicodeEncodeError:
+        value = value.encode("utf-8", "surrogatepass").decode("utf-8", "replace")
+    return value
+
+
+def _safe(value: str) -> str:
+    return "".join(c if c.isalnum() or c in "._-" else "_" for c in value) or "_"
+
+
+def _day(us: int) -> str:
+    if us == NO_DATE:
+        return UNDATED_DAY
+    try:
+        return (_EPOCH + timedelta(microseconds=us)).strftime("%Y-%m-%d")
+    except OverflowError:
+        return UNDATED_DAY
+
+
+def load_manifest(export_dir: Path, rebuild: bool = False) -> dict:
+    try:
+        with (export_dir / MANIFEST).open("r", encoding="utf-8") as f:
+            manifest = json.load(f) or {}
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+    if rebuild or manifest.get("version") != EXPORT_VERSION or manifest.get("build") != _build():
+        manifest = {"version": EXPORT_VERSION, "build": _build(), "files": {}, "parts": {}}
+    return manifest
+
+
+def _save_manifest(export_dir: Path, manifest: dict) -> None:
+    path = export_dir / MANIFEST
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    tmp.replace(path)
+
+
+class _Chunk:
+    """Rows of one source file being converted, grouped by partition."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.groups: dict[tuple[str, str], list[tuple]] = {}
+        self.rows = 0
+
+    def add(self, raw: bytes, offset: int, rev: int) -> None:
+        try:
+            rec = loads(raw)
+        except ValueError:
+            return
+        if not isinstance(rec, dict):
+            return
+        source = _text(rec.get("source") or "telegram")
+        us = date_us(rec.get("date"))
+        key = record_key(rec)
+        sender_id = rec.get("sender_id")
+        self.groups.setdefault((_safe(source), _day(us)), []).append(
+            (
+                source,
+                _text(str(rec.get("chat_id", ""))),
+                _text(rec.get("chat_title") or ""),
+                _text(rec.get("chat_username") or ""),
+                None if sender_id is None else _text(str(sender_id)),
+                _text(rec.get("sender_username")),
+                None if key is None else _text(key[2]),
+                None if us == NO_DATE else us,
+                _text(rec.get("text") or ""),
+                offset,
+                rev,
+                None if key is None else dumps(list(key)),
+                dumps_line(rec),
+            )
+        )
+        self.rows += 1
+
+    def write(self, export_dir: Path, manifest: dict, tag: int) -> None:
+        pa = _pyarrow()
+        pc = pa.compute
+        schema = _schema()
+        entry = manifest["files"][self.name]
+        for (source, day), rows in sorted(self.groups.items()):
+            cols = list(zip(*rows))
+            text = pa.array(cols[8], pa.string())
+            lowered = pa.array([t.lower() for t in cols[8]], pa.string())
+            same = pc.equal(pc.utf8_lower(text), lowered)
+            arrays = [pa.array(cols[i], pa.string()).dictionary_encode() for i in range(6)]
+            arrays += [
+                pa.array(cols[6], pa.string()),
+                pa.array(cols[7], pa.int64()).cast(schema.field("date").type),
+                text,
+                pc.if_else(same, pa.scalar(None, pa.string()), lowered),
+                pa.array([self.name] * len(rows), pa.string()).dictionary_encode(),
+                pa.array(cols[9], pa.int64()),
+                pa.array(cols[10], pa.int64()),
+                pa.array(cols[11], pa.binary()),
+                pa.array(cols[12], pa.binary()),
+            ]
+            rel = f"source={source}/day={day}/{_safe(self.name)}.{tag}.parquet"
+            path = export_dir / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + ".tmp")
+            pa.parquet.write_table(pa.Table.from_arrays(arrays, schema=schema), tmp, row_group_size=ROW_GROUP_ROWS)
+            tmp.replace(path)
+
+            dates = [d for d in cols[7] if d is not None]
+            chats: dict[str, dict[str, set]] = {}
+            for chat_id, title, username in zip(cols[1], cols[2], cols[3]):
+                meta = chats.setdefault(chat_id, {"titles": set(), "usernames": set()})
+                meta["titles"].add(title)
+                if username:
+                    meta["usernames"].add(username)
+            manifest["parts"][rel] = {
+                "rows": len(rows),
+                "min_date": min(dates, default=None),
+                "max_date": max(dates, default=None),
+                "undated": len(dates) < len(rows),
+                "chats": {
+                    cid: {"titles": sorted(meta["titles"]), "usernames": sorted(meta["usernames"])}
+                    for cid, meta in chats.items()
+                },
+            }
+            entry["parts"].append(rel)
+        self.groups.clear()
+        self.rows = 0
+
+
+def _drop(export_dir: Path, manifest: dict, name: str) -> None:
+    entry = manifest["files"].pop(name, None)
+    for rel in (entry or {}).get("parts", []):
+        manifest["parts"].pop(rel, None)
+        (export_dir / rel).unlink(missing_ok=True)
+
+
+def _exported_from(export_dir: Path, manifest: dict, path: Path, archive: bool) -> Optional[int]:
+    """Offset to export `path` from, or None if it is up to date; stale exports are dropped."""
+    entry = manifest["files"].get(path.name)
+    st = path.stat()
+    if entry is not None:
+        stale = (entry["dev"], entry["ino"]) != (st.st_dev, st.st_ino) or entry["size"] > st.st_size
+        if archive:
+            stale = stale or entry["size"] != st.st_size
+        elif not stale and entry["size"] > 0:
+            with path.open("rb") as f:
+                f.seek(entry["size"] - 1)
+                stale = f.read(1) != b"\n"
+        if not stale:
+            return None if archive else entry["size"]
+        _drop(export_dir, manifest, path.name)
+    manifest["files"][path.name] = {"dev": st.st_dev, "ino": st.st_ino, "size": 0, "parts": []}
+    return 0
+
+
+def _export_file(export_dir: Path, manifest: dict, path: Path, start: int) -> bool:
+    """Export the complete lines of `path` after `start`; False if there were none."""
+    chunk = _Chunk(path.name)
+    entry = manifest["files"][path.name]
+    tag = pos = start
+    for pos, raw in iter_lines_from(path, start):
+        offset = pos - len(raw)
+        chunk.add(raw, offset, -offset)
+        if chunk.rows >= CHUNK_ROWS:
+            chunk.write(export_dir, manifest, tag)
+            entry["size"] = tag = pos
+            _save_manifest(export_dir, manifest)
+    if chunk.rows:
+        chunk.write(export_dir, manifest, tag)
+    entry["size"] = pos
+    return pos != start
+
+
+def _export_archive(export_dir: Path, manifest: dict, path: Path) -> None:
+    # Forward scans read an archive in date order (ties in archive order)
+    # and --latest reads it newest first, ties still in archive order.
+    lines = list(iter_archive(path))
+
+    def by_date(i: int) -> int:
+        try:
+            return date_us(loads(lines[i]).get("date"))
+        except (ValueError, AttributeError):
+            return NO_DATE
+
+    dates = [by_date(i) for i in range(len(lines))]
+    rev = [0] * len(lines)
+    for pos, i in enumerate(sorted(range(len(lines)), key=dates.__getitem__, reverse=True)):
+        rev[i] = pos
+    chunk = _Chunk(path.name)
+    for i, raw in enumerate(lines):
+        chunk.add(raw, i, rev[i])
+    chunk.write(export_dir, manifest, 0)
+    manifest["files"][path.name]["size"] = path.stat().st_size
+
+
+def export(store_path: Path, rebuild: bool = False) -> dict:
+    """Bring the Parquet copy of the store up to date (or convert it all again); returns its manifest."""
+    export_dir = parquet_path(store_path)
+    export_dir.mkdir(parents=True, exist_ok=True)
+    with (export_dir / EXPORT_LOCK).open("a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = load_manifest(export_dir, rebuild)
+        hot = store_files(store_path)
+        archives = list_archives(archive_dir(store_path))
+        names = {p.name for p in hot + archives}
+        for name in list(manifest["files"]):
+            if name not in names:
+                _drop(export_dir, manifest, name)
+        # Parts a crashed export wrote but never recorded, or a rebuild let go.
+        for path in export_dir.glob("source=*/day=*/*.parquet*"):
+            if path.relative_to(export_dir).as_posix() not in manifest["parts"]:
+                path.unlink(missing_ok=True)
+        for path in archives:
+            if _exported_from(export_dir, manifest, path, archive=True) is not None:
+                _export_archive(export_dir, manifest, path)
+                _save_manifest(export_dir, manifest)
+        for path in hot:
+            start = _exported_from(export_dir, manifest, path, archive=False)
+            if _export_file(export_dir, manifest, path, start) or start == 0:
+                _save_manifest(export_dir, manifest)
+    return manifest
+
+
+def _part_matches(part: dict, after_us: Optional[int], before_us: Optional[int], chat_match) -> bool:
+    if not part["undated"]:
+        if after_us is not None and part["max_date"] is not None and part["max_date"] < after_us:
+            return False
+        if before_us is not None and part["min_date"] is not None and part["min_date"] > before_us:
+            return False
+    return chat_match is None or any(chat_match(rec) for rec in chat_probes(part["chats"]))
+
+
+def _expression(record_filter: RecordFilter, chats: dict):
+    """(dataset filter or None, columns it reads) for `record_filter`; (False, []) if no chat in `chats` matches."""
+    pa = _pyarrow()
+    ds, pc = pa.dataset, pa.compute
+    conds = []
+    columns = []
+
+    chat_match = record_filter.chat_match()
+    if chat_match is not None:
+        # match_chat() ORs one check per field, so testing each distinct
+        # value on its own gives exactly the values a matching row can hold.
+        ids = sorted(cid for cid in chats if chat_match({"chat_id": cid}))
+        titles = sorted({t for meta in chats.values() for t in meta["titles"] if chat_match({"chat_title": t})})
+        users = sorted({u for meta in chats.values() for u in meta["usernames"] if chat_match({"chat_username": u})})
+        chat_conds = []
+        for column, values in (("chat_id", ids), ("chat_title", titles), ("chat_username", users)):
+            if values:
+                chat_conds.append(ds.field(column).isin(pa.array(values, pa.string())))
+                columns.append(column)
+        if not chat_conds:
+            return False, []
+        conds.append(functools.reduce(operator.or_, chat_conds))
+    date_type = pa.timestamp("us", tz="UTC")
+    if record_filter.after is not None:
+        conds.append(ds.field("date").is_null() | (ds.field("date") >= pa.scalar(to_us(record_filter.after), date_type)))
+    if record_filter.before is not None:
+        conds.append(ds.field("date").is_null() | (ds.field("date") <= pa.scalar(to_us(record_filter.before), date_type)))
+    if record_filter.after is not None or record_filter.before is not None:
+        columns.append("date")
+    if record_filter.contains:
+        lowered = pc.coalesce(ds.field("text_lower"), pc.utf8_lower(ds.field("text")))
+        conds.append(pc.match_substring(lowered, record_filter.contains))
+        columns += ["text", "text_lower"]
+    return (functools.reduce(operator.and_, conds) if conds else None), columns
+
+
+def _read_part(path: Path, expr, columns: list[str], position: str, keys: bool):
+    """The rows of one part matching `expr`, with their `position`, line and (if `keys`) key.
+
+    The filter columns are read and evaluated first; `line` is then read
+    only from the row groups holding a match.
+    """
+    pa = _pyarrow()
+    part = pa.parquet.ParquetFile(path)
+    table = part.read(columns=[position] + columns)
+    table = table.append_column("row", pa.array(range(table.num_rows), pa.int64()))
+    if expr is not None:
+        table = table.filter(expr)
+    rows = table.column("row").to_pylist()
+    wanted = ["line", "key"] if keys else ["line"]
+    pieces = []
+    first = 0
+    for group in range(part.num_row_groups):
+        end = first + part.metadata.row_group(group).num_rows
+        lo, hi = bisect.bisect_left(rows, first), bisect.bisect_left(rows, end)
+        if lo < hi:
+            taken = pa.array([row - first for row in rows[lo:hi]], pa.int64())
+            pieces.append(part.read_row_group(group, columns=wanted).take(taken))
+        first = end
+    lines = pa.concat_tables(pieces) if pieces else _schema().empty_table().select(wanted)
+    return lines.append_column(position, table.column(position))
+
+
+def select_lines(
+    export_dir: Path,
+    manifest: dict,
+    names: list[str],
+    record_filter: RecordFilter,
+    reverse: bool = False,
+    keys: bool = False,
+) -> Iterator[tuple[Optional[bytes], bytes]]:
+    """Yield (dedup key if `keys`, else None; line) for the records matching `record_filter`.
+
+    `names` are store files in query_telegram.py's scan order; records come
+    in the order that scan reads them, or as the `--latest` scan does if
+    `reverse`. Each file is read only once the previous one is used up.
+    """
+    pa = _pyarrow()
+    chat_match = record_filter.chat_match()
+    after_us = to_us(record_filter.after) if record_filter.after else None
+    before_us = to_us(record_filter.before) if record_filter.before else None
+    position = "rev" if reverse else "offset"
+    for name in reversed(names) if reverse else names:
+        entry = manifest["files"].get(name)
+        if entry is None:
+            continue
+        parts = [rel for rel in entry["parts"] if _part_matches(manifest["parts"][rel], after_us, before_us, chat_match)]
+        if not parts:
+            continue
+        chats: dict[str, dict[str, set]] = {}
+        for rel in parts:
+            for cid, meta in manifest["parts"][rel]["chats"].items():
+                merged = chats.setdefault(cid, {"titles": set(), "usernames": set()})
+                merged["titles"].update(meta["titles"])
+                merged["usernames"].update(meta["usernames"])
+        expr, columns = _expression(record_filter, chats)
+        if expr is False:
+            continue
+        tables = [_read_part(export_dir / rel, expr, columns, position, keys) for rel in parts]
+        table = pa.concat_tables(tables).sort_by(position)
+        for batch in table.to_batches(max_chunksize=READ_BATCH):
+            lines = batch.column("line").to_pylist()
+            yield from zip(batch.column("key").to_pylist() if keys else [None] * len(lines), lines)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""Thin client for query_daemon.py, with the arguments and output of query_telegram.py.
+
+Sends the arguments to the daemon's Unix socket and copies its answer to
+stdout. If no daemon is listening, the query runs in-process through
+query_telegram.py instead, so the answer is the same either way. Only the
+standard library is imported before that fallback, which keeps a query the
+daemon answers close to bare interpreter startup.
+
+The socket is `$TG_QUERY_SOCKET`, or `data/query.sock` next to the config
+file. Protocol: the client sends one JSON line `{"argv": [...], "cwd": "..."}`;
+the daemon replies with one JSON line `{"status": 0, "stderr": "...",
+"source": "window|cache|scan"}`, then the JSONL output, and closes the
+connection. Queries with --profile or --cprofile always run in-process.
+"""
+
+import json
+import os
+import shutil
+import socket
+import sys
+from pathlib import Path
+from typing import Optional
+
+SOCKET_ENV = "TG_QUERY_SOCKET"
+SOCKET_NAME = "data/query.sock"
+CONNECT_TIMEOUT = 1.0
+
+
+def config_arg(argv: list[str]) -> Optional[str]:
+    for i, arg in enumerate(argv):
+        if arg == "--config" and i + 1 < len(argv):
+            return argv[i + 1]
+        if arg.startswith("--config="):
+            return arg.split("=", 1)[1]
+    return None
+
+
+def socket_path(config: str) -> Path:
+    value = os.environ.get(SOCKET_ENV)
+    if value:
+        return Path(value).expanduser()
+    return Path(config).expanduser().resolve().parent / SOCKET_NAME
+
+
+def ask_daemon(path: Path, argv: list[str]) -> Optional[int]:
+    """Run the query on the daemon and copy its answer; None if no daemon answered."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(str(path))
+        sock.settimeout(None)
+        sock.sendall(json.dumps({"argv": argv, "cwd": os.getcwd()}).encode("utf-8") + b"\n")
+        stream = sock.makefile("rb")
+        header = stream.readline()
+        if not header:
+            return None
+        reply = json.loads(header)
+    except (OSError, ValueError):
+        sock.close()
+        return None
+    try:
+        shutil.copyfileobj(stream, sys.stdout.buffer)
+    except ConnectionError as exc:
+        # Part of the answer may be out already, so no fallback here.
+        print(f"[query] daemon connection lost: {exc}", file=sys.stderr)
+        return 1
+    finally:
+        sock.close()
+    if reply.get("stderr"):
+        sys.stderr.write(reply["stderr"])
+    return int(reply.get("status", 1))
+
+
+def main() -> int:
+    argv = sys.argv[1:]
+    config = config_arg(argv)
+    # --profile and --cprofile measure a run of this process.
+    profiling = any(a.split("=")[0] in ("--profile", "--cprofile") for a in argv)
+    if config and not profiling:
+        status = ask_daemon(socket_path(config), argv)
+        if status is not None:
+            return status
+
+    from query_telegram import main as query_main
+
+    return query_main(argv)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
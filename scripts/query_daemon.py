@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+"""Resident query service: query_telegram.py queries over a Unix socket.
+
+Started once per config, the daemon keeps the interpreter, imports, config
+and sidecar indexes warm, and holds the newest records of the store decoded
+in memory (`RecentWindow`). Each request (see query_client.py for the
+protocol) first reads whatever was appended to the store since the last one,
+then is answered, in order of preference:
+
+- from the result cache, emptied whenever the store changed;
+- from the window, when the answer provably lies within it: --latest finds
+  its N matches there, or nothing before the window can match (the whole
+  store fits, or every older record is dated before --after);
+- by running query_telegram.py's own query in-process (--search,
+  --since-cursor, queries on other configs, and everything else).
+
+The output is byte for byte what query_telegram.py prints. Requests are
+served one at a time; the window is also refreshed while idle.
+
+    python scripts/query_daemon.py --config config.yaml [--window 50000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import signal
+import socket
+import socketserver
+import sys
+import time
+import traceback
+from collections import OrderedDict, deque
+from contextlib import redirect_stderr, redirect_stdout
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from config_loader import load_config, store_location
+from dedup import record_key
+from jsonl_archive import load_frames
+from jsonl_codec import dumps_line, loads
+from jsonl_cursor import iter_lines_from
+from jsonl_index import NO_DATE
+from jsonl_store import archive_dir, list_archives, list_segments, parse_dt
+from query_client import socket_path
+from query_telegram import (
+    build_parser,
+    check_args,
+    is_archive,
+    order_files,
+    record_filter_of,
+    run_query,
+)
+from record_filter import RecordFilter, record_date
+
+DEFAULT_WINDOW = 50000
+DEFAULT_CACHE = 256
+CACHE_MAX_BYTES = 4 << 20
+POLL_SECONDS = 1.0
+
+
+class _File:
+    __slots__ = ("path", "ino", "size", "entries")
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.ino = None
+        self.size = 0
+        # (date, record, output line) while the file is in the window, None before it.
+        self.entries: Optional[deque] = None
+
+
+class RecentWindow:
+    """The newest `max_records` records of a store, decoded, in query scan order.
+
+    Records before the window (archives, older files, lines evicted from the
+    front) are only summarised: how many there are, the newest date among
+    them and whether any is undated. That is enough to tell whether a query
+    bounded by --after could match one of them.
+    """
+
+    def __init__(self, output_path: Path, segments_dir: Optional[Path], max_records: int):
+        self.output_path = output_path
+        self.segments_dir = segments_dir
+        self.max_records = max(1, max_records)
+        self._reset()
+
+    def _reset(self) -> None:
+        self.files: list[_File] = []
+        self.order: list[Path] = []
+        self.archives: dict[Path, tuple[int, int]] = {}
+        self.first = 0
+        self.count = 0
+        self.before_count = 0
+        self.before_max: Optional[datetime] = None
+        self.before_undated = False
+
+    def _listing(self) -> list[tuple[Path, Optional[str]]]:
+        store_path = self.segments_dir or self.output_path
+        if self.segments_dir is not None:
+            files = [(p, p.name) for p in list_segments(self.segments_dir)]
+        else:
+            files = [(self.output_path, None)] if self.output_path.exists() else []
+        return order_files(files + [(p, p.name) for p in list_archives(archive_dir(store_path))])
+
+    def _before(self, date: Optional[datetime], count: int = 1) -> None:
+        self.before_count += count
+        if date is None:
+            self.before_undated = True
+        elif self.before_max is None or date > self.before_max:
+            self.before_max = date
+
+    def _add_archive(self, path: Path) -> None:
+        st = path.stat()
+        self.archives[path] = (st.st_ino, st.st_size)
+        table = load_frames(path)
+        if table is None:
+            # Unknown contents: assume an undated record, which no --after excludes.
+            self._before(None)
+            return
+        if not table.get("count"):
+            return
+        undated = any(fr[3] == NO_DATE for fr in table["frames"])
+        self._before(None if undated or not table.get("max_date") else parse_dt(table["max_date"]), table["count"])
+
+    def _read(self, f: _File) -> bool:
+        """Take in the lines appended to a hot file; True if there were any."""
+        st = f.path.stat()
+        f.ino = st.st_ino
+        if st.st_size <= f.size:
+            return False
+        read = False
+        for end, raw in iter_lines_from(f.path, f.size):
+            f.size = end
+            read = True
+            try:
+                rec = loads(raw)
+            except ValueError:
+                continue
+            if not isinstance(rec, dict):
+                continue
+            date = record_date(rec)
+            if f.entries is None:
+                self._before(date)
+            else:
+                f.entries.append((date, rec, dumps_line(rec)))
+                self.count += 1
+                if self.count > self.max_records:
+                    self._evict()
+        return read
+
+    def _evict(self) -> None:
+        while self.count > self.max_records:
+            f = self.files[self.first]
+            if f.entries:
+                self._before(f.entries.popleft()[0])
+                self.count -= 1
+            else:
+                f.entries = None
+                self.first += 1
+
+    def rebuild(self) -> None:
+        self._reset()
+        listing = self._listing()
+        self.order = [p for p, _ in listing]
+        for path, _ in listing:
+            if is_archive(path):
+                self._add_archive(path)
+                continue
+            f = _File(path)
+            f.entries = deque()
+            self.files.append(f)
+            self._read(f)
+
+    def refresh(self) -> bool:
+        """Take in what was appended since the last call; True if the store changed.
+
+        Rewritten, truncated, removed or newly archived files (compact_store.py,
+        rotation) rebuild the window from scratch.
+        """
+        try:
+            return self._refresh()
+        except OSError:
+            self.rebuild()
+            return True
+
+    def _refresh(self) -> bool:
+        listing = self._listing()
+        archives = [p for p, _ in listing if is_archive(p)]
+        known = {f.path: f for f in self.files}
+        hot = [p for p, _ in listing if not is_archive(p)]
+        if set(archives) != set(self.archives) or not known.keys() <= set(hot):
+            self.rebuild()
+            return True
+        for path in archives:
+            st = path.stat()
+            if (st.st_ino, st.st_size) != self.archives[path]:
+                self.rebuild()
+                return True
+        for f in self.files:
+            st = f.path.stat()
+            if st.st_ino != f.ino or st.st_size < f.size:
+                self.rebuild()
+                return True
+
+        changed = False
+        self.order = [p for p, _ in listing]
+        if len(hot) != len(self.files):
+            # New segments: those sorting before the window only count as older records.
+            first_path = self.files[self.first].path if self.first < len(self.files) else None
+            files = []
+            in_window = first_path is None
+            for path in hot:
+                if path == first_path:
+                    in_window = True
+                f = known.get(path)
+                if f is None:
+                    f = _File(path)
+                    if in_window:
+                        f.entries = deque()
+                files.append(f)
+            self.files = files
+            self.first = files.index(known[first_path]) if first_path is not None else 0
+            changed = True
+        for f in self.files:
+            changed |= self._read(f)
+        return changed
+
+    def _archive_in_window(self) -> bool:
+        """Whether an archive sorts after the window start; the window lacks its lines."""
+        if self.first >= len(self.files):
+            return False
+        start = self.order.index(self.files[self.first].path)
+        return any(is_archive(p) for p in self.order[start:])
+
+    def _entries(self, reverse: bool) -> Iterator[tuple]:
+        files = self.files[self.first :]
+        if not reverse:
+            return (e for f in files if f.entries for e in f.entries)
+        return (e for f in reversed(files) if f.entries for e in reversed(f.entries))
+
+    def _lines(self, entries: Iterable[tuple], record_filter: RecordFilter, prefilter, dedup: bool) -> Iterator[bytes]:
+        seen_keys = set() if dedup else None
+        for date, rec, line in entries:
+            if prefilter is not None and not prefilter.line_ok(line):
+                continue
+            if not record_filter.matches_dated(rec, date):
+                continue
+            if seen_keys is not None:
+                key = record_key(rec)
+                if key is not None:
+                    if key in seen_keys:
+                        continue
+                    seen_keys.add(key)
+            yield line
+
+    def answer(self, args: argparse.Namespace, out) -> bool:
+        """Write the output of a valid query if it lies within the window; False if it may not."""
+        if args.search or args.since_cursor or self._archive_in_window():
+            return False
+        record_filter = record_filter_of(args)
+        after = record_filter.after
+        nothing_before = self.before_count == 0 or (
+            after is not None and not self.before_undated and self.before_max is not None and self.before_max < after
+        )
+        prefilter = None if args.no_prefilter else record_filter.prefilter()
+        lines = self._lines(self._entries(args.latest), record_filter, prefilter, args.dedup)
+        if args.limit > 0:
+            lines = (line for _, line in zip(range(args.limit), lines))
+
+        if args.latest:
+            newest_first = list(lines)
+            if len(newest_first) < args.limit and not nothing_before:
+                return False
+            out.writelines(reversed(newest_first))
+            return True
+        if not nothing_before:
+            return False
+        out.writelines(lines)
+        return True
+
+
+class QueryService:
+    """Answers requests for one config: window, result cache, in-process fallback."""
+
+    def __init__(self, config_path: Path, window_size: int, cache_size: int):
+        self.config_path = config_path
+        self.window_size = window_size
+        self.cache_size = cache_size
+        self.cache: OrderedDict = OrderedDict()
+        self.config_mtime = None
+        self.window: Optional[RecentWindow] = None
+        self.last_refresh = 0.0
+        self.refresh()
+
+    def refresh(self) -> None:
+        mtime = self.config_path.stat().st_mtime_ns
+        if mtime != self.config_mtime:
+            self.config_mtime = mtime
+            output_path, segments_dir = store_location(self.config_path, load_config(self.config_path))
+            self.window = RecentWindow(output_path, segments_dir, self.window_size)
+            self.window.rebuild()
+            self.cache.clear()
+        elif self.window.refresh():
+            self.cache.clear()
+        self.last_refresh = time.monotonic()
+
+    def query(self, argv: list[str], cwd: str) -> tuple[int, str, bytes, str]:
+        """(exit status, stderr text, output, source) of one query_telegram.py command line."""
+        out = io.BytesIO()
+        text_out = io.StringIO()
+        err = io.StringIO()
+        status = 0
+        source = "scan"
+        key = None
+        try:
+            with redirect_stdout(text_out), redirect_stderr(err):
+                parser = build_parser()
+                parser.prog = "query_telegram.py"
+                args = parser.parse_args(argv)
+                config_path = Path(args.config).expanduser()
+                args.config = str((Path(cwd) / config_path).resolve())
+                ours = Path(args.config) == self.config_path
+                # Profiles measure the in-process query itself.
+                profiling = args.profile is not None or args.cprofile is not None
+                if ours:
+                    self.refresh()
+                    # --since-days and cursors depend on more than the store contents.
+                    if args.since_days is None and not args.since_cursor and not profiling:
+                        key = tuple(argv)
+                if key is not None and key in self.cache:
+                    self.cache.move_to_end(key)
+                    return 0, "", self.cache[key], "cache"
+
+                error = check_args(args)
+                if error:
+                    print(error, file=sys.stderr)
+                    status = 2
+                elif ours and not profiling and self.window.answer(args, out):
+                    source = "window"
+                else:
+                    status = run_query(args, out)
+        except SystemExit as exc:
+            status = exc.code if isinstance(exc.code, int) else (0 if exc.code is None else 1)
+            if exc.code is not None and not isinstance(exc.code, int):
+                err.write(f"{exc.code}\n")
+        except Exception:
+            traceback.print_exc(file=err)
+            status = 1
+        body = text_out.getvalue().encode("utf-8") + out.getvalue()
+        if status == 0 and key is not None and len(body) <= CACHE_MAX_BYTES and not err.getvalue():
+            self.cache[key] = body
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return status, err.getvalue(), body, source
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        try:
+            request = loads(self.rfile.readline())
+            argv = [str(a) for a in request["argv"]]
+            cwd = str(request.get("cwd") or ".")
+        except (ValueError, KeyError, TypeError) as exc:
+            status, err, body, source = 2, f"bad request: {exc}\n", b"", "error"
+        else:
+            status, err, body, source = self.server.service.query(argv, cwd)
+        try:
+            self.wfile.write(dumps_line({"status": status, "stderr": err, "source": source}))
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class QueryServer(socketserver.UnixStreamServer):
+    def __init__(self, path: Path, service: QueryService):
+        self.service = service
+        super().__init__(str(path), QueryHandler)
+
+    def service_actions(self) -> None:
+        # Between requests, keep the window following the store.
+        if time.monotonic() - self.service.last_refresh >= POLL_SECONDS:
+            try:
+                self.service.refresh()
+            except Exception as exc:
+                print(f"[query-daemon] refresh failed: {exc}", file=sys.stderr)
+
+
+def _daemon_running(path: Path) -> bool:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def _stop(signum, frame) -> None:
+    raise SystemExit(0)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Serve query_telegram.py queries from memory over a Unix socket.")
+    parser.add_argument("--config", required=True, help="Path to YAML config file")
+    parser.add_argument("--socket", help="Socket path (default: $TG_QUERY_SOCKET or data/query.sock next to the config)")
+    parser.add_argument("--window", type=int, help=f"Newest records kept in memory (default {DEFAULT_WINDOW})")
+    parser.add_argument("--cache", type=int, help=f"Query results cached (default {DEFAULT_CACHE})")
+    args = parser.parse_args()
+
+    config_path = Path(args.config).expanduser().resolve()
+    cfg = load_config(config_path)
+    window_size = args.window or int(cfg.get("query_daemon_window") or DEFAULT_WINDOW)
+    cache_size = args.cache or int(cfg.get("query_daemon_cache") or DEFAULT_CACHE)
+    path = Path(args.socket).expanduser() if args.socket else socket_path(str(config_path))
+
+    if path.exists():
+        if _daemon_running(path):
+            print(f"[query-daemon] already running on {path}", file=sys.stderr)
+            return 1
+        path.unlink()
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    service = QueryService(config_path, window_size, cache_size)
+    window = service.window
+    print(
+        f"[query-daemon] {window.count} records in memory, {window.before_count} before them, "
+        f"loaded in {time.perf_counter() - start:.1f}s",
+        file=sys.stderr,
+    )
+
+    signal.signal(signal.SIGTERM, _stop)
+    server = QueryServer(path, service)
+    try:
+        os.chmod(path, 0o600)
+        print(f"[query-daemon] listening on {path}", file=sys.stderr)
+        server.serve_forever(poll_interval=POLL_SECONDS / 2)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        path.unlink(missing_ok=True)
+        print("[query-daemon] stopped", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,28 +1,24 @@
 #!/usr/bin/env python
 import argparse
-import json
 import sys
 from collections import deque
+from contextlib import closing
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from typing import BinaryIO, Optional
 
-import yaml
+from config_loader import load_config, store_location
+from jsonl_cursor import CURSOR_DIR, advance, iter_lines_from, load_cursor, resume_offset, save_cursor
+from jsonl_archive import iter_archive, select_archives
+from jsonl_codec import dumps_line, loads
+from jsonl_index import candidate_lines
+from jsonl_store import ARCHIVE_SUFFIXES, archive_dir, iter_lines_reverse, list_archives, select_segments, store_files
+from record_filter import RecordFilter, record_date
 
-
-def load_config(config_path: Path) -> dict:
-    with config_path.open("r", encoding="utf-8") as f:
-        cfg = yaml.safe_load(f) or {}
-    return cfg
-
-
-def resolve_path(config_path: Path, value: str, default_relative: str) -> Path:
-    if value:
-        p = Path(value)
-    else:
-        p = Path(default_relative)
-    if not p.is_absolute():
-        p = config_path.parent / p
-    return p
+# --profile stages; with --workers the scan is one "workers" stage.
+QUERY_STAGES = ("setup", "read", "decode", "parse_dt", "filter", "encode", "output", "cursor")
+WORKER_STAGES = ("setup", "workers", "output", "cursor")
+ARROW_STAGES = ("setup", "export", "scan", "output", "cursor")
 
 
 def parse_dt(value: str) -> datetime:
@@ -34,101 +30,367 @@ def parse_dt(value: str) -> datetime:
     return dt
 
 
-def match_chat(rec: dict, filters) -> bool:
-    if not filters:
-        return True
-    chat_id = str(rec.get("chat_id", ""))
-    chat_username = rec.get("chat_username") or ""
-    chat_title = rec.get("chat_title") or ""
+def is_archive(path: Path) -> bool:
+    return path.name.endswith(ARCHIVE_SUFFIXES)
 
-    for f in filters:
-        if f.isdigit() and chat_id == f:
-            return True
-        if f.startswith("@") and chat_username and f[1:].lower() == chat_username.lower():
-            return True
-        if f.lower() in chat_title.lower():
-            return True
-    return False
 
+def order_files(files: list[tuple[Path, Optional[str]]]) -> list[tuple[Path, Optional[str]]]:
+    """Sort (path, segment name) pairs into scan order.
 
-def main() -> int:
+    Compressed day archives (compact_store.py) hold the oldest history; a
+    day's archive comes before any segment lines written for it since, and a
+    single-file store comes after its archives.
+    """
+    return sorted(files, key=lambda f: (f[1] is None, (f[1] or "").split(".")[0], not is_archive(f[0])))
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Query Telegram JSONL store.")
     parser.add_argument("--config", required=True, help="Path to YAML config file")
     parser.add_argument("--chat", action="append", help="Chat filter (@username, id, or title substring)")
     parser.add_argument("--contains", help="Case-insensitive substring match on message text")
+    parser.add_argument(
+        "--search",
+        help="Full-text search via the FTS5 index (all words must match, `word*` for prefix); newest first",
+    )
     parser.add_argument("--after", help="ISO datetime; include messages >= this time")
     parser.add_argument("--before", help="ISO datetime; include messages <= this time")
     parser.add_argument("--since-days", type=int, help="Include messages from the last N days")
     parser.add_argument("--limit", type=int, default=200, help="Max records to output (0 for unlimited)")
     parser.add_argument("--latest", action="store_true", help="Return latest N matches (requires --limit > 0)")
-    args = parser.parse_args()
+    parser.add_argument(
+        "--since-cursor",
+        metavar="NAME",
+        help="Only read lines appended since the named cursor's last run, then advance it",
+    )
+    parser.add_argument("--no-index", action="store_true", help="Scan the JSONL instead of using the sidecar index")
+    parser.add_argument(
+        "--no-prefilter",
+        action="store_true",
+        help="Decode every line instead of skipping lines whose bytes cannot match --chat/--contains",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Drop repeated (source, chat_id, message_id) records, e.g. written by both sync and listener",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Scan the files with N processes (reads the files directly instead of using the index)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("jsonl", "arrow"),
+        default="jsonl",
+        help="arrow: filter a Parquet copy of the store with pyarrow (updated first, see parquet_store.py)",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="-",
+        metavar="JSON",
+        help="Report per-stage wall/CPU time, records and bytes to stderr, or to this JSON file",
+    )
+    parser.add_argument("--cprofile", metavar="FILE", help="Dump cProfile stats of the query to FILE (python -m pstats FILE)")
+    return parser
+
 
+def check_args(args: argparse.Namespace) -> Optional[str]:
+    """Why a combination of query arguments is rejected, or None."""
+    if args.workers < 1:
+        return "--workers must be at least 1"
+    if args.workers > 1 and (args.search or args.since_cursor):
+        return "--workers cannot be combined with --search or --since-cursor"
+    if args.engine == "arrow" and (args.search or args.since_cursor or args.workers > 1):
+        return "--engine arrow cannot be combined with --search, --since-cursor or --workers"
     if args.latest and args.limit <= 0:
-        print("--latest requires --limit > 0", file=sys.stderr)
+        return "--latest requires --limit > 0"
+    if args.search and args.since_cursor:
+        return "--search cannot be combined with --since-cursor"
+    return None
+
+
+def record_filter_of(args: argparse.Namespace) -> RecordFilter:
+    after_dt = parse_dt(args.after) if args.after else None
+    before_dt = parse_dt(args.before) if args.before else None
+    if args.since_days is not None:
+        after_dt = datetime.now(timezone.utc) - timedelta(days=args.since_days)
+    contains = args.contains.lower() if args.contains else None
+    return RecordFilter(tuple(args.chat) if args.chat else None, after_dt, before_dt, contains)
+
+
+def run_query(args: argparse.Namespace, out: BinaryIO) -> int:
+    """Write the records selected by parsed query arguments to `out`; returns the exit code."""
+    if args.profile is None and args.cprofile is None:
+        return _query(args, out, None)
+    from stage_profile import cprofiled, profiled
+
+    stages = ARROW_STAGES if args.engine == "arrow" else QUERY_STAGES if args.workers == 1 else WORKER_STAGES
+    return cprofiled(
+        args.cprofile,
+        lambda: profiled(args.profile, "query_telegram.py", stages, lambda profile: _query(args, out, profile)),
+    )
+
+
+def _query(args: argparse.Namespace, out: BinaryIO, profile) -> int:
+    error = check_args(args)
+    if error:
+        print(error, file=sys.stderr)
         return 2
 
     config_path = Path(args.config).expanduser().resolve()
     cfg = load_config(config_path)
 
-    output_path = resolve_path(config_path, cfg.get("output_jsonl", ""), "data/telegram_messages.jsonl")
-    if not output_path.exists():
-        print(f"JSONL not found: {output_path}", file=sys.stderr)
+    output_path, segments_dir = store_location(config_path, cfg)
+    store_path = segments_dir or output_path
+    if not store_path.exists():
+        print(f"JSONL not found: {store_path}", file=sys.stderr)
         return 1
 
-    after_dt = parse_dt(args.after) if args.after else None
-    before_dt = parse_dt(args.before) if args.before else None
-    if args.since_days is not None:
-        after_dt = datetime.now(timezone.utc) - timedelta(days=args.since_days)
+    record_filter = record_filter_of(args)
+    after_dt, before_dt = record_filter.after, record_filter.before
+    chat_match = record_filter.chat_match()
 
-    contains = args.contains.lower() if args.contains else None
+    # Lines whose raw bytes lack the chat or --contains text are skipped
+    # before JSON decoding; survivors still go through the exact checks.
+    prefilter = None if args.no_prefilter else record_filter.prefilter()
 
-    buffer = deque(maxlen=args.limit) if args.latest and args.limit > 0 else None
-    count = 0
+    def prefiltered(lines):
+        return filter(prefilter.line_ok, lines) if prefilter is not None else lines
 
-    with output_path.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
+    if segments_dir is not None:
+        files = [(p, p.name) for p in select_segments(segments_dir, after_dt, before_dt, chat_match)]
+    else:
+        files = [(output_path, None)]
+    files = order_files(files + [(p, p.name) for p in select_archives(store_path, after_dt, before_dt, chat_match)])
+
+    cursor_dir = store_path.parent / CURSOR_DIR
+    cursor = None
+    if args.since_cursor:
+        try:
+            cursor = load_cursor(cursor_dir, args.since_cursor)
+        except ValueError as exc:
+            print(str(exc), file=sys.stderr)
+            return 2
+
+    # The sidecar index narrows --chat/--after/--before lookups; cursor reads
+    # only touch the tail and scan it directly.
+    use_index = not args.no_index and cursor is None and bool(args.chat or after_dt or before_dt)
+    consumed = {}
+
+    def iter_store():
+        for path, key in files:
+            if is_archive(path):
+                # Archives only hold history already moved out of the hot
+                # files, so cursor reads (new lines only) skip them.
+                if cursor is None:
+                    yield from prefiltered(iter_archive(path, chat_match, after_dt, before_dt))
                 continue
-            try:
-                rec = json.loads(line)
-            except json.JSONDecodeError:
+            if use_index:
+                try:
+                    lines = candidate_lines(path, chat_match, after_dt, before_dt)
+                except OSError as exc:
+                    print(f"[query] index unavailable for {path}: {exc}", file=sys.stderr)
+                else:
+                    yield from prefiltered(lines)
+                    continue
+            start = resume_offset(path, cursor, key) if cursor is not None else 0
+            consumed[key] = (path, start)
+            if prefilter is not None:
+                for end, raw in prefilter.scan(path, start):
+                    consumed[key] = (path, end)
+                    if raw is not None:
+                        yield raw
                 continue
+            for end, raw in iter_lines_from(path, start):
+                consumed[key] = (path, end)
+                yield raw
 
-            if not match_chat(rec, args.chat):
+    def iter_store_reverse():
+        for path, _ in reversed(files):
+            if is_archive(path):
+                yield from prefiltered(iter_archive(path, chat_match, after_dt, before_dt, reverse=True))
                 continue
-
-            rec_date = None
-            if rec.get("date"):
+            if use_index:
                 try:
-                    rec_date = parse_dt(rec["date"])
-                except Exception:
-                    rec_date = None
+                    lines = candidate_lines(path, chat_match, after_dt, before_dt, reverse=True)
+                except OSError as exc:
+                    print(f"[query] index unavailable for {path}: {exc}", file=sys.stderr)
+                else:
+                    yield from prefiltered(lines)
+                    continue
+            # Lines are in write order, not date order (syncs append older
+            # history), so without the index's block dates there is no point
+            # before which nothing can match --after: read back to the start.
+            yield from prefiltered(iter_lines_reverse(path))
+
+    # Modules only some modes need are imported there, to keep startup short.
+    seen_keys = None
+    if args.dedup:
+        from dedup import record_key
 
-            if after_dt and rec_date and rec_date < after_dt:
+        seen_keys = set()
+
+    def matching(lines):
+        for raw in lines:
+            line = raw.strip()
+            if not line:
                 continue
-            if before_dt and rec_date and rec_date > before_dt:
+            try:
+                rec = loads(line)
+            except ValueError:
                 continue
+            if record_filter.matches(rec):
+                yield (record_key(rec) if seen_keys is not None else None), dumps_line(rec)
 
-            text = rec.get("text") or ""
-            if contains and contains not in text.lower():
+    def profiled_matching(lines):
+        # matching(), with each step charged to its --profile stage.
+        enter = profile.enter
+        read = profile.stages["read"]
+        decode, dates, filtered, encode, output = profile.counters(*QUERY_STAGES[2:7])
+        read.records_out = read.bytes = encode.bytes = 0
+        lines = iter(lines)
+        while True:
+            enter("read")
+            raw = next(lines, None)
+            if raw is None:
+                return
+            read.records_out += 1
+            read.bytes += len(raw)
+            line = raw.strip()
+            if not line:
+                continue
+            enter("decode")
+            decode.records_in += 1
+            try:
+                rec = loads(line)
+            except ValueError:
                 continue
+            decode.records_out += 1
+            if not isinstance(rec, dict):
+                continue
+            enter("parse_dt")
+            dates.records_in += 1
+            rec_date = record_date(rec)
+            if rec_date is not None:
+                dates.records_out += 1
+            enter("filter")
+            filtered.records_in += 1
+            if not record_filter.matches_dated(rec, rec_date):
+                continue
+            filtered.records_out += 1
+            enter("encode")
+            encode.records_in += 1
+            key = record_key(rec) if seen_keys is not None else None
+            line = dumps_line(rec)
+            encode.records_out += 1
+            encode.bytes += len(line)
+            enter("output")
+            output.records_in += 1
+            yield key, line
+
+    scan = matching if profile is None else profiled_matching
+
+    newest_first = None
+    buffer = None
+    if args.workers > 1:
+        from parallel_scan import ScanTask, iter_parallel, split_ranges
+
+        tasks = []
+        for path, _ in files:
+            if is_archive(path):
+                tasks.append(ScanTask(str(path), archive=True))
+            else:
+                tasks += [ScanTask(str(path), start, end) for start, end in split_ranges(path)]
+        if args.latest:
+            tasks.reverse()
+            newest_first = []
+        # Each task only needs its first --limit matches, unless --dedup may drop some.
+        cap = args.limit if args.limit > 0 and not args.dedup else 0
+        results = iter_parallel(
+            tasks, args.workers, record_filter, prefilter is not None, args.latest, seen_keys is not None, cap
+        )
+        if profile is not None:
+            results = profile.iterate("workers", results, "output")
+    elif args.engine == "arrow":
+        from parquet_store import export, parquet_path, select_lines
+
+        if profile is not None:
+            profile.enter("export")
+        try:
+            manifest = export(store_path)
+        except RuntimeError as exc:
+            print(str(exc), file=sys.stderr)
+            return 2
+        names = [p.name for p, _ in files]
+        results = select_lines(
+            parquet_path(store_path), manifest, names, record_filter, args.latest, seen_keys is not None
+        )
+        if args.latest:
+            newest_first = []
+        if profile is not None:
+            results = profile.iterate("scan", results, "output")
+    elif args.search:
+        from fts_index import FtsUnavailable, connect, fts_path, search, sync
+
+        try:
+            conn = connect(fts_path(store_path))
+            sync(conn, store_files(store_path) + list_archives(archive_dir(store_path)))
+        except FtsUnavailable as exc:
+            print(f"{exc}; use --contains instead", file=sys.stderr)
+            return 2
+        # Results already come newest first, which is what --latest would keep.
+        results = scan(search(conn, [p for p, _ in files], args.search, after_dt, before_dt))
+    elif args.latest and cursor is None:
+        # Walk backwards from EOF and stop after N matches; with the index,
+        # blocks entirely before --after are never read.
+        results = scan(iter_store_reverse())
+        newest_first = []
+    else:
+        results = scan(iter_store())
+        buffer = deque(maxlen=args.limit) if args.latest and args.limit > 0 else None
+    count = 0
+
+    with closing(results):
+        for key, line in results:
+            if key is not None:
+                if key in seen_keys:
+                    continue
+                seen_keys.add(key)
 
             if buffer is not None:
-                buffer.append(rec)
+                buffer.append(line)
                 continue
 
-            print(json.dumps(rec, ensure_ascii=False))
+            if newest_first is not None:
+                newest_first.append(line)
+            else:
+                out.write(line)
             count += 1
             if args.limit > 0 and count >= args.limit:
                 break
 
     if buffer is not None:
-        for rec in buffer:
-            print(json.dumps(rec, ensure_ascii=False))
+        out.writelines(buffer)
+    if newest_first is not None:
+        out.writelines(reversed(newest_first))
+
+    if profile is not None:
+        profile.stages["output"].records_out = len(buffer) if buffer is not None else count
+        profile.enter("cursor")
+    if cursor is not None:
+        for key, (path, end) in consumed.items():
+            cursor = advance(path, cursor, end, key)
+        save_cursor(cursor_dir, cursor)
 
     return 0
 
 
+def main(argv: Optional[list[str]] = None) -> int:
+    return run_query(build_parser().parse_args(argv), sys.stdout.buffer)
+
+
 if __name__ == "__main__":
     raise SystemExit(main())
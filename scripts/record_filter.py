@@ -0,0 +1,84 @@
+"""The record filters of query_telegram.py, shared with its scan workers."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Optional
+
+from jsonl_prefilter import LinePrefilter, chat_needles
+from jsonl_store import parse_dt
+
+
+def match_chat(rec: dict, filters) -> bool:
+    if not filters:
+        return True
+    chat_id = str(rec.get("chat_id", ""))
+    chat_username = rec.get("chat_username") or ""
+    chat_title = rec.get("chat_title") or ""
+
+    for f in filters:
+        if f.isdigit() and chat_id == f:
+            return True
+        if f.startswith("@") and chat_username and f[1:].lower() == chat_username.lower():
+            return True
+        if f.lower() in chat_title.lower():
+            return True
+    return False
+
+
+def record_date(rec: dict) -> Optional[datetime]:
+    """The date the filters compare, or None (undated records pass date bounds)."""
+    if rec.get("date"):
+        try:
+            return parse_dt(rec["date"])
+        except Exception:
+            return None
+    return None
+
+
+@dataclass(frozen=True)
+class RecordFilter:
+    """--chat/--after/--before/--contains; `contains` is already lower-cased."""
+
+    chats: Optional[tuple[str, ...]] = None
+    after: Optional[datetime] = None
+    before: Optional[datetime] = None
+    contains: Optional[str] = None
+
+    def matches(self, rec) -> bool:
+        if not isinstance(rec, dict):
+            return False
+        return self.matches_dated(rec, record_date(rec))
+
+    def matches_dated(self, rec: dict, rec_date: Optional[datetime]) -> bool:
+        """`matches` for a dict record whose `record_date` is already known."""
+        if not match_chat(rec, self.chats):
+            return False
+
+        if self.after and rec_date and rec_date < self.after:
+            return False
+        if self.before and rec_date and rec_date > self.before:
+            return False
+
+        text = rec.get("text") or ""
+        if self.contains and self.contains not in text.lower():
+            return False
+        return True
+
+    def chat_match(self) -> Optional[Callable[[dict], bool]]:
+        """The chat filter alone, for the index and archive frame tables."""
+        if not self.chats:
+            return None
+        chats = self.chats
+        return lambda rec: match_chat(rec, chats)
+
+    def prefilter(self) -> Optional[LinePrefilter]:
+        # Lines whose raw bytes lack the chat or --contains text cannot match.
+        groups = []
+        chat_group = chat_needles(list(self.chats)) if self.chats else None
+        if chat_group:
+            groups.append(chat_group)
+        if self.contains:
+            groups.append([self.contains])
+        return LinePrefilter(groups) if groups else None
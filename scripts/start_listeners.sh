@@ -103,7 +103,12 @@ if [ "$DISABLE_TELEGRAM" -eq 1 ]; then
   TG_PID=""
   echo "Telegram listener disabled (marker or TELEGRAM_DISABLED=1)."
 else
-  LISTENER_LOG="$LISTENER_LOG" "$PY" "$ROOT/scripts/telegram_listen.py" --config "$ROOT/config.yaml" &
+  # TELEGRAM_SYNC=1: the listener also runs the sync (telegram_listen.py --sync)
+  TG_ARGS=()
+  if [ "${TELEGRAM_SYNC:-0}" = "1" ]; then
+    TG_ARGS+=(--sync)
+  fi
+  LISTENER_LOG="$LISTENER_LOG" "$PY" "$ROOT/scripts/telegram_listen.py" --config "$ROOT/config.yaml" ${TG_ARGS[@]+"${TG_ARGS[@]}"} &
   TG_PID=$!
 fi
 
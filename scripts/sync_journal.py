@@ -0,0 +1,206 @@
+"""Write-ahead journal of sync_telegram.py's per-chat progress.
+
+The state file (chat id -> last message id) is rewritten at the end of a run.
+Until then every batch of records a chat writes is framed by two lines in
+`<state file>.journal`, each flushed and fsynced before the next step:
+
+    {"op": "begin", "run": ..., "chat": "123", "ids": [...], "files": {"<path>": <size before>}}
+    {"op": "commit", "run": ..., "chat": "123", "last_id": 456, "files": {"<path>": <size after>}}
+
+The records are written and fsynced between the two, so a committed last_id
+never runs ahead of the store. `recover`, run before the next sync, replays
+the commits into the state; a commit whose files are now shorter than its
+offsets (and any later one for that chat) is dropped. A batch that began but
+never committed is repaired: a torn last line is truncated (never below the
+batch's starting offset), and the leading part of the batch that did reach
+the store, as complete lines of that run and chat, is kept by moving last_id
+past it, so those records are neither fetched nor written again. The caller
+then saves the state and removes the journal, as after every finished run.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable
+
+from jsonl_codec import dumps_line, loads
+
+COMPACT_EVERY = 1000  # commits between state rewrites that empty the journal
+TAIL_SETTLE = 0.2  # seconds an unterminated tail must stay unchanged before it is cut
+TAIL_BLOCK = 1 << 16
+
+
+def journal_path(state_path: Path) -> Path:
+    return state_path.with_suffix(".journal")
+
+
+def _size(path: str) -> int:
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
+
+
+class SyncJournal:
+    """Appends begin/commit entries around each batch and keeps `state` in step."""
+
+    def __init__(self, path: Path, state: dict, run_id: str, file_of: Callable[[dict], Path], save: Callable[[], None]):
+        self.path = path
+        self.state = state
+        self.run_id = run_id
+        self.file_of = file_of
+        self._save = save
+        self._commits = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = path.open("ab")
+
+    def _append(self, entry: dict) -> None:
+        self._f.write(dumps_line(entry))
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def write_batch(self, out, chat: str, records: list[dict], last_id: int) -> None:
+        """Write `records` through `out` and commit `last_id` for `chat`."""
+        files = sorted({str(self.file_of(rec)) for rec in records})
+        self._append(
+            {
+                "op": "begin",
+                "run": self.run_id,
+                "chat": chat,
+                "ids": [rec["message_id"] for rec in records],
+                "files": {p: _size(p) for p in files},
+            }
+        )
+        for rec in records:
+            out.write(rec)
+        out.flush(fsync=True)
+        self._append(
+            {"op": "commit", "run": self.run_id, "chat": chat, "last_id": last_id, "files": {p: _size(p) for p in files}}
+        )
+        self.state[chat] = last_id
+        self._commits += 1
+        if self._commits >= COMPACT_EVERY:
+            self.compact()
+
+    def compact(self) -> None:
+        """Save the state and empty the journal (no batch is open between write_batch calls)."""
+        self._save()
+        self._f.truncate(0)
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._commits = 0
+
+    def close(self) -> None:
+        self._f.close()
+
+
+def _read_entries(path: Path) -> list[dict]:
+    entries = []
+    with path.open("rb") as f:
+        for line in f:
+            # A torn last line (the crash came mid-append) ends the journal.
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entries.append(loads(line))
+            except ValueError:
+                break
+    return entries
+
+
+def _cut_torn_tail(path: str, floor: int) -> None:
+    """Truncate an unterminated last line of `path`, but not below `floor`."""
+    try:
+        size = os.stat(path).st_size
+    except FileNotFoundError:
+        return
+    if size <= floor:
+        return
+    with open(path, "rb") as f:
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Look backwards for the end of the last whole line.
+        cut = floor
+        end = size
+        while end > floor:
+            start = max(floor, end - TAIL_BLOCK)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                cut = start + newline + 1
+                break
+            end = start
+    # The listener appends whole lines; wait out one it may be writing now.
+    time.sleep(TAIL_SETTLE)
+    if os.stat(path).st_size != size:
+        return
+    with open(path, "r+b") as f:
+        f.truncate(cut)
+    print(f"[sync] truncated a torn line at the end of {path} ({size - cut} bytes)", file=sys.stderr)
+
+
+def _written_ids(files: dict, run_id: str, chat: str) -> set:
+    """Message ids of this run's records for `chat` after the given file offsets."""
+    ids = set()
+    for path, start in files.items():
+        try:
+            with open(path, "rb") as f:
+                f.seek(start)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        rec = loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(rec, dict) and rec.get("run_id") == run_id and str(rec.get("chat_id")) == chat:
+                        ids.add(rec.get("message_id"))
+        except FileNotFoundError:
+            continue
+    return ids
+
+
+def recover(path: Path, state: dict) -> bool:
+    """Replay the journal at `path` into `state`; False if there is none to replay."""
+    if not path.exists():
+        return False
+    entries = _read_entries(path)
+    dropped: set[str] = set()
+    open_batch: dict[str, dict] = {}
+    replayed = 0
+    for entry in entries:
+        chat = str(entry.get("chat"))
+        if entry.get("op") == "begin":
+            open_batch[chat] = entry
+            continue
+        if entry.get("op") != "commit" or chat in dropped:
+            continue
+        open_batch.pop(chat, None)
+        if any(_size(p) < offset for p, offset in entry["files"].items()):
+            print(f"[sync] chat {chat}: store is shorter than journaled, fetching from {state.get(chat, 0)} again", file=sys.stderr)
+            dropped.add(chat)
+            continue
+        state[chat] = entry["last_id"]
+        replayed += 1
+
+    for chat, entry in open_batch.items():
+        if chat in dropped:
+            continue
+        for p, start in entry["files"].items():
+            _cut_torn_tail(p, start)
+        written = _written_ids(entry["files"], entry["run"], chat)
+        # Records reach each file in order, so the batch's longest prefix on disk is complete.
+        kept = 0
+        for message_id in entry["ids"]:
+            if message_id not in written:
+                break
+            kept += 1
+        if kept and int(entry["ids"][kept - 1]) > int(state.get(chat, 0)):
+            state[chat] = int(entry["ids"][kept - 1])
+        print(f"[sync] chat {chat}: interrupted batch, kept {kept} of {len(entry['ids'])} records", file=sys.stderr)
+    print(f"[sync] recovered {replayed} checkpoints from {path}", file=sys.stderr)
+    return True
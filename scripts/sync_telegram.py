@@ -1,53 +1,16 @@
 #!/usr/bin/env python
 import argparse
+import asyncio
 import json
 import os
 import sys
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-import yaml
-from telethon.sync import TelegramClient
-
-
-def _resolve_env_value(value):
-    if value is None:
-        return None
-    if isinstance(value, str):
-        key = None
-        if value.startswith("${") and value.endswith("}"):
-            key = value[2:-1]
-        elif value.startswith("$"):
-            key = value[1:]
-        if key:
-            return os.environ.get(key)
-    return value
-
-
-def load_config(config_path: Path) -> dict:
-    with config_path.open("r", encoding="utf-8") as f:
-        cfg = yaml.safe_load(f) or {}
-
-    cfg["api_id"] = _resolve_env_value(cfg.get("api_id")) or os.environ.get("TG_API_ID")
-    cfg["api_hash"] = _resolve_env_value(cfg.get("api_hash")) or os.environ.get("TG_API_HASH")
-    cfg["phone"] = _resolve_env_value(cfg.get("phone")) or os.environ.get("TG_PHONE")
-
-    required = ["api_id", "api_hash", "phone", "chats", "output_jsonl", "state_file"]
-    missing = [k for k in required if k not in cfg]
-    if missing:
-        raise ValueError(f"Missing config keys: {', '.join(missing)}")
-
-    return cfg
-
-
-def resolve_path(config_path: Path, value: str, default_relative: str) -> Path:
-    if value:
-        p = Path(value)
-    else:
-        p = Path(default_relative)
-    if not p.is_absolute():
-        p = config_path.parent / p
-    return p
+from config_loader import load_config, resolve_path, store_location
+from dedup import open_dedup_writer
+from jsonl_store import open_writer, segment_path
+from sync_journal import SyncJournal, journal_path, recover
 
 
 def load_state(state_path: Path) -> dict:
@@ -65,9 +28,29 @@ def save_state(state_path: Path, state: dict) -> None:
     tmp_path = state_path.with_suffix(".tmp")
     with tmp_path.open("w", encoding="utf-8") as f:
         json.dump(state, f, ensure_ascii=False, indent=2)
+        # The journal is removed once this has replaced the state file.
+        f.flush()
+        os.fsync(f.fileno())
     tmp_path.replace(state_path)
 
 
+def recover_state(state_path: Path) -> dict:
+    """Load the state, with the progress an interrupted run journaled replayed into it."""
+    state = load_state(state_path)
+    journal_file = journal_path(state_path)
+    if recover(journal_file, state):
+        save_state(state_path, state)
+        journal_file.unlink()
+    return state
+
+
+def store_file_of(output_path: Path, segments_dir):
+    """The function mapping a record to the store file it is appended to."""
+    if segments_dir is not None:
+        return lambda rec: segment_path(segments_dir, rec)
+    return lambda rec: output_path
+
+
 def build_record(msg, chat_id, chat_title, chat_username, run_id):
     sender_username = None
     if msg.sender:
@@ -90,18 +73,130 @@ def build_record(msg, chat_id, chat_title, chat_username, run_id):
     }
 
 
+DEFAULT_CONCURRENCY = 4
+FLOOD_RETRIES = 3
+FLOOD_MAX_WAIT = 600
+CHECKPOINT_EVERY = 100  # messages per checkpoint, one Telethon history page
+
+
+async def fetch_chat(client, entity, last_id, initial_days, initial_limit, run_id, commit) -> int:
+    """Hand one chat's messages after `last_id` to `await commit(records, last_id)`, oldest first.
+
+    A chat's first sync (last_id 0) starts at the `initial_days` cutoff or at
+    its `initial_limit`-th newest message. The records go out CHECKPOINT_EVERY
+    at a time with the last_id they bring the chat to, so memory stays flat
+    however long the window and an interrupted sync resumes after the last
+    batch committed. Returns the new last_id.
+    """
+    chat_id = entity.id
+    chat_title = getattr(entity, "title", None)
+    chat_username = getattr(entity, "username", None)
+
+    window = {"min_id": last_id}
+    if last_id == 0:
+        if initial_days and initial_days > 0:
+            window["offset_date"] = datetime.now(timezone.utc) - timedelta(days=initial_days)
+        elif initial_limit > 0:
+            # The initial_limit-th newest message is the oldest one to keep;
+            # a shorter history is fetched whole.
+            async for msg in client.iter_messages(entity, limit=1, add_offset=initial_limit - 1):
+                window["min_id"] = msg.id - 1
+
+    records = []
+    async for msg in client.iter_messages(entity, reverse=True, **window):
+        records.append(build_record(msg, chat_id, chat_title, chat_username, run_id))
+        if msg.id > last_id:
+            last_id = msg.id
+        if len(records) >= CHECKPOINT_EVERY:
+            await commit(records, last_id)
+            records = []
+    if records:
+        await commit(records, last_id)
+    return last_id
+
+
+async def with_flood_retry(label, make_call, progress=None):
+    """Await make_call(), sleeping out FloodWait errors up to FLOOD_RETRIES times in a row.
+
+    With `progress`, a call that failed after progress() changed (e.g. a
+    backfill that checkpointed some batches) starts the count again.
+    """
+    from telethon.errors import FloodWaitError
+
+    attempt = 0
+    while True:
+        mark = progress() if progress is not None else None
+        try:
+            return await make_call()
+        except FloodWaitError as exc:
+            attempt = 1 if progress is not None and progress() != mark else attempt + 1
+            if attempt == FLOOD_RETRIES or exc.seconds > FLOOD_MAX_WAIT:
+                raise
+            print(
+                f"[sync] flood wait {exc.seconds}s for {label} (attempt {attempt}/{FLOOD_RETRIES})",
+                file=sys.stderr,
+            )
+            await asyncio.sleep(exc.seconds + 1)
+
+
+async def sync_chat(client, chat, sem, out, journal, initial_days, initial_limit) -> None:
+    async with sem:
+        try:
+            entity = await with_flood_retry(f"chat {chat}", lambda: client.get_entity(chat))
+        except Exception as exc:
+            print(f"[sync] failed to resolve chat {chat}: {exc}", file=sys.stderr)
+            return
+
+        state = journal.state
+        key = str(entity.id)
+        label = getattr(entity, "title", None) or getattr(entity, "username", None) or entity.id
+        print(f"[sync] chat={label} last_id={int(state.get(key, 0))}")
+
+        async def commit(records: list[dict], last_id: int) -> None:
+            # No await in between, so each batch lands as one contiguous block.
+            journal.write_batch(out, key, records, last_id)
+
+        try:
+            # A retry after FloodWait resumes from the last checkpoint.
+            await with_flood_retry(
+                f"chat {chat}",
+                lambda: fetch_chat(
+                    client, entity, int(state.get(key, 0)), initial_days, initial_limit, journal.run_id, commit
+                ),
+                progress=lambda: state.get(key),
+            )
+        except Exception as exc:
+            print(f"[sync] failed to sync chat {chat}: {exc}", file=sys.stderr)
+
+
+async def run_sync(make_client, phone, chats, open_out, journal, initial_days, initial_limit, concurrency) -> None:
+    client = make_client()
+    await client.start(phone=phone)
+    try:
+        sem = asyncio.Semaphore(concurrency)
+        with open_out() as out:
+            await asyncio.gather(
+                *(sync_chat(client, chat, sem, out, journal, initial_days, initial_limit) for chat in chats)
+            )
+        if getattr(out, "skipped", 0):
+            print(f"[sync] skipped {out.skipped} messages already in the store")
+    finally:
+        await client.disconnect()
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="Sync Telegram chats to JSONL.")
     parser.add_argument("--config", required=True, help="Path to YAML config file")
     parser.add_argument("--rebuild", action="store_true", help="Ignore state and rebuild output JSONL")
     parser.add_argument("--initial-days", type=int, help="Override initial_days from config")
+    parser.add_argument("--concurrency", type=int, help="Chats fetched in parallel (overrides sync_concurrency)")
     args = parser.parse_args()
 
     config_path = Path(args.config).expanduser().resolve()
-    cfg = load_config(config_path)
+    cfg = load_config(config_path, required=["api_id", "api_hash", "phone", "chats", "output_jsonl", "state_file"])
 
     session_path = resolve_path(config_path, cfg.get("session_file", ""), "data/telegram.session")
-    output_path = resolve_path(config_path, cfg.get("output_jsonl", ""), "data/telegram_messages.jsonl")
+    output_path, segments_dir = store_location(config_path, cfg)
     state_path = resolve_path(config_path, cfg.get("state_file", ""), "data/telegram_state.json")
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
@@ -117,62 +212,45 @@ def main() -> int:
     if initial_days is not None:
         initial_days = int(initial_days)
 
-    state = {} if args.rebuild else load_state(state_path)
-    run_id = datetime.now(timezone.utc).isoformat()
-
-    with TelegramClient(str(session_path), api_id, api_hash) as client:
-        client.start(phone=phone)
-        out_mode = "w" if args.rebuild else "a"
-        with output_path.open(out_mode, encoding="utf-8") as out:
-            for chat in chats:
-                try:
-                    entity = client.get_entity(chat)
-                except Exception as exc:
-                    print(f"[sync] failed to resolve chat {chat}: {exc}", file=sys.stderr)
-                    continue
-
-                chat_id = entity.id
-                chat_title = getattr(entity, "title", None)
-                chat_username = getattr(entity, "username", None)
-
-                last_id = int(state.get(str(chat_id), 0))
-                is_initial = last_id == 0 and (initial_limit > 0 or (initial_days and initial_days > 0))
-
-                print(f"[sync] chat={chat_title or chat_username or chat_id} last_id={last_id}")
-
-                try:
-                    if is_initial:
-                        newest_first = []
-                        if initial_days and initial_days > 0:
-                            cutoff = datetime.now(timezone.utc) - timedelta(days=initial_days)
-                            for msg in client.iter_messages(entity):
-                                if msg.date < cutoff:
-                                    break
-                                newest_first.append(msg)
-                        else:
-                            # Fetch latest N messages, then write oldest->newest
-                            newest_first = list(client.iter_messages(entity, limit=initial_limit))
-
-                        for msg in reversed(newest_first):
-                            record = build_record(msg, chat_id, chat_title, chat_username, run_id)
-                            out.write(json.dumps(record, ensure_ascii=False) + "\n")
-
-                        if newest_first:
-                            last_id = max(m.id for m in newest_first)
-                    else:
-                        iterator = client.iter_messages(entity, min_id=last_id, reverse=True)
-                        for msg in iterator:
-                            record = build_record(msg, chat_id, chat_title, chat_username, run_id)
-                            out.write(json.dumps(record, ensure_ascii=False) + "\n")
-                            if msg.id > last_id:
-                                last_id = msg.id
-                except Exception as exc:
-                    print(f"[sync] failed to sync chat {chat}: {exc}", file=sys.stderr)
-                    continue
-
-                state[str(chat_id)] = last_id
+    concurrency = args.concurrency or int(cfg.get("sync_concurrency") or DEFAULT_CONCURRENCY)
+
+    # Progress since the last finished run is in the journal (sync_journal.py).
+    journal_file = journal_path(state_path)
+    if args.rebuild:
+        state = {}
+        journal_file.unlink(missing_ok=True)
+        save_state(state_path, state)
+    else:
+        state = recover_state(state_path)
+    open_out = open_dedup_writer if cfg.get("dedup", True) else open_writer
+    journal = SyncJournal(
+        journal_file,
+        state,
+        datetime.now(timezone.utc).isoformat(),
+        store_file_of(output_path, segments_dir),
+        lambda: save_state(state_path, state),
+    )
+
+    from telethon import TelegramClient
+
+    try:
+        asyncio.run(
+            run_sync(
+                lambda: TelegramClient(str(session_path), api_id, api_hash),
+                phone,
+                chats,
+                lambda: open_out(output_path, segments_dir, truncate=args.rebuild),
+                journal,
+                initial_days,
+                initial_limit,
+                max(1, concurrency),
+            )
+        )
+    finally:
+        journal.close()
 
     save_state(state_path, state)
+    journal_file.unlink()
     print("[sync] done")
     return 0
 
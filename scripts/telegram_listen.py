@@ -1,63 +1,33 @@
 #!/usr/bin/env python
 import argparse
-import json
+import asyncio
+import inspect
 import os
+import signal
 import sys
 import time
 from datetime import datetime, timezone
 from pathlib import Path
 
-import yaml
-from telethon import TelegramClient, events
+from batch_writer import FSYNC_POLICIES, BatchWriter
+from config_loader import load_config, resolve_env_value, resolve_path, store_location
+from dedup import open_dedup_writer
+from entity_cache import EntityCache
+from jsonl_store import open_writer
+from listener_gaps import GapTracker
+from listener_metrics import DEFAULT_INTERVAL, ListenerMetrics
+from sync_journal import SyncJournal, journal_path
+from sync_telegram import DEFAULT_CONCURRENCY, fetch_chat, recover_state, save_state, store_file_of, with_flood_retry
 
+SESSION_MODES = ("file", "memory", "string")
 
-def _resolve_env_value(value):
-    if value is None:
-        return None
-    if isinstance(value, str):
-        key = None
-        if value.startswith("${") and value.endswith("}"):
-            key = value[2:-1]
-        elif value.startswith("$"):
-            key = value[1:]
-        if key:
-            return os.environ.get(key)
-    return value
 
-
-def load_config(config_path: Path) -> dict:
-    with config_path.open("r", encoding="utf-8") as f:
-        cfg = yaml.safe_load(f) or {}
-
-    cfg["api_id"] = _resolve_env_value(cfg.get("api_id")) or os.environ.get("TG_API_ID")
-    cfg["api_hash"] = _resolve_env_value(cfg.get("api_hash")) or os.environ.get("TG_API_HASH")
-    cfg["phone"] = _resolve_env_value(cfg.get("phone")) or os.environ.get("TG_PHONE")
-
-    required = ["api_id", "api_hash", "phone", "chats", "output_jsonl"]
-    missing = [k for k in required if k not in cfg]
-    if missing:
-        raise ValueError(f"Missing config keys: {', '.join(missing)}")
-
-    return cfg
-
-
-def resolve_path(config_path: Path, value: str, default_relative: str) -> Path:
-    if value:
-        p = Path(value)
-    else:
-        p = Path(default_relative)
-    if not p.is_absolute():
-        p = config_path.parent / p
-    return p
-
-
-def build_record(msg, chat, run_id):
+def build_record(msg, chat, run_id, sender_username=None):
     chat_id = getattr(chat, "id", None)
     chat_title = getattr(chat, "title", None)
     chat_username = getattr(chat, "username", None)
 
-    sender_username = None
-    if msg.sender:
+    if sender_username is None and msg.sender:
         sender_username = getattr(msg.sender, "username", None)
 
     return {
@@ -82,10 +52,15 @@ def main() -> int:
     parser.add_argument("--config", required=True, help="Path to YAML config file")
     parser.add_argument("--quiet", action="store_true", help="Disable per-message logs")
     parser.add_argument("--verbose", action="store_true", help="Enable per-message logs")
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Also run the initial and incremental sync (state_file) on the same client, instead of sync_telegram.py",
+    )
     args = parser.parse_args()
 
     config_path = Path(args.config).expanduser().resolve()
-    cfg = load_config(config_path)
+    cfg = load_config(config_path, required=["api_id", "api_hash", "phone", "chats", "output_jsonl"])
 
     listener_session = cfg.get("telegram_listener_session_file") or cfg.get("listener_session_file")
     session_path = resolve_path(
@@ -93,7 +68,7 @@ def main() -> int:
         listener_session if listener_session is not None else cfg.get("session_file", ""),
         "data/telegram_listener.session",
     )
-    output_path = resolve_path(config_path, cfg.get("output_jsonl", ""), "data/telegram_messages.jsonl")
+    output_path, segments_dir = store_location(config_path, cfg)
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
     api_id = int(cfg["api_id"])
@@ -101,6 +76,38 @@ def main() -> int:
     phone = cfg["phone"]
     chats = cfg["chats"]
 
+    fsync_policy = str(cfg.get("listener_fsync") or "batch").lower()
+    if fsync_policy not in FSYNC_POLICIES:
+        print(f"listener_fsync must be one of: {', '.join(FSYNC_POLICIES)}", file=sys.stderr)
+        return 2
+    queue_size = int(cfg.get("listener_queue_size") or 10000)
+    batch_size = int(cfg.get("listener_batch_size") or 256)
+    batch_delay = float(cfg.get("listener_batch_ms") or 50) / 1000.0
+    open_out = open_dedup_writer if cfg.get("dedup", True) else open_writer
+    metrics_value = cfg.get("listener_metrics_file")
+    metrics_path = None if metrics_value is False else resolve_path(config_path, metrics_value, "data/telegram_listener.prom")
+    metrics_interval = float(cfg.get("listener_metrics_interval") or DEFAULT_INTERVAL)
+    cache = EntityCache(
+        max_size=int(cfg.get("listener_entity_cache_size") or 2048),
+        ttl=float(cfg.get("listener_entity_ttl") or 3600),
+    )
+    catch_up_gaps = args.sync or cfg.get("listener_catch_up", True) is not False
+    concurrency = int(cfg.get("sync_concurrency") or DEFAULT_CONCURRENCY)
+    session_mode = str(cfg.get("session_mode") or "file").lower()
+    if session_mode not in SESSION_MODES:
+        print(f"session_mode must be one of: {', '.join(SESSION_MODES)}", file=sys.stderr)
+        return 2
+
+    # With --sync, fetches start from the sync state; the first run of a chat
+    # starts at its initial_days cutoff or initial_limit-th newest message.
+    initial_days = None
+    initial_limit = 0
+    state_path = None
+    if args.sync:
+        initial_days = int(cfg["initial_days"]) if cfg.get("initial_days") is not None else None
+        initial_limit = int(cfg.get("initial_limit", 0))
+        state_path = resolve_path(config_path, cfg.get("state_file", ""), "data/telegram_state.json")
+
     env_log = os.environ.get("LISTENER_LOG", "").lower()
     env_quiet = env_log == "quiet"
     env_verbose = env_log == "verbose"
@@ -110,55 +117,285 @@ def main() -> int:
     max_retries = int(os.environ.get("LISTENER_MAX_RETRIES", "5"))
     base_delay = int(os.environ.get("LISTENER_RETRY_SECONDS", "5"))
     auto_reset_lock = os.environ.get("TELEGRAM_RESET_ON_LOCK", "0") in ("1", "true", "yes")
-    fail_streak = 0
-
-    while True:
-        client = TelegramClient(str(session_path), api_id, api_hash)
-
-        @client.on(events.NewMessage(chats=chats))
-        async def handler(event):
-            msg = event.message
-            chat = await event.get_chat()
-            record = build_record(msg, chat, run_id)
-            with output_path.open("a", encoding="utf-8") as out:
-                out.write(json.dumps(record, ensure_ascii=False) + "\n")
-            if log_messages:
-                preview = (record["text"] or "").replace("\n", " ")
-                preview = " ".join(preview.split())[:120]
-                print(f"[telegram] saved message chat={record['chat_id']} id={record['message_id']} text=\"{preview}\"")
 
+    from telethon import TelegramClient, events, utils
+    from telethon.tl.types import MessageActionChatEditTitle
+
+    if session_mode == "file":
+        def make_client():
+            return TelegramClient(str(session_path), api_id, api_hash)
+    else:
+        # The session lives in memory: no SQLite file is written while running.
+        from telethon.sessions import StringSession
+
+        if session_mode == "memory":
+            from telethon.sessions import SQLiteSession
+
+            on_disk = SQLiteSession(str(session_path))
+            session_string = StringSession.save(on_disk)
+            on_disk.close()
+        else:
+            session_string = resolve_env_value(cfg.get("session_string")) or os.environ.get("TG_SESSION_STRING", "")
+        if not session_string:
+            print(
+                f"[telegram] no authorized session for session_mode {session_mode}; "
+                "log in with scripts/telegram_login.py first",
+                file=sys.stderr,
+            )
+            return 2
+
+        def make_client():
+            return TelegramClient(StringSession(session_string), api_id, api_hash)
+
+    gaps = GapTracker()
+    journal = None
+    if args.sync:
+        state = recover_state(state_path)
+
+        def save():
+            """Save the sync state, moved up to what the live stream has persisted."""
+            for chat_id, last_id in dict(gaps.last_ids).items():
+                if last_id > int(state.get(str(chat_id), 0)):
+                    state[str(chat_id)] = last_id
+            save_state(state_path, state)
+
+        journal = SyncJournal(journal_path(state_path), state, run_id, store_file_of(output_path, segments_dir), save)
+
+    async def run() -> int:
+        metrics = ListenerMetrics("telegram")
+        # Handlers wait for this before claiming messages: with --sync, until
+        # every chat's sync has begun.
+        ready = asyncio.Event()
+        if journal is None:
+            ready.set()
+
+        def committed(batch, seconds):
+            metrics.committed(batch, seconds)
+            gaps.committed(batch)
+
+        writer = BatchWriter(
+            lambda: open_out(output_path, segments_dir),
+            max_queue=queue_size,
+            batch_size=batch_size,
+            max_delay=batch_delay,
+            fsync=fsync_policy,
+            on_commit=committed,
+            # Keep going only while messages reach the disk.
+            on_error=lambda exc: request_stop(),
+        )
+        writer.start()
+        metrics.queue_depth = writer.qsize
+
+        def publish_metrics() -> None:
+            if metrics_path is None:
+                return
+            try:
+                metrics.write_file(metrics_path)
+            except OSError as exc:
+                print(f"[telegram] could not write metrics: {exc}", file=sys.stderr)
+
+        async def publish_metrics_every() -> None:
+            while True:
+                await asyncio.sleep(metrics_interval)
+                publish_metrics()
+
+        publisher = asyncio.get_running_loop().create_task(publish_metrics_every())
+
+        stopping = asyncio.Event()
+        current = {}
+
+        def request_stop():
+            stopping.set()
+            client = current.get("client")
+            if client is not None:
+                # Inside the loop, Telethon's disconnect() returns an awaitable
+                # that does nothing until it runs; keep the task so it does.
+                result = client.disconnect()
+                if inspect.isawaitable(result):
+                    current["disconnect"] = asyncio.ensure_future(result)
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, request_stop)
+
+        entities = {}
+
+        async def prewarm(client):
+            for chat in chats:
+                try:
+                    entity = await with_flood_retry(f"chat {chat}", lambda: client.get_entity(chat))
+                    if journal is not None:
+                        gaps.seen(entity.id, int(journal.state.get(str(entity.id), 0)))
+                    elif catch_up_gaps:
+                        # Messages up to the chat's newest one are sync_telegram.py's to fetch.
+                        async def newest_id():
+                            async for msg in client.iter_messages(entity, limit=1):
+                                return msg.id
+                            return 0
+
+                        gaps.seen(entity.id, await with_flood_retry(f"chat {chat}", newest_id))
+                except Exception as exc:
+                    print(f"[telegram] could not resolve {chat}: {exc}", file=sys.stderr)
+                    continue
+                cache.put_chat(utils.get_peer_id(entity), entity)
+                entities[entity.id] = entity
+
+        async def catch_up(client, starts):
+            """Write the history of each (entity, id to fetch after) in `starts`, alongside the live events."""
+            sem = asyncio.Semaphore(concurrency)
+
+            async def catch_up_chat(entity, after):
+                async with sem:
+                    key = str(entity.id)
+                    queued = 0
+
+                    async def commit(records, last_id):
+                        nonlocal queued
+                        records = [r for r in records if gaps.claim(entity.id, r["message_id"])]
+                        queued += len(records)
+                        if journal is not None:
+                            # Journaled like sync_telegram.py's batches, in the writer's thread.
+                            await writer.call(lambda out: journal.write_batch(out, key, records, last_id))
+                            return
+                        for record in records:
+                            await writer.put(record)
+
+                    # A retry fetches the range again; claimed messages are skipped.
+                    fetched_to = await with_flood_retry(
+                        f"chat {entity.id}",
+                        lambda: fetch_chat(client, entity, after, initial_days, initial_limit, run_id, commit),
+                        progress=lambda: queued,
+                    )
+                    return fetched_to, queued
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*(catch_up_chat(e, after) for e, after in starts), return_exceptions=True)
+            await writer.drain()
+            fetched = 0
+            for (entity, _), result in zip(starts, results):
+                if isinstance(result, BaseException):
+                    # Its claimed messages stay claimed; the next reconnect resumes it.
+                    print(f"[telegram] could not fetch the history of chat {entity.id}: {result}", file=sys.stderr)
+                    continue
+                fetched_to, queued = result
+                gaps.finish(entity.id, fetched_to)
+                fetched += queued
+            if journal is not None:
+                await writer.call(lambda out: journal.compact())
+            print(
+                f"[telegram] fetched {fetched} messages from the history of {len(starts)} chats "
+                f"({time.perf_counter() - started:.1f}s)",
+                file=sys.stderr,
+            )
+
+        fail_streak = 0
+        connections = 0
+        warmed = False
         try:
-            client.start(phone=phone)
-            fail_streak = 0
-            print("[telegram] listener started")
-            client.run_until_disconnected()
-            print("[telegram] disconnected", file=sys.stderr)
-        except Exception as exc:
-            msg = str(exc)
-            print(f"[telegram] disconnected: {msg}", file=sys.stderr)
-            if auto_reset_lock and "database is locked" in msg.lower():
+            while not stopping.is_set():
+                client = make_client()
+                current["client"] = client
+
+                @client.on(events.NewMessage(chats=chats))
+                async def handler(event):
+                    started = time.perf_counter()
+                    msg = event.message
+                    if isinstance(msg.action, MessageActionChatEditTitle):
+                        cache.invalidate_chat(event.chat_id)
+                    chat = cache.chat(event.chat_id)
+                    if chat is None:
+                        chat = cache.put_chat(event.chat_id, await event.get_chat())
+                    await ready.wait()
+                    if not gaps.claim(chat.id, msg.id):
+                        return
+                    sender_username = cache.sender_username(msg.sender_id, msg.sender)
+                    record = build_record(msg, chat, run_id, sender_username)
+                    await writer.put(record)
+                    metrics.handler.observe(time.perf_counter() - started)
+                    if log_messages:
+                        preview = (record["text"] or "").replace("\n", " ")
+                        preview = " ".join(preview.split())[:120]
+                        print(f"[telegram] saved message chat={record['chat_id']} id={record['message_id']} text=\"{preview}\"")
+
+                # From here until its catch-up finishes, no commit moves a chat past its gap.
+                starts = [(e, gaps.begin(e.id)) for e in entities.values()] if catch_up_gaps and connections else []
+                try:
+                    await client.start(phone=phone)
+                    if connections:
+                        metrics.reconnects += 1
+                    connections += 1
+                    fail_streak = metrics.fail_streak = 0
+                    metrics.connected = True
+                    publish_metrics()
+                    if not warmed:
+                        await prewarm(client)
+                        warmed = True
+                        if journal is not None:
+                            # The first connection's sync, from the state of each chat.
+                            starts = [(e, gaps.begin(e.id)) for e in entities.values()]
+                            ready.set()
+                    print("[telegram] listener started")
+                    # Live events are flowing again; without --sync the first connection has no gap.
+                    gap = loop.create_task(catch_up(client, starts)) if starts else None
+                    try:
+                        await client.run_until_disconnected()
+                    finally:
+                        if gap is not None:
+                            gap.cancel()
+                    print("[telegram] disconnected", file=sys.stderr)
+                except Exception as exc:
+                    msg = str(exc)
+                    print(f"[telegram] disconnected: {msg}", file=sys.stderr)
+                    if auto_reset_lock and "database is locked" in msg.lower():
+                        try:
+                            lock_path = Path(str(session_path) + "-journal")
+                            if session_path.exists():
+                                session_path.unlink()
+                            if lock_path.exists():
+                                lock_path.unlink()
+                            print("[telegram] session reset due to database lock", file=sys.stderr)
+                        except Exception as reset_exc:
+                            print(f"[telegram] failed to reset session: {reset_exc}", file=sys.stderr)
+                finally:
+                    try:
+                        await client.disconnect()
+                        if "disconnect" in current:
+                            await current.pop("disconnect")
+                    except Exception:
+                        pass
+                    current.pop("client", None)
+                    metrics.connected = False
+                    # Whatever arrived before the disconnect goes to disk now.
+                    await writer.drain()
+                if stopping.is_set():
+                    break
+                fail_streak += 1
+                metrics.fail_streak = fail_streak
+                publish_metrics()
+                if fail_streak >= max_retries:
+                    print("[telegram] max reconnect attempts reached; exiting with error", file=sys.stderr)
+                    return 1
+                delay = base_delay * (2 ** (fail_streak - 1))
+                print(f"[telegram] reconnecting in {delay}s (attempt {fail_streak}/{max_retries})", file=sys.stderr)
                 try:
-                    lock_path = Path(str(session_path) + "-journal")
-                    if session_path.exists():
-                        session_path.unlink()
-                    if lock_path.exists():
-                        lock_path.unlink()
-                    print("[telegram] session reset due to database lock", file=sys.stderr)
-                except Exception as reset_exc:
-                    print(f"[telegram] failed to reset session: {reset_exc}", file=sys.stderr)
+                    await asyncio.wait_for(stopping.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            if writer.error is not None:
+                print("[telegram] stopped: the store could not be written; exiting with error", file=sys.stderr)
+                return 1
+            print("[telegram] stopped", file=sys.stderr)
+            return 0
         finally:
-            try:
-                client.disconnect()
-            except Exception:
-                pass
-        fail_streak += 1
-        if fail_streak >= max_retries:
-            print("[telegram] max reconnect attempts reached; exiting with error", file=sys.stderr)
-            return 1
-        delay = base_delay * (2 ** (fail_streak - 1))
-        print(f"[telegram] reconnecting in {delay}s (attempt {fail_streak}/{max_retries})", file=sys.stderr)
-        time.sleep(delay)
-    return 1
+            publisher.cancel()
+            await writer.close()
+            publish_metrics()
+            if journal is not None:
+                journal.compact()
+                journal.close()
+                journal.path.unlink()
+
+    return asyncio.run(run())
 
 
 if __name__ == "__main__":
@@ -1,61 +1,23 @@
 #!/usr/bin/env python
 import argparse
-import os
 from getpass import getpass
 from pathlib import Path
 
-import yaml
-from telethon import TelegramClient
-from telethon.errors import SessionPasswordNeededError
-
-
-def _resolve_env_value(value):
-    if value is None:
-        return None
-    if isinstance(value, str):
-        key = None
-        if value.startswith("${") and value.endswith("}"):
-            key = value[2:-1]
-        elif value.startswith("$"):
-            key = value[1:]
-        if key:
-            return os.environ.get(key)
-    return value
-
-
-def load_config(config_path: Path) -> dict:
-    with config_path.open("r", encoding="utf-8") as f:
-        cfg = yaml.safe_load(f) or {}
-
-    cfg["api_id"] = _resolve_env_value(cfg.get("api_id")) or os.environ.get("TG_API_ID")
-    cfg["api_hash"] = _resolve_env_value(cfg.get("api_hash")) or os.environ.get("TG_API_HASH")
-    cfg["phone"] = _resolve_env_value(cfg.get("phone")) or os.environ.get("TG_PHONE")
-
-    required = ["api_id", "api_hash"]
-    missing = [k for k in required if not cfg.get(k)]
-    if missing:
-        raise ValueError(f"Missing config keys: {', '.join(missing)}")
-
-    return cfg
-
-
-def resolve_path(config_path: Path, value: str, default_relative: str) -> Path:
-    if value:
-        p = Path(value)
-    else:
-        p = Path(default_relative)
-    if not p.is_absolute():
-        p = config_path.parent / p
-    return p
+from config_loader import load_config, resolve_path
 
 
 def main() -> int:
     parser = argparse.ArgumentParser(description="Interactive Telegram login (create session file).")
     parser.add_argument("--config", required=True, help="Path to YAML config file")
+    parser.add_argument(
+        "--string-session",
+        action="store_true",
+        help="After logging in, print the session as a string for session_mode: string",
+    )
     args = parser.parse_args()
 
     config_path = Path(args.config).expanduser().resolve()
-    cfg = load_config(config_path)
+    cfg = load_config(config_path, nonempty=["api_id", "api_hash"])
 
     listener_session = cfg.get("telegram_listener_session_file") or cfg.get("listener_session_file")
     session_path = resolve_path(
@@ -68,11 +30,22 @@ def main() -> int:
     api_hash = cfg["api_hash"]
     phone = cfg.get("phone") or input("Please enter your phone: ").strip()
 
+    from telethon import TelegramClient
+    from telethon.errors import SessionPasswordNeededError
+
     client = TelegramClient(str(session_path), api_id, api_hash)
     client.connect()
 
+    def print_string_session() -> None:
+        if args.string_session:
+            from telethon.sessions import StringSession
+
+            # A credential: store it like the API hash (e.g. TG_SESSION_STRING in .env).
+            print(StringSession.save(client.session))
+
     if client.is_user_authorized():
         print("[telegram] already authorized")
+        print_string_session()
         client.disconnect()
         return 0
 
@@ -86,6 +59,7 @@ def main() -> int:
             client.sign_in(password=password)
 
     print("[telegram] login successful")
+    print_string_session()
     client.disconnect()
     return 0
 
@@ -1,6 +1,7 @@
 #!/usr/bin/env node
 const fs = require('fs');
 const path = require('path');
+const { performance } = require('perf_hooks');
 const yaml = require('js-yaml');
 const qrcode = require('qrcode-terminal');
 const {
@@ -36,6 +37,129 @@ function ensureDir(p) {
   fs.mkdirSync(p, { recursive: true });
 }
 
+// Mirrors segment_name() in scripts/jsonl_store.py: one segment per UTC day.
+function segmentName(isoDate) {
+  if (!isoDate) return 'undated.jsonl';
+  return `${isoDate.slice(0, 10)}.jsonl`;
+}
+
+// Each record is appended with a fresh O_APPEND open so that files swapped in
+// by scripts/compact_store.py are picked up immediately.
+function createRecordWriter(outputPath, segmentsDir) {
+  if (!segmentsDir) {
+    return (record) => fs.appendFileSync(outputPath, JSON.stringify(record) + '\n');
+  }
+  ensureDir(segmentsDir);
+  return (record) => {
+    fs.appendFileSync(path.join(segmentsDir, segmentName(record.date)), JSON.stringify(record) + '\n');
+  };
+}
+
+// Runtime metrics in Prometheus text format, with the metric names, help texts
+// and buckets of scripts/listener_metrics.py so both listeners read alike.
+const HANDLER_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0];
+const WRITE_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0];
+const LAG_BUCKETS = [0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 86400.0];
+const DEFAULT_METRICS_INTERVAL = 10;
+
+function createHistogram(buckets) {
+  return { buckets, counts: buckets.map(() => 0), sum: 0, count: 0 };
+}
+
+function observe(histogram, value) {
+  histogram.sum += value;
+  histogram.count += 1;
+  const i = histogram.buckets.findIndex((bound) => value <= bound);
+  if (i !== -1) histogram.counts[i] += 1;
+}
+
+function createMetrics(source) {
+  return {
+    source,
+    messages: new Map(),
+    handler: createHistogram(HANDLER_BUCKETS),
+    write: createHistogram(WRITE_BUCKETS),
+    lag: createHistogram(LAG_BUCKETS),
+    reconnects: 0,
+    failStreak: 0,
+    connected: false,
+    lastPersist: 0,
+    rates: new Map(),
+    previous: { at: performance.now(), counts: new Map() },
+  };
+}
+
+// Floats as Python's repr() writes them, so `le` labels match across listeners.
+function promNumber(value) {
+  return Number.isInteger(value) ? value.toFixed(1) : String(value);
+}
+
+function promLabels(labels) {
+  const parts = Object.entries(labels).map(
+    ([k, v]) => `${k}="${String(v).replace(/\\/g, '\\\\').replace(/\n/g, '\\n').replace(/"/g, '\\"')}"`
+  );
+  return `{${parts.join(',')}}`;
+}
+
+function renderMetrics(m) {
+  const now = performance.now();
+  const elapsed = (now - m.previous.at) / 1000;
+  if (elapsed > 0) {
+    m.rates = new Map([...m.messages].map(([chat, n]) => [chat, (n - (m.previous.counts.get(chat) || 0)) / elapsed]));
+  }
+  m.previous = { at: now, counts: new Map(m.messages) };
+
+  const src = m.source;
+  const lines = [];
+  const metric = (name, kind, help, samples) => {
+    lines.push(`# HELP ${name} ${help}`, `# TYPE ${name} ${kind}`, ...samples);
+  };
+  const histogramLines = (name, h) => {
+    const out = [];
+    let cumulative = 0;
+    h.buckets.forEach((bound, i) => {
+      cumulative += h.counts[i];
+      out.push(`${name}_bucket${promLabels({ source: src, le: promNumber(bound) })} ${cumulative}`);
+    });
+    out.push(`${name}_bucket${promLabels({ source: src, le: '+Inf' })} ${h.count}`);
+    out.push(`${name}_sum${promLabels({ source: src })} ${promNumber(h.sum)}`);
+    out.push(`${name}_count${promLabels({ source: src })} ${h.count}`);
+    return out;
+  };
+  const byChat = (map) => [...map].sort(([a], [b]) => (a < b ? -1 : a > b ? 1 : 0));
+  const single = (name, value) => [`${name}${promLabels({ source: src })} ${value}`];
+
+  metric('listener_messages_total', 'counter', 'Records persisted, per chat.',
+    byChat(m.messages).map(([chat, n]) => `listener_messages_total${promLabels({ source: src, chat })} ${n}`));
+  metric('listener_messages_per_second', 'gauge', 'Records persisted per second over the last metrics interval, per chat.',
+    byChat(m.rates).map(([chat, r]) => `listener_messages_per_second${promLabels({ source: src, chat })} ${r.toFixed(3)}`));
+  metric('listener_handler_seconds', 'histogram', 'Time from update to record queued.', histogramLines('listener_handler_seconds', m.handler));
+  metric('listener_write_seconds', 'histogram', 'Time to write, flush and fsync one batch.', histogramLines('listener_write_seconds', m.write));
+  metric('listener_lag_seconds', 'histogram', 'Persist time minus message date.', histogramLines('listener_lag_seconds', m.lag));
+  // Records are appended synchronously, so nothing ever waits.
+  metric('listener_queue_depth', 'gauge', 'Records waiting for the writer.', single('listener_queue_depth', 0));
+  metric('listener_reconnects_total', 'counter', 'Connections after the first one.', single('listener_reconnects_total', m.reconnects));
+  metric('listener_fail_streak', 'gauge', 'Failed connection attempts in a row.', single('listener_fail_streak', m.failStreak));
+  metric('listener_connected', 'gauge', '1 while connected.', single('listener_connected', m.connected ? 1 : 0));
+  metric('listener_last_persist_timestamp_seconds', 'gauge', 'Unix time of the last write.',
+    single('listener_last_persist_timestamp_seconds', m.lastPersist.toFixed(3)));
+  metric('listener_metrics_updated_timestamp_seconds', 'gauge', 'Unix time these metrics were written.',
+    single('listener_metrics_updated_timestamp_seconds', (Date.now() / 1000).toFixed(3)));
+  return lines.join('\n') + '\n';
+}
+
+// Replaced atomically, so readers never see a partial file.
+function writeMetricsFile(m, metricsPath) {
+  try {
+    ensureDir(path.dirname(metricsPath));
+    const tmp = `${metricsPath}.tmp`;
+    fs.writeFileSync(tmp, renderMetrics(m));
+    fs.renameSync(tmp, metricsPath);
+  } catch (err) {
+    console.error(`[whatsapp] could not write metrics: ${err.message}`);
+  }
+}
+
 function toIso(tsSeconds) {
   if (!tsSeconds) return null;
   const ms = Number(tsSeconds) * 1000;
@@ -99,6 +223,23 @@ async function start() {
     'data/whatsapp_auth'
   );
 
+  const segmentsValue = cfg.whatsapp_output_segments_dir || cfg.output_segments_dir || '';
+  const segmentsDir = segmentsValue ? resolvePath(configPath, segmentsValue, segmentsValue) : null;
+
+  const metricsPath = cfg.whatsapp_metrics_file === false
+    ? null
+    : resolvePath(configPath, cfg.whatsapp_metrics_file || '', 'data/whatsapp_listener.prom');
+  const metricsInterval = Number(cfg.listener_metrics_interval || DEFAULT_METRICS_INTERVAL);
+  const metrics = createMetrics('whatsapp');
+  const publishMetrics = () => {
+    if (metricsPath) writeMetricsFile(metrics, metricsPath);
+  };
+  setInterval(publishMetrics, metricsInterval * 1000).unref();
+  process.on('exit', () => {
+    metrics.connected = false;
+    publishMetrics();
+  });
+
   ensureDir(path.dirname(outputPath));
   ensureDir(authDir);
 
@@ -111,11 +252,12 @@ async function start() {
   const maxRetries = Number(process.env.LISTENER_MAX_RETRIES || 5);
   const baseDelayMs = Number(process.env.LISTENER_RETRY_SECONDS || 5) * 1000;
   let attempt = 0;
+  let connections = 0;
   let sock = null;
   let reconnectScheduled = false;
 
   const runId = new Date().toISOString();
-  const stream = fs.createWriteStream(outputPath, { flags: 'a' });
+  const writeRecord = createRecordWriter(outputPath, segmentsDir);
 
   const scheduleReconnect = (reason) => {
     if (reconnectScheduled) return;
@@ -124,6 +266,9 @@ async function start() {
       process.exit(1);
     }
     attempt += 1;
+    metrics.failStreak = attempt;
+    metrics.connected = false;
+    publishMetrics();
     reconnectScheduled = true;
     const delayMs = baseDelayMs * (2 ** (attempt - 1));
     console.log(`[whatsapp] reconnecting in ${delayMs / 1000}s (attempt ${attempt}/${maxRetries})`);
@@ -171,6 +316,11 @@ async function start() {
       if (connection === 'open') {
         console.log('[whatsapp] connected');
         attempt = 0;
+        if (connections > 0) metrics.reconnects += 1;
+        connections += 1;
+        metrics.failStreak = 0;
+        metrics.connected = true;
+        publishMetrics();
       }
     });
 
@@ -178,6 +328,7 @@ async function start() {
       if (type !== 'notify') return; // only new messages
       for (const msg of messages) {
         if (!msg || msg.key?.fromMe) continue; // only incoming
+        const started = performance.now();
 
         const chatId = msg.key?.remoteJid || null;
         if (chatAllowList.length > 0 && chatId && !chatAllowList.includes(chatId)) {
@@ -200,7 +351,16 @@ async function start() {
           run_id: runId,
         };
 
-        stream.write(JSON.stringify(record) + '\\n');
+        const writeStarted = performance.now();
+        writeRecord(record);
+        const persisted = performance.now();
+        observe(metrics.write, (persisted - writeStarted) / 1000);
+        observe(metrics.handler, (persisted - started) / 1000);
+        metrics.lastPersist = Date.now() / 1000;
+        metrics.messages.set(String(chatId), (metrics.messages.get(String(chatId)) || 0) + 1);
+        if (msg.messageTimestamp) {
+          observe(metrics.lag, Math.max(0, metrics.lastPersist - Number(msg.messageTimestamp)));
+        }
         if (logMessages) {
           const preview = (record.text || '').replace(/\\s+/g, ' ').slice(0, 120);
           console.log(`[whatsapp] saved message chat=${chatId} id=${record.message_id} text="${preview}"`);